@@ -0,0 +1,68 @@
+import argparse
+import json
+import sys
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('input', help='absolute or relative filepath of the assembly file to analyze')
+    parser.add_argument('-o', '--output', help='absolute or relative filepath to write the JSON report (default: print it)')
+    parser.add_argument('-l', '--listing', help='absolute or relative filepath to write a listing annotated with cycle costs and block estimates')
+    parser.add_argument('--costs', metavar='FILE', help='JSON file overriding the cycle model: {"costs": {"<opcode>": cycles}, "taken_penalty": n, "default": n}')
+    parser.add_argument('--path', nargs=2, action='append', default=[], metavar=('FROM', 'TO'), help='report the worst case path (in cycles) from label FROM to label TO (repeatable)')
+    parser.add_argument('-O', '--optimize', action='store_true', help='analyze the program as assembled with peephole optimization')
+    parser.add_argument('--no-relax', action='store_true', help='fail on branches whose label is out of range instead of rewriting them around a jump')
+    args = parser.parse_args()
+
+    from assembler.analysis import CycleAnalysis, write_report
+    from assembler.custom_assembler import CONTROL_FLOW_OPCODES, PC_RELATIVE_OPCODES, CustomAssembler, get_cycle_model, get_instruction_set
+    from assembler.exceptions import AssemblerError
+
+    model = get_cycle_model()
+    if args.costs:
+        try:
+            with open(args.costs, 'r') as costs_file:
+                model = model.updated(json.load(costs_file), list(get_instruction_set().keys()))
+        except (OSError, ValueError) as e:
+            print('{}: ERROR: {}'.format(args.costs, e))
+            exit(-1)
+
+    assembler = CustomAssembler()
+    assembler.optimize, assembler.relax = args.optimize, not args.no_relax
+    try:
+        with open(args.input, 'r') as src_file:
+            source_lines = src_file.readlines()
+        ir, aps, words = assembler.build_program(source_lines, args.input)
+    except AssemblerError as e:
+        print(e.tostring())
+        exit(-1)
+    except (OSError, UnicodeDecodeError) as e:
+        print('{}: ERROR: {}'.format(args.input, e))
+        exit(-1)
+
+    analysis = CycleAnalysis(ir, aps.get_symbol_table(), get_instruction_set(), model, CONTROL_FLOW_OPCODES, PC_RELATIVE_OPCODES)
+    paths = []
+    for from_label, to_label in args.path:
+        try:
+            paths.append((from_label, to_label, analysis.worst_path(from_label, to_label)))
+        except KeyError as e:
+            print('{}: ERROR: Unknown code label \'{}\''.format(args.input, e.args[0]))
+            exit(-1)
+
+    report = analysis.to_dict(args.input, paths)
+    if args.output:
+        with open(args.output, 'w') as report_file:
+            write_report(report, report_file)
+    else:
+        write_report(report, sys.stdout)
+    if args.listing:
+        with open(args.listing, 'w') as listing_file:
+            listing_file.writelines(analysis.listing_lines(source_lines, words, args.input))
+
+    for from_label, to_label, path in paths:
+        if path is None:
+            print('PATH: {} -> {}: not reachable'.format(from_label, to_label), file=sys.stderr)
+        else:
+            print('PATH: {} -> {}: {} cycle(s) through {} block(s){}'.format(from_label, to_label, path.cycles, len(path.blocks),
+                                                                           ', entering loop(s) at block(s) {}'.format(', '.join(map(str, path.loops))) if path.loops else ''), file=sys.stderr)
+    if args.output:
+        print('SUCCESS: Analyzed {} instruction(s) in {} block(s) and {} loop(s), report written to {}'.format(len(ir), len(analysis.blocks), len(analysis.loops), args.output))
@@ -1,43 +1,183 @@
 import argparse
 import os
-from pathlib import Path
+import sys
+import time
 
-from assembler.custom_assembler import CustomAssembler
-from assembler.exceptions import AssemblerError, AssemblerException
-
-from bitstring import Bits
-
-from assembler.utils import print_exception, print_info
+from assembler.batch import BatchJob, expand_inputs, run_batch, run_batch_on_daemon
+from assembler.writers import IMAGE_WRITERS
 
 # FIBS-J2
 # MMAABC
 # MACBAM
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
-    parser.add_argument('input', help='absolute or relative filepath to the assembly file to be assembled')
-    parser.add_argument('-o', '--output', help='absolute or relative filepath to write the executable')
-    parser.add_argument('-f', '--format', default='binary', choices=['binary','text'], type=str.lower, help='output file format')
+    parser.add_argument('input', nargs='*', help='absolute or relative filepath(s) or glob pattern(s) of the assembly file(s) to be assembled')
+    parser.add_argument('-o', '--output', help='absolute or relative filepath to write the executable (an existing directory when assembling multiple files)')
+    parser.add_argument('-f', '--format', default='binary', choices=list(IMAGE_WRITERS.keys()), type=str.lower, help='output file format')
+    parser.add_argument('--endian', default='big', choices=['big','little'], type=str.lower, help='byte order of words in binary output files')
+    parser.add_argument('-v', '--verbose', action='count', default=0, help='print an INFO line for every assembled instruction')
+    parser.add_argument('-l', '--listing', action='store_true', help='write a listing file (address, encoding, source) next to each output file')
+    parser.add_argument('--listing-file', metavar='PATH', help='write the listing to PATH instead (single input only, implies --listing)')
+    parser.add_argument('--stream', action='store_true', help='stream the source and output instead of holding them in memory (for very large sources)')
+    parser.add_argument('--mmap', action='store_true', help='memory map the source and only decode lines that hold code (for very large, heavily commented sources)')
+    parser.add_argument('-O', '--optimize', action='store_true', help='remove redundant instructions (peephole optimization) between the passes and report what each rule removed')
+    parser.add_argument('--no-relax', action='store_true', help='fail on branches whose label is out of range instead of rewriting them around a jump')
+    parser.add_argument('-I', '--include-path', action='append', default=[], metavar='DIR', help='search DIR for .include files not found next to the including file (repeatable, searched in order)')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='number of worker processes used to assemble multiple files')
+    parser.add_argument('-p', '--parallel', type=int, default=1, help='number of worker processes used for both passes of very large programs (at most one per CPU)')
+    parser.add_argument('--timings', action='store_true', help='print how long each file took to assemble')
+    parser.add_argument('--cache', metavar='DIR', default=os.environ.get('ASSEMBLER_CACHE_DIR'), help='reuse images of unchanged sources from the build cache in DIR (default: $ASSEMBLER_CACHE_DIR)')
+    parser.add_argument('--cache-size', type=int, default=256, help='build cache size limit in MB (least recently used entries are evicted)')
+    parser.add_argument('--cache-stats', action='store_true', help='print build cache hit/miss statistics')
+    parser.add_argument('--stats', action='store_true', help='print wall time and call counts per phase, preprocessor step and opcode')
+    parser.add_argument('--stats-memory', action='store_true', help='with --stats, also record the tracemalloc peak of every phase (much slower)')
+    parser.add_argument('--profile', metavar='FILE', help='run the assembler under cProfile and dump the profile to FILE (for pstats/snakeviz)')
+    parser.add_argument('--serve', metavar='SOCKET', help='run a persistent assembler daemon listening on the Unix domain socket SOCKET')
+    parser.add_argument('--workers', type=int, default=2, help='(--serve) number of requests assembled concurrently')
+    parser.add_argument('--max-pending', type=int, default=64, help='(--serve) number of requests in flight before clients are told to back off')
+    parser.add_argument('--daemon', metavar='SOCKET', help='send the inputs to the assembler daemon listening on SOCKET instead of assembling them in this process')
+    parser.add_argument('--watch', action='store_true', help='keep running and reassemble the input whenever it (or a file it includes) changes, redoing only the edited lines when labels don\'t move')
     args = parser.parse_args()
+    args.listing = args.listing or args.listing_file is not None
+
+    if args.serve:
+        from assembler.daemon import AssemblerDaemon
+        print('Assembler daemon listening on {}'.format(args.serve))
+        AssemblerDaemon(args.serve, args.workers, args.max_pending).run()
+        exit(0)
+
+    if not args.input:
+        parser.error('at least one input is required')
+    if args.daemon and (args.stream or args.mmap or args.verbose or args.optimize):
+        parser.error('--daemon can\'t be combined with --stream, --mmap, --verbose or --optimize')
+    if args.daemon and (args.stats or args.profile):
+        parser.error('--stats and --profile measure this process and can\'t be combined with --daemon')
+    if args.profile and args.jobs > 1:
+        parser.error('--profile can\'t be combined with --jobs (worker processes aren\'t profiled)')
 
-    isBinaryFormat: bool = args.format == 'binary'
+    if args.stream and (args.listing or args.verbose or args.optimize):
+        parser.error('--stream can\'t be combined with --listing, --verbose or --optimize')
+    if args.mmap and (args.stream or args.listing or args.verbose):
+        parser.error('--mmap can\'t be combined with --stream, --listing or --verbose')
+    if args.watch and (args.stream or args.mmap or args.daemon or args.listing or args.verbose or args.parallel > 1 or args.stats or args.profile):
+        parser.error('--watch can\'t be combined with --stream, --mmap, --daemon, --listing, --verbose, --parallel, --stats or --profile')
+    if args.jobs < 1:
+        parser.error('--jobs must be at least 1')
+    if args.parallel < 1:
+        parser.error('--parallel must be at least 1')
+    if args.parallel > 1 and args.jobs > 1:
+        parser.error('--parallel can\'t be combined with --jobs (use --jobs for many files, --parallel for one large file)')
 
-    assembler = CustomAssembler()
-    try:
-        executable_data: Bits = assembler.assemble_file(args.input)
-    except AssemblerError as e:
-        print_exception(e)
+    unmatched = []
+    inputs = expand_inputs(args.input, unmatched)
+    for pattern in unmatched:
+        print('{}: ERROR: No files match the pattern.'.format(pattern))
+    if not inputs:
         exit(-1)
 
-    output_filepath = args.output if args.output else Path(args.input).stem + ('.o' if isBinaryFormat else '.txt')
+    multiple = len(inputs) > 1
+    if multiple and args.output and not os.path.isdir(args.output):
+        parser.error('--output must be an existing directory when assembling multiple files')
+    if multiple and args.listing_file:
+        parser.error('--listing-file can only be given for a single input')
+    if multiple and args.watch:
+        parser.error('--watch takes a single input')
+
+    extension = IMAGE_WRITERS[args.format].EXTENSION
+    jobs = []
+    for input_path in inputs:
+        output_filepath = os.path.splitext(os.path.basename(input_path))[0] + extension
+        if args.output:
+            output_filepath = os.path.join(args.output, output_filepath) if multiple else args.output
+        listing_filepath = None
+        if args.listing:
+            listing_filepath = args.listing_file or os.path.splitext(output_filepath)[0] + '.lst'
+        jobs.append(BatchJob(input_path, output_filepath, args.format, args.endian, listing_filepath, args.stream, args.verbose, args.cache, args.cache_size << 20, args.stats or args.stats_memory, args.stats_memory, args.parallel, args.mmap, args.optimize, not args.no_relax, [os.path.abspath(path) for path in args.include_path]))
+
+    output_paths = [job.output_path for job in jobs]
+    if len(set(output_paths)) != len(output_paths):
+        parser.error('multiple inputs would be written to the same output file (inputs with the same name)')
+
+    if args.watch:
+        from assembler.custom_assembler import CustomAssembler
+        from assembler.exceptions import AssemblerError
+        from assembler.incremental import IncrementalAssembler
+        job = jobs[0]
+        assembler = CustomAssembler()
+        assembler.optimize, assembler.relax, assembler.include_paths = job.optimize, job.relax, job.include_paths
+        watcher = IncrementalAssembler(assembler, job.input_path, job.output_path, job.format, job.byteorder)
+        print('WATCH: Reassembling {} whenever it changes (Ctrl+C to stop)'.format(job.input_path), flush=True)
+        try:
+            while True:
+                start = time.perf_counter()
+                try:
+                    build = watcher.build()
+                except AssemblerError as e:
+                    print(e.tostring(), flush=True)
+                except (OSError, UnicodeDecodeError) as e:
+                    print('{}: ERROR: {}'.format(job.input_path, e), flush=True)
+                else:
+                    print('SUCCESS: Assembled program written to {} ({}, {} of {} word(s) rewritten, {} in {:.1f} ms)'.format(job.output_path, args.format,
+                          sum(end - first for first, end in build.changed), build.words, 'edited lines only' if build.incremental else 'both passes', (time.perf_counter() - start) * 1000), flush=True)
+                watcher.wait()
+        except KeyboardInterrupt:
+            exit(0)
 
-    # wb = write binary
-    if isBinaryFormat:
-        with open(output_filepath, 'wb') as executable:
-            for instr in executable_data:
-                executable.write(instr.bytes)
+    if args.daemon:
+        from assembler.daemon_client import DaemonError
+        try:
+            results = run_batch_on_daemon(jobs, args.daemon)
+        except (OSError, DaemonError) as e:
+            print('ERROR: Failed to assemble with the daemon at {}: {}'.format(args.daemon, e))
+            exit(-1)
+    elif args.profile:
+        import cProfile
+        profile = cProfile.Profile()
+        results = profile.runcall(run_batch, jobs, args.jobs)
+        profile.dump_stats(args.profile)
     else:
-        with open(output_filepath, 'w') as executable:
-            for instr in executable_data:
-                executable.write(instr.bin + '\n')
+        results = run_batch(jobs, args.jobs)
 
-    print('SUCCESS: Assembled program written to {} ({})'.format(output_filepath, args.format))
\ No newline at end of file
+    # Report in input order, regardless of which worker finished first
+    failures = 0
+    for result in results:
+        sys.stdout.write(result.output)
+        if result.success:
+            print('SUCCESS: Assembled program written to {} ({})'.format(result.job.output_path, args.format))
+            for branch in result.relaxed_branches:
+                print('RELAX: {}:{}: {} to \'{}\' (displacement {}) rewritten into {} words: {} instructions when taken, {} when not'.format(
+                    result.job.input_path, branch.lineno + 1, branch.opcode, branch.symbol, branch.displacement, branch.words, branch.taken, branch.not_taken))
+            if result.peephole_stats is not None:
+                removed = ['{} {}'.format(name, count) for name, count in result.peephole_stats.items() if count]
+                print('OPTIMIZE: Removed {} instruction(s) from {}{}'.format(sum(result.peephole_stats.values()), result.job.input_path, ' ({})'.format(', '.join(removed)) if removed else ''))
+        else:
+            failures += 1
+
+    if args.timings:
+        print('{:>10s} {:>10s}  {}'.format('time (ms)', 'words', 'file'))
+        for result in results:
+            print('{:>10.2f} {:>10d}  {}{}'.format(result.seconds * 1000, result.words, result.job.input_path, '' if result.success else ' (FAILED)'))
+        print('{:>10.2f} {:>10d}  total'.format(sum(result.seconds for result in results) * 1000, sum(result.words for result in results)))
+
+    if args.stats or args.stats_memory:
+        from assembler.profiling import format_stats, merge_stats
+        total = {}
+        for result in results:
+            if result.stats:
+                merge_stats(total, result.stats)
+        for line in format_stats(total):
+            print('STATS: ' + line)
+
+    if args.profile:
+        print('PROFILE: cProfile stats written to {} (python -m pstats {})'.format(args.profile, args.profile))
+
+    if args.cache_stats and args.cache:
+        from assembler.cache import BuildCache
+        hits = sum(1 for result in results if result.cached)
+        misses = sum(1 for result in results if result.cached is False)
+        print('CACHE: {} hit(s), {} miss(es), {:.1f} of {} MB used in {}'.format(hits, misses, BuildCache(args.cache, args.cache_size << 20).size() / (1 << 20), args.cache_size, args.cache))
+
+    if failures + len(unmatched):
+        if multiple or unmatched:
+            print('FAILED: {} of {} file(s) failed to assemble'.format(failures + len(unmatched), len(inputs) + len(unmatched)))
+        exit(-1)
@@ -0,0 +1,391 @@
+from array import array
+from typing import Any, Dict, IO, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+from assembler.ir import InstructionIR
+from assembler.isa import InstructionSet
+from assembler.relocation import branch_target, displacement_fields
+from assembler.state import SymbolTable
+
+# How an instruction transfers control (see CycleAnalysis); instructions that aren't listed fall through
+FLOW_BRANCH   = 'branch'   # PC relative conditional branch: goes to its target or falls through
+FLOW_JUMP     = 'jump'     # PC relative unconditional jump
+FLOW_CALL     = 'call'     # jump through a register that comes back to the next instruction (the callee isn't counted)
+FLOW_INDIRECT = 'indirect' # jump through a register to a target that isn't known statically (ex. a return)
+FLOW_HALT     = 'halt'     # stops the processor
+
+ControlFlowTable = Dict[str, str] # FLOW_* of every control transfer opcode, by opcode name
+
+
+'''
+Cycle cost of every opcode (opcodes that aren't listed cost default), plus taken_penalty extra cycles
+whenever a branch or jump is taken (ex. the instructions a pipeline flushes).
+'''
+class CycleModel(NamedTuple):
+    costs: Dict[str, int]
+    taken_penalty: int = 0
+    default: int = 1
+
+    def cost(self, opcode_name: str) -> int:
+        return self.costs.get(opcode_name, self.default)
+
+    '''
+    Returns a copy with the settings of a JSON object ({"costs": {"<opcode>": cycles}, "taken_penalty": n,
+    "default": n}, every key optional) applied. Raises ValueError on unknown keys or opcodes.
+    '''
+    def updated(self, settings: Dict[str, Any], opcode_names: Sequence[str]) -> 'CycleModel':
+        unknown = set(settings) - {'costs', 'taken_penalty', 'default'}
+        if unknown:
+            raise ValueError('Unknown cycle model setting(s) {}'.format(', '.join(sorted(unknown))))
+        costs = dict(self.costs)
+        for name, cycles in settings.get('costs', {}).items():
+            if name.upper() not in opcode_names:
+                raise ValueError('Unknown opcode \'{}\' in cycle costs'.format(name))
+            costs[name.upper()] = int(cycles)
+        return CycleModel(costs, int(settings.get('taken_penalty', self.taken_penalty)), int(settings.get('default', self.default)))
+
+'''
+Instructions [start, end) that always run in sequence. cycles is what running them costs; successors
+holds the (block index, taken) of every block control can go to next, where taken edges cost the
+model's taken_penalty on top. flow is the FLOW_* of the last instruction (None if it falls through).
+'''
+class BasicBlock(NamedTuple):
+    start: int
+    end: int
+    labels: List[str]
+    cycles: int
+    flow: Optional[str]
+    successors: List[Tuple[int, bool]]
+
+'''
+A loop: the blocks of every back edge to header, and the cycles of its slowest iteration (from entering
+the header to taking a back edge, inner loops run once).
+'''
+class Loop(NamedTuple):
+    header: int
+    blocks: List[int]
+    iteration_cycles: int
+
+'''
+The slowest path from one block to another (inner loops run once), the cycles it takes until control
+reaches the last block (which isn't counted), and the headers of the loops it enters.
+'''
+class CyclePath(NamedTuple):
+    blocks: List[int]
+    cycles: int
+    loops: List[int]
+
+
+'''
+Static cycle estimate of an assembled program. The IR's instructions are split into basic blocks at
+labels, branch and jump targets and after every control transfer (see ControlFlowTable); the blocks
+and the edges between them form the control flow graph, from which loops (natural loops of back edges)
+and worst case paths are found. Estimates assume every instruction costs what the model says and
+every taken branch or jump pays its penalty; nothing is known about how many times loops iterate, so
+per loop figures are per iteration and paths run every loop they enter once.
+
+Blocks that can't be reached from the first instruction (ex. subroutines only called through a
+register) are analyzed as if control could start there.
+'''
+class CycleAnalysis(object):
+
+    def __init__(self, ir: InstructionIR, sym_table: SymbolTable, instr_set: InstructionSet, model: CycleModel,
+                 control_flow: ControlFlowTable, pc_relative: Sequence[str]):
+        self.ir = ir
+        self.model = model
+        self.sym_table = sym_table
+        num_instrs = len(ir)
+        opcode_names = ir.opcode_names
+        flows = [control_flow.get(name) for name in opcode_names]
+        costs = [model.cost(name) for name in opcode_names]
+        fields = displacement_fields(instr_set, pc_relative)
+
+        # Branch and jump targets inside the program (a target outside it leaves no edge)
+        self.targets: Dict[int, int] = {}
+        leaders = {0} if num_instrs else set()
+        self.labels: Dict[int, List[str]] = {}
+        for name, addr in sym_table.items():
+            if 0 <= addr < num_instrs:
+                self.labels.setdefault(addr, []).append(name)
+                leaders.add(addr)
+        opcodes = ir.opcodes
+        for index in range(num_instrs):
+            flow = flows[opcodes[index]]
+            if flow is None: continue
+            if flow == FLOW_BRANCH or flow == FLOW_JUMP:
+                target = branch_target(ir, index, fields[opcodes[index]], sym_table)
+                if target is not None and 0 <= target < num_instrs:
+                    self.targets[index] = target
+                    leaders.add(target)
+            if index + 1 < num_instrs:
+                leaders.add(index + 1)
+
+        self.blocks: List[BasicBlock] = []
+        self.block_of = array('I', bytes(4 * num_instrs)) # block index of every instruction
+        starts = sorted(leaders)
+        for block_index, start in enumerate(starts):
+            end = starts[block_index + 1] if block_index + 1 < len(starts) else num_instrs
+            for index in range(start, end):
+                self.block_of[index] = block_index
+            self.blocks.append(BasicBlock(start, end, sorted(self.labels.get(start, [])), sum(costs[opcodes[index]] for index in range(start, end)),
+                                          flows[opcodes[end - 1]], []))
+        for block_index, block in enumerate(self.blocks):
+            last = block.end - 1
+            if block.flow in (FLOW_BRANCH, FLOW_JUMP) and last in self.targets:
+                block.successors.append((self.block_of[self.targets[last]], True))
+            if block.flow in (None, FLOW_BRANCH, FLOW_CALL) and block.end < num_instrs:
+                block.successors.append((block_index + 1, False))
+
+        self.__order_blocks()
+        self.loops: List[Loop] = self.__find_loops()
+        self.loop_of_header: Dict[int, Loop] = { loop.header: loop for loop in self.loops }
+
+    '''
+    Returns the cycles of a block plus the penalty of leaving it through a (taken) edge.
+    '''
+    def edge_cycles(self, block_index: int, taken: bool) -> int:
+        return self.blocks[block_index].cycles + (self.model.taken_penalty if taken else 0)
+
+    '''
+    Numbers the blocks in reverse postorder of a depth first search (from the first block, then from every
+    block not reached yet, in address order) and computes their immediate dominators. An edge to a
+    block that isn't later in that order is a retreating edge; without them the graph is acyclic.
+    '''
+    def __order_blocks(self):
+        num_blocks = len(self.blocks)
+        root = num_blocks # virtual root, the predecessor of every block a search starts from
+        visited = bytearray(num_blocks)
+        postorder = []
+        roots = []
+        for start in range(num_blocks):
+            if visited[start]: continue
+            roots.append(start)
+            visited[start] = 1
+            stack = [(start, iter(self.blocks[start].successors))]
+            while stack:
+                block_index, successors = stack[-1]
+                for successor, taken in successors:
+                    if not visited[successor]:
+                        visited[successor] = 1
+                        stack.append((successor, iter(self.blocks[successor].successors)))
+                        break
+                else:
+                    stack.pop()
+                    postorder.append(block_index)
+        self.order: List[int] = postorder[::-1]
+        self.rank = array('I', bytes(4 * (num_blocks + 1))) # position of every block in order (the root is first)
+        for position, block_index in enumerate(self.order, 1):
+            self.rank[block_index] = position
+        self.rank[root] = 0
+
+        # Immediate dominators (Cooper, Harvey and Kennedy's iterative algorithm)
+        predecessors: List[List[int]] = [[] for _ in range(num_blocks)]
+        for block_index, block in enumerate(self.blocks):
+            for successor, taken in block.successors:
+                predecessors[successor].append(block_index)
+        for start in roots:
+            predecessors[start].append(root)
+        self.predecessors = predecessors
+        rank = self.rank
+        idom = [-1] * (num_blocks + 1)
+        idom[root] = root
+        def intersect(a: int, b: int) -> int:
+            while a != b:
+                while rank[a] > rank[b]: a = idom[a]
+                while rank[b] > rank[a]: b = idom[b]
+            return a
+        changed = True
+        while changed:
+            changed = False
+            for block_index in self.order:
+                new_idom = -1
+                for predecessor in predecessors[block_index]:
+                    if idom[predecessor] == -1: continue
+                    new_idom = predecessor if new_idom == -1 else intersect(predecessor, new_idom)
+                if idom[block_index] != new_idom:
+                    idom[block_index] = new_idom
+                    changed = True
+        self.idom = idom
+
+        # Entry and exit times of a walk of the dominator tree, so a dominates b when a's interval holds b's
+        children: List[List[int]] = [[] for _ in range(num_blocks + 1)]
+        for block_index in self.order:
+            children[idom[block_index]].append(block_index)
+        self.dom_entry, self.dom_exit = array('I', bytes(4 * (num_blocks + 1))), array('I', bytes(4 * (num_blocks + 1)))
+        clock = 0
+        stack = [(root, iter(children[root]))]
+        while stack:
+            block_index, block_children = stack[-1]
+            child = next(block_children, None)
+            if child is None:
+                stack.pop()
+                self.dom_exit[block_index] = clock
+            else:
+                clock += 1
+                self.dom_entry[child] = clock
+                stack.append((child, iter(children[child])))
+            clock += 1
+
+    '''
+    Returns True if every path from where control starts to block b goes through block a.
+    '''
+    def dominates(self, a: int, b: int) -> bool:
+        return self.dom_entry[a] <= self.dom_entry[b] and self.dom_exit[b] <= self.dom_exit[a]
+
+    '''
+    Longest (most cycles) paths from the first of blocks (given in order) over forward edges between them.
+    Returns the cycles to reach every block that is reached and the block each was reached from.
+    '''
+    def __longest_paths(self, blocks: Sequence[int], allowed: Optional[set] = None) -> Tuple[Dict[int, int], Dict[int, int]]:
+        rank = self.rank
+        cycles, came_from = { blocks[0]: 0 }, {}
+        for block_index in blocks:
+            if block_index not in cycles: continue
+            for successor, taken in self.blocks[block_index].successors:
+                if rank[successor] <= rank[block_index] or (allowed is not None and successor not in allowed): continue
+                reached = cycles[block_index] + self.edge_cycles(block_index, taken)
+                if reached > cycles.get(successor, -1):
+                    cycles[successor], came_from[successor] = reached, block_index
+        return cycles, came_from
+
+    def __find_loops(self) -> List[Loop]:
+        back_edges: Dict[int, List[Tuple[int, bool]]] = {}
+        for block_index, block in enumerate(self.blocks):
+            for successor, taken in block.successors:
+                if self.rank[successor] <= self.rank[block_index] and self.dominates(successor, block_index):
+                    back_edges.setdefault(successor, []).append((block_index, taken))
+        loops = []
+        for header in sorted(back_edges, key=lambda block_index: self.blocks[block_index].start):
+            body = {header}
+            worklist = [source for source, taken in back_edges[header]]
+            while worklist:
+                block_index = worklist.pop()
+                if block_index in body: continue
+                body.add(block_index)
+                worklist.extend(predecessor for predecessor in self.predecessors[block_index] if predecessor < len(self.blocks))
+            cycles, came_from = self.__longest_paths(sorted(body, key=self.rank.__getitem__), body)
+            iteration = max(cycles[source] + self.edge_cycles(source, taken) for source, taken in back_edges[header] if source in cycles)
+            loops.append(Loop(header, sorted(body), iteration))
+        return loops
+
+    '''
+    Returns the slowest path from the block starting at label from_label to the one starting at label
+    to_label, or None if there's no path (going around no loop more than once). Raises KeyError if
+    either label isn't in the program.
+    '''
+    def worst_path(self, from_label: str, to_label: str) -> Optional[CyclePath]:
+        start, end = self.block_of[self.__label_address(from_label)], self.block_of[self.__label_address(to_label)]
+        if start == end:
+            return CyclePath([start], 0, [])
+        cycles, came_from = self.__longest_paths(self.order[self.rank[start] - 1:])
+        if end not in cycles:
+            return None
+        blocks = [end]
+        while blocks[-1] != start:
+            blocks.append(came_from[blocks[-1]])
+        blocks.reverse()
+        return CyclePath(blocks, cycles[end], [block_index for block_index in blocks if block_index in self.loop_of_header])
+
+    def __label_address(self, label: str) -> int:
+        addr = self.sym_table[label]
+        if not 0 <= addr < len(self.ir):
+            raise KeyError(label)
+        return addr
+
+    '''
+    Returns the analysis (and the given paths, as (from label, to label, CyclePath or None)) as plain
+    data for a JSON report. Line numbers are 1-based.
+    '''
+    def to_dict(self, filename: str = None, paths: Sequence[Tuple[str, str, Optional[CyclePath]]] = ()) -> Dict[str, Any]:
+        linenos = self.ir.linenos
+        def block_name(block_index: int) -> str:
+            block = self.blocks[block_index]
+            return block.labels[0] if block.labels else '{:04x}'.format(block.start)
+        return {
+            'file': filename,
+            'instructions': len(self.ir),
+            'model': { 'default': self.model.default, 'taken_penalty': self.model.taken_penalty, 'costs': dict(sorted(self.model.costs.items())) },
+            'blocks': [{
+                'id': block_index,
+                'name': block_name(block_index),
+                'start': block.start,
+                'end': block.end,
+                'labels': block.labels,
+                'lines': [linenos[block.start] + 1, linenos[block.end - 1] + 1],
+                'instructions': block.end - block.start,
+                'cycles': block.cycles,
+                'flow': block.flow,
+                'successors': [{ 'block': successor, 'taken': taken, 'penalty': self.model.taken_penalty if taken else 0 } for successor, taken in block.successors],
+            } for block_index, block in enumerate(self.blocks)],
+            'loops': [{
+                'header': loop.header,
+                'name': block_name(loop.header),
+                'blocks': loop.blocks,
+                'iteration_cycles': loop.iteration_cycles,
+            } for loop in self.loops],
+            'paths': [{
+                'from': from_label,
+                'to': to_label,
+                'blocks': path.blocks if path else None,
+                'cycles': path.cycles if path else None,
+                'loops': path.loops if path else None,
+            } for from_label, to_label, path in paths],
+        }
+
+    '''
+    Annotated listing: every instruction with its address, encoding and cycle cost, and a comment before
+    the first instruction of every block with its estimate (and the iteration estimate of loops it heads).
+    '''
+    def listing_lines(self, source_lines: Sequence[str], words: Sequence[int], filename: str = None) -> Iterator[str]:
+        ir, model = self.ir, self.model
+        yield '; {}\n'.format(filename)
+        yield 'ADDR  WORD  CYC   LINE  SOURCE\n'
+        index = 0
+        num_instrs = len(ir)
+        linenos = ir.linenos
+        for lineno, line in enumerate(source_lines):
+            source = line.rstrip('\r\n')
+            if index < num_instrs and linenos[index] == lineno:
+                first = True
+                while index < num_instrs and linenos[index] == lineno: # more than one for a relaxed branch
+                    block_index = self.block_of[index]
+                    block = self.blocks[block_index]
+                    if block.start == index:
+                        yield from self.__block_comments(block_index)
+                    cycles = model.cost(ir.opcode_name(index))
+                    if first:
+                        yield '{:04x}  {:04x}  {:3d}  {:5d}  {}\n'.format(index, words[index], cycles, lineno + 1, source)
+                        first = False
+                    else:
+                        yield '{:04x}  {:04x}  {:3d}\n'.format(index, words[index], cycles)
+                    index += 1
+            else:
+                yield '{:15s}  {:5d}  {}\n'.format('', lineno + 1, source)
+
+    def __block_comments(self, block_index: int) -> Iterator[str]:
+        block, penalty = self.blocks[block_index], self.model.taken_penalty
+        successors = ', '.join('{}{}'.format(successor, ' (taken +{})'.format(penalty) if taken else '') for successor, taken in block.successors)
+        yield '; block {}: {} instruction(s), {} cycle(s){}{}\n'.format(block_index, block.end - block.start, block.cycles,
+                                                                     ' -> ' + successors if successors else '', ' [{}]'.format(block.flow) if block.flow else '')
+        loop = self.loop_of_header.get(block_index)
+        if loop is not None:
+            yield '; loop {}: {} block(s), {} cycle(s) per iteration\n'.format(block_index, len(loop.blocks), loop.iteration_cycles)
+
+
+'''
+Writes a report (see CycleAnalysis.to_dict()) as JSON with every block, loop and path on a line of its
+own: readable and diffable, and much faster to write for large programs than indenting everything.
+'''
+def write_report(report: Dict[str, Any], fp: IO):
+    from json import JSONEncoder
+    encode = JSONEncoder().encode
+    fp.write('{\n')
+    for key_index, (key, value) in enumerate(report.items()):
+        fp.write('  {}: '.format(encode(key)))
+        if isinstance(value, list) and value:
+            fp.write('[\n')
+            fp.write(',\n'.join('    ' + encode(item) for item in value))
+            fp.write('\n  ]')
+        else:
+            fp.write(encode(value))
+        fp.write(',\n' if key_index + 1 < len(report) else '\n')
+    fp.write('}\n')
@@ -1,29 +1,106 @@
-from abc import abstractmethod
-from bitstring import Bits
-from typing import Dict, Any, List
-
-from prometheus_client import Enum
-
-from assembler.preprocessor import PreprocessorTask
+import io
+import os
+import sys
+from array import array
+from contextlib import contextmanager
+from typing import Callable, Dict, Any, Iterable, Iterator, List, Optional, Sequence, Set, Tuple, Union, TYPE_CHECKING
 
 from assembler.isa import *
 from assembler.state import *
+from assembler.defines import DefineTable, WORD_TOKEN_RE
 from assembler.exceptions import AssemblerWarning, AssemblerError
+from assembler.ir import InstructionIR
+from assembler.listing import Listing, VERBOSITY_QUIET, VERBOSITY_INFO
+from assembler.profiling import Profiler, PHASE_READ, PHASE_PASS1, PHASE_OPTIMIZE, PHASE_RELAX, PHASE_PASS2, profile_phase
+from assembler.parallel import PARALLEL_PASS1_MIN_LINES, PARALLEL_PASS2_MIN_INSTRUCTIONS
 
 from assembler.preprocessor import preprocessor
 from assembler.synthesis import Synthesizer
 
+if TYPE_CHECKING:
+    from bitstring import Bits
+    from assembler.cache import BuildCache, CacheEntry
+    from assembler.includes import IncludeUnit
+    from assembler.peephole import PeepholeOptimizer
+    from assembler.relaxation import BranchRelaxer, RelaxedBranch
+    from assembler.stream import MappedSource
+
+# Part of every build cache key; bump it whenever a change to the assembler changes its output
+ASSEMBLER_VERSION = '2.0'
+
 
 class Assembler(object):
     
-    def __init__(self, preprocessor: preprocessor, synthesizer: Synthesizer):
+    def __init__(self, preprocessor: preprocessor, synthesizer: Synthesizer, verbosity: int = VERBOSITY_QUIET):
         self.__preprocessor = preprocessor
         self.__synthesizer = synthesizer
+        self.verbosity = verbosity
+        self.profiler: Optional[Profiler] = None # set to record per phase stats (see assembler.profiling)
+        self.parallel: int = 1                   # worker processes used for both passes of large programs
+        self.parallel_threshold: int = PARALLEL_PASS2_MIN_INSTRUCTIONS
+        self.parallel_lines_threshold: int = PARALLEL_PASS1_MIN_LINES
+        self.included_files: List[str] = []      # files besides the source the last assemble_lines() read (.include sources, .incbin data)
+        self.include_paths: List[str] = []       # directories searched for .include files after the including file's own
+        self.peephole: Optional['PeepholeOptimizer'] = None # removes redundant instructions between the passes if optimize is set
+        self.optimize: bool = False
+        self.peephole_stats: Optional[Dict[str, int]] = None # instructions each peephole rule removed in the last assembly (None if it didn't run)
+        self.relaxer: Optional['BranchRelaxer'] = None # rewrites branches whose label is out of range if relax is set
+        self.relax: bool = True
+        self.relaxed_branches: List['RelaxedBranch'] = [] # branches relaxed in the last assembly
+
+    def assemble(self, source_str: str, filename: str = None, as_words: bool = False, listing: Listing = None) -> Union[List['Bits'], array]:
+        return self.assemble_lines(source_str.splitlines(), filename, as_words, listing)
+
+    '''
+    Assembles the source code lines into machine code. Instructions are encoded as plain ints;
+    by default they're converted to a list of Bits (one per instruction) for backward compatibility.
+    If as_words is set, the machine code is returned as an array('H') of instruction words instead.
+    If a listing is given, it's filled in so it can be written out afterwards.
+    '''
+    def assemble_lines(self, source_lines: List[str], filename: str = None, as_words: bool = False, listing: Listing = None) -> Union[List['Bits'], array]:
+        if listing is None and self.verbosity >= VERBOSITY_INFO:
+            listing = Listing()
+        processed_lines = [] if listing is not None else None # only kept for the listing; formatted later
+
+        ir, aps, text_segment = self.build_program(source_lines, filename, processed_lines)
+        self.included_files = [filepath for filepath, _ in aps.included] + aps.data.files()
+
+        if listing is not None:
+            listing.filename = filename
+            listing.source_lines = source_lines
+            listing.instr_lines = processed_lines
+            listing.words = text_segment
+            listing.linenos = ir.linenos
+            listing.data_lines = { lineno: len(ir) + offset for lineno, offset in aps.data.lines }
+            if self.verbosity >= VERBOSITY_INFO:
+                sys.stdout.writelines(listing.info_lines())
+
+        #text_segment.byteswap() # change endianness of the machine code
+        if as_words:
+            return text_segment
+        from bitstring import Bits
+        word_length = self.__synthesizer.word_length
+        return [Bits(uint=word, length=word_length) for word in text_segment]
 
-    def assemble(self, source_str: str, filename: str = None) -> List[Bits]:
-        return self.assemble_lines(source_str.splitlines(), filename)
+    '''
+    Runs every pass over the source code lines and returns the final IR (after peephole optimization and
+    branch relaxation), the pass state (with the final symbol table) and the image words. The words are
+    the IR's instructions in order, followed by the DATA segment. If processed_lines is given, the
+    preprocessed text of every line is appended to it. If comment_lines is given, the line numbers at
+    which a block comment is open are appended to it (see build_ir()).
+    '''
+    def build_program(self, source_lines: List[str], filename: str = None, processed_lines: List[str] = None, comment_lines: array = None) -> Tuple[InstructionIR, AssemblerPassState, array]:
+        profiler = self.profiler
+        with self.__profiling():
+            with profile_phase(profiler, PHASE_PASS1):
+                ir, aps = self.build_ir(source_lines, filename, processed_lines, comment_lines)
+            ir = self.optimize_ir(ir, aps)
+            ir = self.relax_ir(ir, aps, source_lines)
+            with profile_phase(profiler, PHASE_PASS2):
+                words = self.synthesize_ir(ir, aps, source_lines)
+        return ir, aps, words
 
-    def assemble_lines(self, source_lines: List[str], filename: str = None) -> List[Bits]:
+    def __begin_pass(self, filename: str) -> AssemblerPassState:
         if not self.__preprocessor or not self.__synthesizer:
             raise ValueError('Assembler must have a preprocessor and synthesizer! One or both were not set in the constructor.')
 
@@ -34,34 +111,437 @@ class Assembler(object):
         aps.filename = filename
         aps.lineno = 0
         aps.pc_addr = 0
+        aps.include_paths = list(self.include_paths)
+        aps.include_stack = [os.path.realpath(filename)] if filename else []
+        if self.profiler is not None:
+            self.profiler.instrument(aps, 'add_symbol', PHASE_PASS1 + '.labels')
+            self.profiler.instrument(aps, 'substitute_defines', PHASE_PASS1 + '.defines')
+        return aps
+
+    '''
+    Installs the profiler's hooks in the preprocessor and synthesizer for the duration of the block
+    (a no-op without a profiler).
+    '''
+    @contextmanager
+    def __profiling(self) -> Iterator[None]:
+        profiler = self.profiler
+        if profiler is None:
+            yield
+            return
+        self.__preprocessor.instrument(profiler)
+        self.__synthesizer.instrument(profiler)
+        try:
+            yield
+        finally:
+            profiler.restore()
+
+    '''
+    Assembler Pass 1: Preprocesses the source code lines, builds the symbol table and lowers every
+    instruction to the compact IR (see assembler.ir). Returns the IR and the pass state holding the
+    symbol and define tables. If processed_lines is given, the preprocessed text of every line is
+    appended to it. If comment_lines is given, the number of every line that starts inside a block
+    comment is appended to it, followed by the number of lines if the source ends inside one. Sources (lists) of at least parallel_lines_threshold lines are split across
+    'parallel' worker processes (see build_ir_parallel()).
+    '''
+    def build_ir(self, source_lines: Iterable[str], filename: str = None, processed_lines: List[str] = None, comment_lines: array = None) -> Tuple[InstructionIR, AssemblerPassState]:
+        if (self.parallel > 1 and processed_lines is None and comment_lines is None and self.__preprocessor.SPLITTABLE
+                and isinstance(source_lines, list) and len(source_lines) >= self.parallel_lines_threshold):
+            from assembler.parallel import usable_workers
+            num_workers = usable_workers(self.parallel)
+            if num_workers > 1:
+                return self.build_ir_parallel(source_lines, filename, num_workers)
+        aps = self.__begin_pass(filename)
+        ir = self.__synthesizer.new_ir()
+        aps.include = self.__include_hook(aps, ir)
+        self.__lower_lines(source_lines, aps, ir, processed_lines, comment_lines)
+        return ir, aps
+
+    '''
+    Parallel pass 1: worker processes lower chunks of the source speculatively (see
+    assembler.parallel.lower_chunks_parallel()) and this process merges them in source order, carrying
+    the state a serial pass would: the address of the next instruction, the block comment flag, the
+    segment and the define table. A chunk is merged by offsetting its addresses and appending its IR
+    and data. It's lowered again here, from the true state, if it starts inside a block comment or in
+    another segment than it assumed, uses a define whose value it guessed wrong or failed (so errors are raised exactly as the serial pass raises them). The result is identical to
+    the serial pass.
+    '''
+    def build_ir_parallel(self, source_lines: Sequence[str], filename: str, num_workers: int) -> Tuple[InstructionIR, AssemblerPassState]:
+        from assembler.parallel import lower_chunks_parallel
+        aps = self.__begin_pass(filename)
+        ir = self.__synthesizer.new_ir()
+        aps.include = self.__include_hook(aps, ir) # for chunks redone here; workers fail on .include
+        preprocessor = self.__preprocessor
+        defines = aps.get_define_table()
+        for assumed, chunk in lower_chunks_parallel(preprocessor, self.__synthesizer, source_lines, filename, num_workers):
+            if (chunk is None or preprocessor.in_block_comment or aps.segment is not assumed.segment
+                    or not defines.agrees_on(assumed.defines, chunk.used_tokens)):
+                aps.lineno = assumed.start
+                self.__lower_lines(source_lines[assumed.start:assumed.end], aps, ir)
+                continue
+            pc_addr = len(ir)
+            ir.extend(chunk.ir)
+            for name, addr in chunk.labels.items():
+                aps.add_symbol(name, pc_addr + addr)
+            for lineno, name, value in chunk.defines:
+                aps.lineno = lineno
+                aps.add_define(name, value)
+            aps.data.extend(chunk.data)
+            aps.segment = chunk.segment
+            preprocessor.in_block_comment = chunk.in_block_comment
+            aps.pc_addr = len(ir)
+        aps.lineno = len(source_lines)
+        return ir, aps
+
+    def __lower_lines(self, source_lines: Iterable[str], aps: AssemblerPassState, ir: InstructionIR, processed_lines: List[str] = None, comment_lines: array = None):
+        preprocessor = self.__preprocessor
+        lex_line = preprocessor.lex_line
+        lower_lexed = self.__synthesizer.lower_lexed
+        line = None
+        if not preprocessor.SPLITTABLE:
+            comment_lines = None # no block comment state to record (assemble_region() doesn't run either)
+        try:
+            for line in source_lines:
+                if comment_lines is not None and preprocessor.in_block_comment:
+                    comment_lines.append(aps.lineno)
+                instr = lex_line(line, aps)
+                if instr:
+                    lower_lexed(instr, line, aps, ir)
+                if processed_lines is not None:
+                    processed_lines.append(instr.code if instr else None)
+                aps.lineno += 1
+        except AssemblerError as e:
+            if e.filename == aps.filename: self.__locate_error(e, line) # errors in included files point at their own line
+            raise e
+        if comment_lines is not None and preprocessor.in_block_comment:
+            comment_lines.append(aps.lineno)
+
+    '''
+    Returns the hook the .include directive calls (see AssemblerPassState.include) to merge a file into
+    the IR being built. used_tokens, if given, collects the word tokens of every file merged.
+    '''
+    def __include_hook(self, aps: AssemblerPassState, ir: InstructionIR, used_tokens: Set[str] = None) -> Callable[[str], None]:
+        return lambda filepath: self.include_file(filepath, aps, ir, used_tokens)
+
+    '''
+    Merges an included file (by real path) at the current line of pass 1, like a chunk of the source
+    is merged by the parallel pass 1 (see build_ir_parallel()): its instructions are appended to the IR,
+    attributed to the .include line, and its labels, defines, data and final segment become the
+    including file's.
+
+    Files are lowered on their own (see __lower_include()) and kept in the process wide include cache
+    (see assembler.includes), so a header included by many sources, or many times by a daemon, is only
+    read and lowered once per version. A file that uses a name the including file has defined depends
+    on where it's included, so it's lowered again (with those defines) every time instead.
+    '''
+    def include_file(self, filepath: str, aps: AssemblerPassState, ir: InstructionIR, used_tokens: Set[str] = None):
+        from assembler.includes import get_include_cache
+        cache = get_include_cache()
+        defines = aps.get_define_table()
+        key = (aps.segment, tuple(aps.include_paths), self.__synthesizer.fingerprint())
+        try:
+            version, lines = cache.stat(filepath)
+            unit = cache.get(filepath, version.digest, key)
+            if unit is not None and (not cache.is_current(unit) or any(path in aps.include_stack for path, _ in unit.files)
+                                     or not defines.agrees_on(DefineTable(), unit.used_tokens)):
+                unit = None
+            if unit is None:
+                if lines is None:
+                    version, lines = cache.read(filepath)
+                unit = self.__lower_include(filepath, version.digest, lines, aps)
+                if defines.agrees_on(DefineTable(), unit.used_tokens): # lowered as it would be anywhere else
+                    cache.put(filepath, version.digest, key, unit)
+        except (OSError, UnicodeDecodeError) as e:
+            raise AssemblerError('Can\'t read include file \'{}\': {}'.format(filepath, e), aps.filename, aps.lineno)
+
+        lineno = aps.lineno
+        pc_addr = len(ir)
+        ir.extend(unit.ir, lineno)
+        for name, addr in unit.labels.items():
+            aps.add_symbol(name, pc_addr + addr)
+        for name, value in unit.defines:
+            aps.add_define(name, value)
+        aps.data.extend(unit.data, lineno)
+        aps.segment = unit.segment
+        aps.pc_addr = len(ir)
+        aps.included.extend(unit.files)
+        if used_tokens is not None:
+            used_tokens.update(unit.used_tokens)
 
-        # Assembler Pass 1: Preprocess the source code lines, build the symbol table
-        processed_lines = []
-        for line in source_lines:
-            processed_lines.append(self.__preprocessor.process_line(line, aps))
-            aps.lineno += 1
+    '''
+    Pass 1 of an included file's lines, from the including file's segment and defines, at address 0
+    (labels are offset when it's merged). Errors point at the included file's own lines.
+    '''
+    def __lower_include(self, filepath: str, digest: str, lines: List[str], aps: AssemblerPassState) -> 'IncludeUnit':
+        from assembler.includes import IncludeUnit
+        unit_aps = AssemblerPassState()
+        unit_aps.filename = filepath
+        unit_aps.segment = aps.segment
+        unit_aps.include_paths = aps.include_paths
+        unit_aps.include_stack = aps.include_stack + [filepath]
+        for name, value in aps.get_defines():
+            unit_aps.add_define(name, value)
+        defines = []
+        add_define = unit_aps.add_define
+        def record_define(name: str, value: str):
+            defines.append((name, value))
+            add_define(name, value)
+        unit_aps.add_define = record_define
 
+        unit_ir = self.__synthesizer.new_ir()
+        used_tokens = set(WORD_TOKEN_RE.findall(''.join(lines)))
+        unit_aps.include = self.__include_hook(unit_aps, unit_ir, used_tokens)
+        preprocessor = self.__preprocessor
+        if preprocessor.SPLITTABLE: # an included file starts outside any block comment
+            in_block_comment, preprocessor.in_block_comment = preprocessor.in_block_comment, False
+        try:
+            self.__lower_lines(lines, unit_aps, unit_ir)
+        finally:
+            if preprocessor.SPLITTABLE: preprocessor.in_block_comment = in_block_comment
+        return IncludeUnit(unit_ir, unit_aps.get_symbol_table(), defines, unit_aps.data, unit_aps.segment, used_tokens, [(filepath, digest)] + unit_aps.included)
+
+    '''
+    Points an error at the source line it came from, and fills in the column of its token if it isn't known yet.
+    '''
+    def __locate_error(self, e: AssemblerError, line: str):
+        if line is None: return
+        e.line = line.rstrip('\r\n')
+        if e.column is None and e.at_token is not None:
+            e.column = self.__preprocessor.locate(e.line, e.at_token)
+
+    '''
+    Runs the peephole optimizer (see assembler.peephole) on the IR if optimize is set, and returns the
+    IR to synthesize. The labels in aps are moved to the optimized addresses.
+    '''
+    def optimize_ir(self, ir: InstructionIR, aps: AssemblerPassState) -> InstructionIR:
+        self.peephole_stats = None
+        if not self.optimize or self.peephole is None:
+            return ir
+        with profile_phase(self.profiler, PHASE_OPTIMIZE):
+            ir = self.peephole.optimize(ir, aps)
+        self.peephole_stats = self.peephole.stats
+        return ir
+
+    '''
+    Relaxes the branches whose label is out of range of their displacement (see assembler.relaxation)
+    if relax is set, and returns the IR to synthesize. The labels in aps are moved to the new addresses.
+    '''
+    def relax_ir(self, ir: InstructionIR, aps: AssemblerPassState, source_lines: Sequence[str] = None) -> InstructionIR:
+        self.relaxed_branches = []
+        if not self.relax or self.relaxer is None:
+            return ir
+        try:
+            with profile_phase(self.profiler, PHASE_RELAX):
+                ir = self.relaxer.relax(ir, aps)
+        except AssemblerError as e:
+            if source_lines is not None: self.__locate_error(e, source_lines[e.lineno])
+            raise e
+        self.relaxed_branches = self.relaxer.sites
+        return ir
+
+    '''
+    Assembler Pass 2: Resolves the IR's symbol references and returns the machine code words, followed
+    by the DATA segment (see assembler.memory.DataSegment). source_lines (if given) is used to fill in
+    the offending line of errors. Programs of at least parallel_threshold instructions are synthesized
+    by 'parallel' worker processes (see assembler.parallel).
+    '''
+    def synthesize_ir(self, ir: InstructionIR, aps: AssemblerPassState, source_lines: Sequence[str] = None) -> array:
         aps.lineno = 0
         aps.pc_addr = 0
+        aps.data.place(len(ir), aps)
+        try:
+            words = None
+            if self.parallel > 1 and len(ir) >= self.parallel_threshold:
+                from assembler.parallel import synthesize_ir_parallel, usable_workers
+                num_workers = usable_workers(self.parallel)
+                if num_workers > 1:
+                    words = synthesize_ir_parallel(self.__synthesizer, ir, aps, num_workers)
+            if words is None:
+                words = self.__synthesizer.synthesize_ir(ir, aps)
+            if aps.data:
+                words.extend(aps.data.words(aps))
+            return words
+        except AssemblerError as e:
+            if source_lines is not None: self.__locate_error(e, source_lines[e.lineno])
+            raise e
+
+    '''
+    Assembles a run of source lines on their own, as part of a program assembled before (see
+    assembler.incremental): they're lowered starting at line lineno, outside any block comment, in the
+    TEXT segment and with the given defines, then synthesized at addresses from address on against the
+    program's symbol table. Returns the line numbers and words of their instructions, or None if the lines
+    do anything besides holding instructions (labels, directives, a block comment left open), since then
+    the rest of the program may change too. Raises AssemblerError if the lines don't assemble. The caller
+    must make sure no block comment is open at line lineno. comment_lines is filled like build_ir() does.
+    '''
+    def assemble_region(self, source_lines: Sequence[str], filename: str, lineno: int, address: int, defines: DefineTable, symbol_table: SymbolTable, comment_lines: array = None) -> Optional[Tuple[array, array]]:
+        preprocessor = self.__preprocessor
+        if not preprocessor.SPLITTABLE: # no way to tell whether the lines leave a block comment open
+            return None
+        preprocessor.reset()
+        self.__synthesizer.reset()
+        aps = AssemblerPassState()
+        aps.filename = filename
+        for name, value in defines.items():
+            aps.add_define(name, value)
+        aps.lineno = lineno
+        aps.pc_addr = address
+        defined = []
+        aps.add_define = lambda name, value: defined.append(name)
+        ir = self.__synthesizer.new_ir()
+        self.__lower_lines(source_lines, aps, ir, comment_lines=comment_lines)
+        if defined or aps.get_symbol_table() or aps.data.lines or aps.data.labels or aps.segment is not MemorySegment.TEXT or preprocessor.in_block_comment:
+            return None
+        aps.get_symbol_table().update(symbol_table)
+        try:
+            words = self.__synthesizer.synthesize_ir(ir, aps, base=address)
+        except AssemblerError as e:
+            self.__locate_error(e, source_lines[e.lineno - lineno])
+            raise e
+        return ir.linenos, words
 
-        # Assembler Pass 2: Synthesize the processed source code lines into machine code
-        text_segment = []
-        for i, instr in enumerate(processed_lines):
-            b, _ = self.__synthesizer.process_instruction(instr, source_lines[i], aps)
-            aps.lineno += 1
-            if b is not None:
-                text_segment.append(b)
-                aps.pc_addr += 1
-                print_info(aps, '\'{:20s}\' -> {} (0x{})'.format(instr, b.bin, b.hex))
+    def assemble_file(self, filepath: str, as_words: bool = False, listing: Listing = None, cache: 'BuildCache' = None) -> Union[List['Bits'], array]:
+        if cache is not None and self.verbosity < VERBOSITY_INFO: # verbose output needs both passes to run
+            with open(filepath, 'rb') as src_file:
+                source = src_file.read()
+            entry = self.assemble_cached(source, filepath, cache, listing)
+            text_segment = array('H')
+            text_segment.frombytes(entry.image)
+            if sys.byteorder != 'big': text_segment.byteswap() # big-endian binary image
+            if listing is not None and listing.text is not None:
+                listing.words = text_segment
+            if as_words:
+                return text_segment
+            from bitstring import Bits
+            return [Bits(uint=word, length=self.__synthesizer.word_length) for word in text_segment]
+        with open(filepath, 'r') as src_file:
+            with profile_phase(self.profiler, PHASE_READ):
+                source_lines = src_file.readlines()
+            return self.assemble_lines(source_lines, src_file.name, as_words, listing)
 
-        #text_segment.byteswap(2) # change endianness of the machine code
-        return text_segment
-        
+    '''
+    Assembles a source file without reading it in as lines: the file is memory mapped and scanned as
+    bytes, and only lines that may hold code are decoded, one at a time (see build_ir_mapped()). Line
+    numbers come from the newlines scanned, and diagnostics re-read the offending line from the mapping,
+    so memory use is the IR and the image no matter how large (or how heavily commented) the source is.
+    '''
+    def assemble_file_mapped(self, filepath: str, as_words: bool = False) -> Union[List['Bits'], array]:
+        from assembler.stream import MappedSource # only needed with --mmap, keep it out of CLI startup
+        with MappedSource(filepath) as source, self.__profiling():
+            with profile_phase(self.profiler, PHASE_PASS1):
+                ir, aps = self.build_ir_mapped(source)
+            ir = self.optimize_ir(ir, aps)
+            ir = self.relax_ir(ir, aps, source)
+            with profile_phase(self.profiler, PHASE_PASS2):
+                text_segment = self.synthesize_ir(ir, aps, source)
+        if as_words:
+            return text_segment
+        from bitstring import Bits
+        return [Bits(uint=word, length=self.__synthesizer.word_length) for word in text_segment]
 
+    '''
+    Assembler Pass 1 over a memory mapped source (see build_ir()). The preprocessor picks the lines to
+    decode (Preprocessor.iter_code_lines()); the rest never become strings.
+    '''
+    def build_ir_mapped(self, source: 'MappedSource') -> Tuple[InstructionIR, AssemblerPassState]:
+        from assembler.stream import SOURCE_ENCODING
+        aps = self.__begin_pass(source.filepath)
+        ir = self.__synthesizer.new_ir()
+        aps.include = self.__include_hook(aps, ir)
+        lex_line = self.__preprocessor.lex_line
+        lower_lexed = self.__synthesizer.lower_lexed
+        line = None
+        try:
+            for lineno, line in self.__preprocessor.iter_code_lines(source.buffer, SOURCE_ENCODING):
+                aps.lineno = lineno
+                instr = lex_line(line, aps)
+                if instr:
+                    lower_lexed(instr, line, aps, ir)
+        except AssemblerError as e:
+            if e.filename == aps.filename: self.__locate_error(e, line)
+            raise e
+        return ir, aps
 
-    def assemble_file(self, filepath: str) -> List[Bits]:
-        with open(filepath, 'r') as src_file:
-            return self.assemble_lines(src_file.readlines(), src_file.name)
+    '''
+    Returns the build cache key of a source file's image in the given output format. The key covers
+    the source bytes, the instruction set's encodings, the assembler version, the output format and
+    whether the peephole optimizer and branch relaxation run.
+    '''
+    def cache_key(self, source: bytes, format: str = 'binary', byteorder: str = 'big') -> str:
+        from assembler.cache import BuildCache
+        parts = [source, self.__synthesizer.fingerprint(), ASSEMBLER_VERSION, format, byteorder]
+        if self.optimize: parts.append('optimize')
+        if not self.relax: parts.append('no-relax')
+        return BuildCache.make_key(*parts)
+
+    '''
+    Assembles source file bytes through the build cache and returns the cache entry (the image encoded
+    in the given output format and, if a listing is given, the listing body). A hit skips both passes;
+    the listing then only holds the cached text (Listing.text).
+    '''
+    def assemble_cached(self, source: bytes, filename: str, cache: 'BuildCache', listing: Listing = None, format: str = 'binary', byteorder: str = 'big') -> 'CacheEntry':
+        from assembler.cache import CacheEntry
+        key = self.cache_key(source, format, byteorder)
+        entry = cache.get(key, with_listing=listing is not None)
+        if entry is not None:
+            if listing is not None:
+                listing.filename = filename
+                listing.text = entry.listing
+            return entry
+
+        source_lines = io.StringIO(source.decode(), newline=None).readlines() # same newline handling as open(filepath, 'r')
+        text_segment = self.assemble_lines(source_lines, filename, True, listing)
+        from assembler.writers import encode_image
+        entry = CacheEntry(len(text_segment), encode_image(text_segment, format, byteorder), ''.join(listing.body_lines()) if listing is not None else None)
+        if not self.included_files: # the key only covers the source, so images built from other files (includes, binaries) aren't cached
+            cache.put(key, *entry)
+        return entry
+
+    '''
+    Streaming variant of assemble_file(). Returns a generator of instruction words.
+
+    Pass 1 reads the source lazily, one line at a time, and spills a compact record (line number,
+    source offset, preprocessed instruction) for every instruction to a temporary file. Pass 2 reads
+    the records back and yields each encoded word as soon as it's synthesized, so it can be fed
+    straight to an image writer (ImageWriter.write_stream). Source lines aren't kept; diagnostics
+    re-read the offending line by its offset. Peak memory depends on the symbol and define tables,
+    not on the size of the source file. There's no IR, so neither the peephole optimizer nor branch
+    relaxation run.
+    '''
+    def assemble_file_stream(self, filepath: str) -> Iterator[int]:
+        from assembler.stream import InstructionSpill, iter_source_lines, read_source_line # only needed with --stream
+        with self.__profiling():
+            aps = self.__begin_pass(filepath)
+
+            with open(filepath, 'rb') as src_file, InstructionSpill() as spill:
+                # Assembler Pass 1: Preprocess the source code lines, build the symbol table
+                process_line = self.__preprocessor.process_line
+                try:
+                    with profile_phase(self.profiler, PHASE_PASS1):
+                        for offset, line in iter_source_lines(src_file):
+                            instr = process_line(line, aps)
+                            if instr:
+                                spill.append(aps.lineno, offset, instr)
+                            aps.lineno += 1
+                except AssemblerError as e:
+                    self.__locate_error(e, line)
+                    raise e
+
+                aps.lineno = 0
+                aps.pc_addr = 0
+                aps.data.place(spill.count, aps)
 
-        
+                # Assembler Pass 2: Synthesize the spilled instructions into machine code
+                encode_instruction = self.__synthesizer.encode_instruction
+                for lineno, offset, instr in spill:
+                    aps.lineno = lineno
+                    try:
+                        word = encode_instruction(instr, None, aps)
+                    except AssemblerError as e:
+                        self.__locate_error(e, read_source_line(src_file, offset))
+                        raise e
+                    aps.pc_addr += 1
+                    yield word
 
+                # The DATA segment follows the instructions
+                if aps.data:
+                    yield from aps.data.words(aps)
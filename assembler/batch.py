@@ -0,0 +1,220 @@
+import glob
+import io
+import os
+import time
+from contextlib import redirect_stdout
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional
+
+from assembler.cache import BuildCache, DEFAULT_CACHE_SIZE
+from assembler.exceptions import AssemblerError
+from assembler.listing import Listing, VERBOSITY_QUIET
+from assembler.profiling import Profiler, PHASE_READ, PHASE_WRITE, profile_phase
+from assembler.writers import write_image, write_image_stream
+
+
+'''
+A single file to assemble as part of a batch.
+'''
+class BatchJob(NamedTuple):
+    input_path: str
+    output_path: str
+    format: str = 'binary'
+    byteorder: str = 'big'
+    listing_path: Optional[str] = None
+    stream: bool = False
+    verbosity: int = VERBOSITY_QUIET
+    cache_dir: Optional[str] = None # build cache directory (see assembler.cache), or None to always assemble
+    cache_size: int = DEFAULT_CACHE_SIZE
+    stats: bool = False        # record per phase stats (see assembler.profiling)
+    stats_memory: bool = False # also record tracemalloc peaks (slow)
+    parallel: int = 1          # worker processes for both passes of large programs (see Assembler.parallel)
+    mmap: bool = False         # memory map the source instead of reading it in (see Assembler.assemble_file_mapped)
+    optimize: bool = False     # run the peephole optimizer between the passes (see Assembler.optimize)
+    relax: bool = True         # relax branches whose label is out of range (see Assembler.relax)
+    include_paths: List[str] = [] # directories searched for .include files (see Assembler.include_paths)
+
+
+'''
+Outcome of a batch job. output holds everything the job would have printed (verbose output and
+diagnostics) so results can be reported in a deterministic order no matter which worker ran them.
+'''
+class BatchResult(NamedTuple):
+    job: BatchJob
+    success: bool
+    output: str
+    words: int
+    seconds: float
+    cached: Optional[bool] = None # whether the image came from the build cache (None if the job didn't use it)
+    stats: Optional[Dict[str, Any]] = None # per phase stats (Profiler.to_dict()) if the job asked for them
+    peephole_stats: Optional[Dict[str, int]] = None # instructions each peephole rule removed (None if the optimizer didn't run, ex. on a cache hit)
+    relaxed_branches: List[Any] = [] # RelaxedBranch of every branch that was relaxed
+
+
+'''
+Expands glob patterns in the input paths (sorted, so the order is deterministic). Paths without glob
+characters are passed through unchanged even if they don't exist, so the job reports the error.
+Patterns that match nothing are returned in unmatched.
+'''
+def expand_inputs(patterns: Iterable[str], unmatched: List[str] = None) -> List[str]:
+    paths = []
+    for pattern in patterns:
+        if glob.has_magic(pattern):
+            matches = sorted(glob.glob(pattern))
+            if not matches and unmatched is not None:
+                unmatched.append(pattern)
+            paths.extend(matches)
+        else:
+            paths.append(pattern)
+    return paths
+
+
+'''
+Assembles one job with the given (reused) assembler. Never raises: assembler and I/O errors (and any
+other failure, so one bad file can't end a batch) are reported through the result instead.
+'''
+def run_job(assembler, job: BatchJob) -> BatchResult:
+    start = time.perf_counter()
+    out = io.StringIO()
+    success = False
+    words = 0
+    cached = None
+    assembler.verbosity = job.verbosity
+    assembler.parallel = job.parallel
+    assembler.optimize = job.optimize
+    assembler.relax = job.relax
+    assembler.include_paths = job.include_paths
+    assembler.peephole_stats = None
+    assembler.relaxed_branches = []
+    profiler = assembler.profiler = Profiler(job.stats_memory) if job.stats else None
+    with redirect_stdout(out):
+        try:
+            if job.cache_dir and not job.stream and not job.mmap and job.verbosity == VERBOSITY_QUIET:
+                cache = get_cache(job.cache_dir, job.cache_size)
+                hits = cache.stats.hits
+                with profile_phase(profiler, PHASE_READ), open(job.input_path, 'rb') as src_file:
+                    source = src_file.read()
+                listing = Listing() if job.listing_path else None
+                entry = assembler.assemble_cached(source, job.input_path, cache, listing, job.format, job.byteorder)
+                cached = cache.stats.hits > hits
+                with profile_phase(profiler, PHASE_WRITE), open(job.output_path, 'wb') as fp:
+                    fp.write(entry.image)
+                if listing is not None:
+                    listing.write_file(job.listing_path)
+                words = entry.words
+            elif job.stream:
+                # Words are written as pass 2 yields them, so a failure can leave a partial image behind
+                try:
+                    with profile_phase(profiler, PHASE_WRITE):
+                        words = write_image_stream(job.output_path, assembler.assemble_file_stream(job.input_path), job.format, job.byteorder)
+                except AssemblerError:
+                    os.remove(job.output_path)
+                    raise
+            elif job.mmap:
+                executable_data = assembler.assemble_file_mapped(job.input_path, as_words=True)
+                with profile_phase(profiler, PHASE_WRITE):
+                    words = write_image(job.output_path, executable_data, job.format, job.byteorder)
+            else:
+                listing = Listing() if job.listing_path else None
+                executable_data = assembler.assemble_file(job.input_path, as_words=True, listing=listing)
+                # The whole image is encoded in bulk and written with as few writes as possible
+                with profile_phase(profiler, PHASE_WRITE):
+                    words = write_image(job.output_path, executable_data, job.format, job.byteorder)
+                if listing is not None:
+                    listing.write_file(job.listing_path)
+            success = True
+        except AssemblerError as e:
+            print(e.tostring())
+        except (OSError, UnicodeDecodeError) as e:
+            print('{}: ERROR: {}'.format(job.input_path, e))
+        except Exception as e:
+            print('{}: ERROR: Internal assembler error: {}: {}'.format(job.input_path, type(e).__name__, e))
+        finally:
+            if profiler is not None:
+                profiler.close()
+                assembler.profiler = None
+    return BatchResult(job, success, out.getvalue(), words, time.perf_counter() - start, cached, profiler.to_dict() if profiler is not None else None,
+                       assembler.peephole_stats if success else None, assembler.relaxed_branches if success else [])
+
+
+# Build caches opened by this process, by directory
+_caches = {}
+
+def get_cache(directory: str, max_size: int = DEFAULT_CACHE_SIZE) -> BuildCache:
+    cache = _caches.get(directory)
+    if cache is None:
+        cache = _caches[directory] = BuildCache(directory, max_size)
+    return cache
+
+
+# Each worker process assembles all of its jobs with one assembler instance
+_worker_assembler = None
+
+def _init_worker():
+    global _worker_assembler
+    from assembler.custom_assembler import CustomAssembler
+    _worker_assembler = CustomAssembler()
+
+def _run_worker_job(job: BatchJob) -> BatchResult:
+    return run_job(_worker_assembler, job)
+
+
+'''
+Assembles every job, across num_workers processes if num_workers > 1. Results are returned in the
+same order as the jobs. Every job is attempted: a job whose worker fails (ex. the process dies) gets a
+failed result.
+'''
+def run_batch(jobs: List[BatchJob], num_workers: int = 1) -> List[BatchResult]:
+    num_workers = min(num_workers, len(jobs))
+    if num_workers <= 1:
+        from assembler.custom_assembler import CustomAssembler
+        assembler = CustomAssembler()
+        return [run_job(assembler, job) for job in jobs]
+    from concurrent.futures import ProcessPoolExecutor # only needed with -j, keep it out of CLI startup
+    with ProcessPoolExecutor(max_workers=num_workers, initializer=_init_worker) as pool:
+        futures = [pool.submit(_run_worker_job, job) for job in jobs]
+        results = []
+        for job, future in zip(jobs, futures):
+            try:
+                results.append(future.result())
+            except Exception as e:
+                results.append(BatchResult(job, False, '{}: ERROR: Worker failed: {}: {}\n'.format(job.input_path, type(e).__name__, e), 0, 0.0))
+        return results
+
+
+'''
+Formats an error returned by the daemon like the same error raised in this process: located errors
+like AssemblerError.tostring(), others (ex. a missing input) as '<input>: ERROR: <message>'.
+'''
+def format_daemon_error(error: Dict[str, Any], input_path: str) -> str:
+    if 'lineno' in error or 'line' in error:
+        return AssemblerError(error.get('msg'), error.get('filename'), error.get('lineno') or 0, error.get('line'), error.get('at_token'), error.get('column')).tostring()
+    return '{}: {}: {}'.format(input_path, error.get('tag', 'ERROR'), error.get('msg'))
+
+
+'''
+Sends every job to a running assembler daemon (see assembler.daemon) instead of assembling in this
+process, and writes the returned images and listings. Results are returned in the same order as the jobs.
+'''
+def run_batch_on_daemon(jobs: List[BatchJob], socket_path: str) -> List[BatchResult]:
+    from assembler.daemon_client import DaemonClient
+    results = []
+    with DaemonClient(socket_path) as client:
+        for job in jobs:
+            start = time.perf_counter()
+            response = client.assemble(path=os.path.abspath(job.input_path), format=job.format, byteorder=job.byteorder, listing=job.listing_path is not None, include_paths=job.include_paths, relax=job.relax)
+            if response.success:
+                with open(job.output_path, 'wb') as fp:
+                    fp.write(response.image)
+                if job.listing_path:
+                    with open(job.listing_path, 'w') as fp:
+                        fp.write(response.listing)
+                output = ''
+            else:
+                output = ''.join(format_daemon_error(error, job.input_path) + '\n' for error in response.errors)
+            relaxed_branches = []
+            if response.relaxed:
+                from assembler.relaxation import RelaxedBranch
+                relaxed_branches = [RelaxedBranch(**branch) for branch in response.relaxed]
+            results.append(BatchResult(job, response.success, output, response.words, time.perf_counter() - start, relaxed_branches=relaxed_branches))
+    return results
+
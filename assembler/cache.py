@@ -0,0 +1,177 @@
+import hashlib
+import os
+import struct
+from typing import List, NamedTuple, Optional, Tuple, Union
+
+DEFAULT_CACHE_SIZE = 256 << 20 # bytes
+CACHE_ENTRY_SUFFIX = '.img'
+CACHE_TEMP_PREFIX = '.tmp-'
+
+# Entry file header: magic, words in the image, image size, listing size (NO_LISTING if the entry has none)
+ENTRY_HEADER = struct.Struct('>4sIII')
+ENTRY_MAGIC = b'ASC1'
+NO_LISTING = 0xFFFFFFFF
+
+'''
+A cached assembly result: the encoded image and (if it was recorded) the rendered listing text.
+'''
+class CacheEntry(NamedTuple):
+    words: int
+    image: bytes
+    listing: Optional[str]
+
+
+class CacheStats(object):
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def __repr__(self):
+        return 'CacheStats(hits={}, misses={}, stores={}, evictions={})'.format(self.hits, self.misses, self.stores, self.evictions)
+
+
+'''
+On-disk cache of assembled images, keyed by a content hash (see make_key()).
+
+Every entry is one file named after its key. Entries are written to a temporary file in the cache
+directory and renamed into place, so concurrent builds sharing a directory never see a partial
+entry; two builds storing the same key just replace one complete entry with another. A hit bumps the
+entry's modification time, and once the directory grows past max_size the least recently used
+entries are evicted. A corrupt or vanished entry is treated as a miss.
+'''
+class BuildCache(object):
+
+    def __init__(self, directory: str, max_size: int = DEFAULT_CACHE_SIZE):
+        self.directory = directory
+        self.max_size = max_size
+        self.stats = CacheStats()
+        self.__size_estimate: int = None # bytes; only used to decide when to scan the directory
+        os.makedirs(directory, exist_ok=True)
+
+    '''
+    Hashes the parts of a cache key (source bytes, ISA fingerprint, version, output format...)
+    into a hex digest. Parts are length-prefixed so different splits never collide.
+    '''
+    @staticmethod
+    def make_key(*parts: Union[bytes, str]) -> str:
+        digest = hashlib.sha256()
+        for part in parts:
+            if isinstance(part, str):
+                part = part.encode('utf-8')
+            digest.update(len(part).to_bytes(8, 'big'))
+            digest.update(part)
+        return digest.hexdigest()
+
+    def entry_path(self, key: str) -> str:
+        return os.path.join(self.directory, key + CACHE_ENTRY_SUFFIX)
+
+    '''
+    Returns the entry stored under key, or None on a miss. An entry without a listing is a miss if
+    with_listing is set.
+    '''
+    def get(self, key: str, with_listing: bool = False) -> Optional[CacheEntry]:
+        path = self.entry_path(key)
+        try:
+            with open(path, 'rb') as fp:
+                data = fp.read()
+            magic, words, image_size, listing_size = ENTRY_HEADER.unpack_from(data)
+            start = ENTRY_HEADER.size
+            listing_len = 0 if listing_size == NO_LISTING else listing_size
+            if magic != ENTRY_MAGIC or len(data) != start + image_size + listing_len:
+                raise ValueError('corrupt cache entry')
+            image = data[start:start + image_size]
+            listing = data[start + image_size:].decode('utf-8') if listing_size != NO_LISTING else None
+        except FileNotFoundError:
+            self.stats.misses += 1
+            return None
+        except (OSError, ValueError, struct.error):
+            self.__remove(path)
+            self.stats.misses += 1
+            return None
+        if with_listing and listing is None:
+            self.stats.misses += 1 # stored without a listing; the caller reassembles and replaces it
+            return None
+        try:
+            os.utime(path) # mark as recently used
+        except OSError:
+            pass
+        self.stats.hits += 1
+        return CacheEntry(words, image, listing)
+
+    def put(self, key: str, words: int, image: bytes, listing: Optional[str] = None):
+        listing_bytes = listing.encode('utf-8') if listing is not None else b''
+        header = ENTRY_HEADER.pack(ENTRY_MAGIC, words, len(image), len(listing_bytes) if listing is not None else NO_LISTING)
+        import tempfile
+        fd, temp_path = tempfile.mkstemp(prefix=CACHE_TEMP_PREFIX, dir=self.directory)
+        try:
+            with os.fdopen(fd, 'wb') as fp:
+                fp.write(header)
+                fp.write(image)
+                fp.write(listing_bytes)
+            os.replace(temp_path, self.entry_path(key))
+        except OSError:
+            self.__remove(temp_path)
+            return
+        self.stats.stores += 1
+        if self.__size_estimate is None:
+            self.__size_estimate = self.size()
+        else:
+            self.__size_estimate += len(header) + len(image) + len(listing_bytes)
+        if self.__size_estimate > self.max_size:
+            self.evict()
+
+    '''
+    Total size in bytes of the entries in the cache directory.
+    '''
+    def size(self) -> int:
+        return sum(size for _, size, _ in self.__entry_stats())
+
+    '''
+    Removes the least recently used entries until the cache fits in max_size.
+    '''
+    def evict(self):
+        entries = self.__entry_stats()
+        total = sum(size for _, size, _ in entries)
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_size:
+                break
+            if self.__remove(path):
+                self.stats.evictions += 1
+            total -= size
+        self.__size_estimate = total
+
+    def clear(self):
+        for entry in self.__entries():
+            self.__remove(entry.path)
+        self.__size_estimate = 0
+
+    def __entries(self):
+        with os.scandir(self.directory) as it:
+            return [entry for entry in it if entry.name.endswith(CACHE_ENTRY_SUFFIX) and entry.is_file()]
+
+    # (mtime, size, path) of every entry
+    def __entry_stats(self) -> List[Tuple[float, int, str]]:
+        stats = []
+        for entry in self.__entries():
+            try:
+                st = entry.stat()
+            except OSError:
+                continue # evicted by another build
+            stats.append((st.st_mtime, st.st_size, entry.path))
+        return stats
+
+    @staticmethod
+    def __remove(path: str) -> bool:
+        try:
+            os.remove(path)
+            return True
+        except OSError:
+            return False
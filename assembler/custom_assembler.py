@@ -1,11 +1,21 @@
 from enum import Enum, auto
-from bitstring import Bits
+from functools import lru_cache
+from typing import TYPE_CHECKING
 
 from assembler.isa import *
 from assembler.directives import *
 from assembler.preprocessor import *
 from assembler.synthesis import Synthesizer
 from assembler.assembler import Assembler
+from assembler.listing import VERBOSITY_QUIET
+
+# The optimizer, relaxation, disassembler, simulator and analysis are imported by the tables and classes
+# that use them, so assembling doesn't load the tools it doesn't run (see benchmarks.import_budget)
+if TYPE_CHECKING:
+    from assembler.analysis import ControlFlowTable, CycleModel
+    from assembler.peephole import PeepholeRuleTable
+    from assembler.relaxation import RelaxationTable
+    from assembler.simulator import SemanticsTable
 
 # File Syntax Constants
 PREFIX_LINE_COMMENT  = ';'
@@ -36,56 +46,56 @@ INSTR_OPD_LEN_ALU_OP   = 2
 FILE_EXT_ASSEMBLY    = 'asm'
 
 CPU_GP_REGISTERS: RegisterTable = {
-    '0' : Register('0', Bits(uint=0, length=INSTR_OPD_LEN_GP_REG)),
-    '1' : Register('1', Bits(uint=1, length=INSTR_OPD_LEN_GP_REG)),
-    '2' : Register('2', Bits(uint=2, length=INSTR_OPD_LEN_GP_REG)),
-    '3' : Register('3', Bits(uint=3, length=INSTR_OPD_LEN_GP_REG)),
-    '4' : Register('4', Bits(uint=4, length=INSTR_OPD_LEN_GP_REG)),
-    '5' : Register('5', Bits(uint=5, length=INSTR_OPD_LEN_GP_REG)),
-    '6' : Register('6', Bits(uint=6, length=INSTR_OPD_LEN_GP_REG)),
-    '7' : Register('7', Bits(uint=7, length=INSTR_OPD_LEN_GP_REG)),
+    '0' : Register('0', 0, INSTR_OPD_LEN_GP_REG),
+    '1' : Register('1', 1, INSTR_OPD_LEN_GP_REG),
+    '2' : Register('2', 2, INSTR_OPD_LEN_GP_REG),
+    '3' : Register('3', 3, INSTR_OPD_LEN_GP_REG),
+    '4' : Register('4', 4, INSTR_OPD_LEN_GP_REG),
+    '5' : Register('5', 5, INSTR_OPD_LEN_GP_REG),
+    '6' : Register('6', 6, INSTR_OPD_LEN_GP_REG),
+    '7' : Register('7', 7, INSTR_OPD_LEN_GP_REG),
 }
 
 ''' VDOT registers don't need special names anymore
 VDOT_REGISTERS: RegisterTable = {
-    'V0' : Register('V0', Bits(uint=0, length=INSTR_OPD_LEN_VDOT_REG)),
-    'V1' : Register('V1', Bits(uint=1, length=INSTR_OPD_LEN_VDOT_REG)),
-    'V2' : Register('V2', Bits(uint=2, length=INSTR_OPD_LEN_VDOT_REG)),
-    'V3' : Register('V3', Bits(uint=3, length=INSTR_OPD_LEN_VDOT_REG)),
-    'V4' : Register('V4', Bits(uint=4, length=INSTR_OPD_LEN_VDOT_REG)),
-    'V5' : Register('V5', Bits(uint=5, length=INSTR_OPD_LEN_VDOT_REG)),
-    'V6' : Register('V6', Bits(uint=6, length=INSTR_OPD_LEN_VDOT_REG)),
-    'V7' : Register('V7', Bits(uint=7, length=INSTR_OPD_LEN_VDOT_REG)),
+    'V0' : Register('V0', 0, INSTR_OPD_LEN_VDOT_REG),
+    'V1' : Register('V1', 1, INSTR_OPD_LEN_VDOT_REG),
+    'V2' : Register('V2', 2, INSTR_OPD_LEN_VDOT_REG),
+    'V3' : Register('V3', 3, INSTR_OPD_LEN_VDOT_REG),
+    'V4' : Register('V4', 4, INSTR_OPD_LEN_VDOT_REG),
+    'V5' : Register('V5', 5, INSTR_OPD_LEN_VDOT_REG),
+    'V6' : Register('V6', 6, INSTR_OPD_LEN_VDOT_REG),
+    'V7' : Register('V7', 7, INSTR_OPD_LEN_VDOT_REG),
 }
 '''
 
 
 class Opcodes(Enum):
-    HALT = Opcode('HALT', Bits(uint=0 , length=INSTR_OPC_LEN))
-    NOP  = Opcode('NOP' , Bits(uint=1 , length=INSTR_OPC_LEN))
-    ADDI = Opcode('ADDI', Bits(uint=8 , length=INSTR_OPC_LEN))
-    SUBI = Opcode('SUBI', Bits(uint=9 , length=INSTR_OPC_LEN))
-    SLLI = Opcode('SLLI', Bits(uint=21, length=INSTR_OPC_LEN))
-    SRLI = Opcode('SRLI', Bits(uint=23, length=INSTR_OPC_LEN))
-    ST   = Opcode('ST'  , Bits(uint=16, length=INSTR_OPC_LEN))
-    LD   = Opcode('LD'  , Bits(uint=17, length=INSTR_OPC_LEN))
-    VLD  = Opcode('VLD' , Bits(uint=2 , length=INSTR_OPC_LEN))
-    VDOT = Opcode('VDOT', Bits(uint=3 , length=INSTR_OPC_LEN))
-    STU  = Opcode('STU' , Bits(uint=19, length=INSTR_OPC_LEN))
-    ADD  = Opcode('ADD' , Bits(uint=25, length=INSTR_OPC_LEN))
-    SUB  = Opcode('SUB' , Bits(uint=25, length=INSTR_OPC_LEN))
-    SEQ  = Opcode('SEQ' , Bits(uint=28, length=INSTR_OPC_LEN))
-    SLT  = Opcode('SLT' , Bits(uint=29, length=INSTR_OPC_LEN))
-    SLE  = Opcode('SLE' , Bits(uint=30, length=INSTR_OPC_LEN))
-    SCO  = Opcode('SCO' , Bits(uint=31, length=INSTR_OPC_LEN))
-    BEQZ = Opcode('BEQZ', Bits(uint=12, length=INSTR_OPC_LEN))
-    BLTZ = Opcode('BLTZ', Bits(uint=14, length=INSTR_OPC_LEN))
-    BGEZ = Opcode('BGEZ', Bits(uint=15, length=INSTR_OPC_LEN))
-    LBI  = Opcode('LBI' , Bits(uint=24, length=INSTR_OPC_LEN))
-    SLBI = Opcode('SLBI', Bits(uint=18, length=INSTR_OPC_LEN))
-    J    = Opcode('J'   , Bits(uint=4 , length=INSTR_OPC_LEN))
-    JR   = Opcode('JR'  , Bits(uint=5 , length=INSTR_OPC_LEN))
-    JALR = Opcode('JALR', Bits(uint=7 , length=INSTR_OPC_LEN))
+    HALT = Opcode('HALT', 0 , INSTR_OPC_LEN)
+    NOP  = Opcode('NOP' , 1 , INSTR_OPC_LEN)
+    ADDI = Opcode('ADDI', 8 , INSTR_OPC_LEN)
+    SUBI = Opcode('SUBI', 9 , INSTR_OPC_LEN)
+    SLLI = Opcode('SLLI', 21, INSTR_OPC_LEN)
+    SRLI = Opcode('SRLI', 23, INSTR_OPC_LEN)
+    ST   = Opcode('ST'  , 16, INSTR_OPC_LEN)
+    LD   = Opcode('LD'  , 17, INSTR_OPC_LEN)
+    VLD  = Opcode('VLD' , 2 , INSTR_OPC_LEN)
+    VDOT = Opcode('VDOT', 3 , INSTR_OPC_LEN)
+    STU  = Opcode('STU' , 19, INSTR_OPC_LEN)
+    ADD  = Opcode('ADD' , 25, INSTR_OPC_LEN)
+    SUB  = Opcode('SUB' , 25, INSTR_OPC_LEN)
+    SEQ  = Opcode('SEQ' , 28, INSTR_OPC_LEN)
+    SLT  = Opcode('SLT' , 29, INSTR_OPC_LEN)
+    SLE  = Opcode('SLE' , 30, INSTR_OPC_LEN)
+    SCO  = Opcode('SCO' , 31, INSTR_OPC_LEN)
+    BEQZ = Opcode('BEQZ', 12, INSTR_OPC_LEN)
+    BLTZ = Opcode('BLTZ', 14, INSTR_OPC_LEN)
+    BGEZ = Opcode('BGEZ', 15, INSTR_OPC_LEN)
+    LBI  = Opcode('LBI' , 24, INSTR_OPC_LEN)
+    SLBI = Opcode('SLBI', 18, INSTR_OPC_LEN)
+    J    = Opcode('J'   , 4 , INSTR_OPC_LEN)
+    JR   = Opcode('JR'  , 5 , INSTR_OPC_LEN)
+    JALR = Opcode('JALR', 7 , INSTR_OPC_LEN)
 
 
 class OperandProcessorDefs:
@@ -102,67 +112,198 @@ class OperandProcessorDefs:
     IMM11_UNSIGNED = ImmediateOperandProcessor(INSTR_OPD_LEN_IMM11   , is_signed=False)            # 11-bit unsigned immediate
     DISP11_SIGNED  = DisplacementOperandProcessor(INSTR_OPD_LEN_IMM11, is_signed=True )            # 11-bit signed displacement
     ZERO_PADDING   = ImplicitOperandProcessor.ZEROS(INSTR_LEN - INSTR_OPC_LEN)                     # Padding operand (all 0's)
-    ALU_OPC_ADD    = ImplicitOperandProcessor(Bits(uint=0, length=INSTR_OPD_LEN_ALU_OP))           # ALU opcode for addition instruction
-    ALU_OPC_SUB    = ImplicitOperandProcessor(Bits(uint=1, length=INSTR_OPD_LEN_ALU_OP))           # ALU opcode for subtraction instruction
+    ALU_OPC_ADD    = ImplicitOperandProcessor(0, INSTR_OPD_LEN_ALU_OP)                              # ALU opcode for addition instruction
+    ALU_OPC_SUB    = ImplicitOperandProcessor(1, INSTR_OPD_LEN_ALU_OP)                              # ALU opcode for subtraction instruction
     ALU_OPC_XX     = ImplicitOperandProcessor.DONT_CARES(INSTR_OPD_LEN_ALU_OP)                     # ALU opcode don't care
     
 
-INSTRUCTION_SET: InstructionSet = {
-    Opcodes.HALT.name : InstructionProcessor(Opcodes.HALT.value, pad = OperandProcessorDefs.ZERO_PADDING),
-    Opcodes.NOP.name  : InstructionProcessor(Opcodes.NOP.value , pad = OperandProcessorDefs.ZERO_PADDING),
-    Opcodes.ADDI.name : InstructionProcessor(Opcodes.ADDI.value, ['Rd','Rs','imm'], Rs = OperandProcessorDefs.REG_GP, Rd = OperandProcessorDefs.REG_GP, imm = OperandProcessorDefs.IMM5_SIGNED),
-    Opcodes.SUBI.name : InstructionProcessor(Opcodes.SUBI.value, ['Rd','Rs','imm'], Rs = OperandProcessorDefs.REG_GP, Rd = OperandProcessorDefs.REG_GP, imm = OperandProcessorDefs.IMM5_SIGNED),
-    Opcodes.SLLI.name : InstructionProcessor(Opcodes.SLLI.value, ['Rd','Rs','imm'], Rs = OperandProcessorDefs.REG_GP, Rd = OperandProcessorDefs.REG_GP, imm = OperandProcessorDefs.IMM5_UNSIGNED),
-    Opcodes.SRLI.name : InstructionProcessor(Opcodes.SRLI.value, ['Rd','Rs','imm'], Rs = OperandProcessorDefs.REG_GP, Rd = OperandProcessorDefs.REG_GP, imm = OperandProcessorDefs.IMM5_UNSIGNED),
-    Opcodes.ST.name   : InstructionProcessor(Opcodes.ST.value  , ['Rd','Rs','imm'], Rs = OperandProcessorDefs.REG_GP, Rd = OperandProcessorDefs.REG_GP, imm = OperandProcessorDefs.IMM5_SIGNED),
-    Opcodes.LD.name   : InstructionProcessor(Opcodes.LD.value  , ['Rd','Rs','imm'], Rs = OperandProcessorDefs.REG_GP, Rd = OperandProcessorDefs.REG_GP, imm = OperandProcessorDefs.IMM5_SIGNED),
-    Opcodes.VLD.name  : InstructionProcessor(Opcodes.VLD.value , ['Rd','Rs','imm'], Rs = OperandProcessorDefs.REG_GP, Rd = OperandProcessorDefs.REG_GP, imm = OperandProcessorDefs.IMM5_SIGNED),
-    Opcodes.VDOT.name : InstructionProcessor(Opcodes.VDOT.value, ['Rd','Rs','ac','pad'], Rs = OperandProcessorDefs.REG_GP, Rd = OperandProcessorDefs.REG_GP, ac = OperandProcessorDefs.IMM_BOOL, pad = ImplicitOperandProcessor.ZEROS(4)),
-    Opcodes.STU.name  : InstructionProcessor(Opcodes.STU.value , ['Rd','Rs','imm'], Rs = OperandProcessorDefs.REG_GP, Rd = OperandProcessorDefs.REG_GP, imm = OperandProcessorDefs.IMM5_SIGNED),
-    Opcodes.ADD.name  : InstructionProcessor(Opcodes.ADD.value , ['Rd','Rs','Rt','alu_op'], Rs = OperandProcessorDefs.REG_GP, Rt = OperandProcessorDefs.REG_GP, Rd = OperandProcessorDefs.REG_GP, alu_op=OperandProcessorDefs.ALU_OPC_ADD),
-    Opcodes.SUB.name  : InstructionProcessor(Opcodes.SUB.value , ['Rd','Rs','Rt','alu_op'], Rs = OperandProcessorDefs.REG_GP, Rt = OperandProcessorDefs.REG_GP, Rd = OperandProcessorDefs.REG_GP, alu_op=OperandProcessorDefs.ALU_OPC_SUB),
-    Opcodes.SEQ.name  : InstructionProcessor(Opcodes.SEQ.value , ['Rd','Rs','Rt','alu_op'], Rs = OperandProcessorDefs.REG_GP, Rt = OperandProcessorDefs.REG_GP, Rd = OperandProcessorDefs.REG_GP, alu_op=OperandProcessorDefs.ALU_OPC_XX),
-    Opcodes.SLT.name  : InstructionProcessor(Opcodes.SLT.value , ['Rd','Rs','Rt','alu_op'], Rs = OperandProcessorDefs.REG_GP, Rt = OperandProcessorDefs.REG_GP, Rd = OperandProcessorDefs.REG_GP, alu_op=OperandProcessorDefs.ALU_OPC_XX),
-    Opcodes.SLE.name  : InstructionProcessor(Opcodes.SLE.value , ['Rd','Rs','Rt','alu_op'], Rs = OperandProcessorDefs.REG_GP, Rt = OperandProcessorDefs.REG_GP, Rd = OperandProcessorDefs.REG_GP, alu_op=OperandProcessorDefs.ALU_OPC_XX),
-    Opcodes.SCO.name  : InstructionProcessor(Opcodes.SCO.value , ['Rd','Rs','Rt','alu_op'], Rs = OperandProcessorDefs.REG_GP, Rt = OperandProcessorDefs.REG_GP, Rd = OperandProcessorDefs.REG_GP, alu_op=OperandProcessorDefs.ALU_OPC_XX),
-    Opcodes.BEQZ.name : InstructionProcessor(Opcodes.BEQZ.value, Rs = OperandProcessorDefs.REG_GP, imm = OperandProcessorDefs.DISP8_SIGNED),
-    Opcodes.BLTZ.name : InstructionProcessor(Opcodes.BLTZ.value, Rs = OperandProcessorDefs.REG_GP, imm = OperandProcessorDefs.DISP8_SIGNED),
-    Opcodes.BGEZ.name : InstructionProcessor(Opcodes.BGEZ.value, Rs = OperandProcessorDefs.REG_GP, imm = OperandProcessorDefs.DISP8_SIGNED),
-    Opcodes.LBI.name  : InstructionProcessor(Opcodes.LBI.value , Rs = OperandProcessorDefs.REG_GP, imm = OperandProcessorDefs.IMM8_SIGNED),
-    Opcodes.SLBI.name : InstructionProcessor(Opcodes.SLBI.value, Rs = OperandProcessorDefs.REG_GP, imm = OperandProcessorDefs.IMM8_UNSIGNED),
-    Opcodes.J.name    : InstructionProcessor(Opcodes.J.value   , immediate = OperandProcessorDefs.DISP11_SIGNED),
-    Opcodes.JR.name   : InstructionProcessor(Opcodes.JR.value  , Rs = OperandProcessorDefs.REG_GP, imm = OperandProcessorDefs.DISP8_SIGNED),
-    Opcodes.JALR.name : InstructionProcessor(Opcodes.JALR.value, Rs = OperandProcessorDefs.REG_GP, imm = OperandProcessorDefs.DISP8_SIGNED),
-}
+'''
+Builds the instruction set on first use (instruction processors are stateless, so one table is shared).
+'''
+@lru_cache(maxsize=None)
+def get_instruction_set() -> InstructionSet:
+    return {
+        Opcodes.HALT.name : InstructionProcessor(Opcodes.HALT.value, pad = OperandProcessorDefs.ZERO_PADDING),
+        Opcodes.NOP.name  : InstructionProcessor(Opcodes.NOP.value , pad = OperandProcessorDefs.ZERO_PADDING),
+        Opcodes.ADDI.name : InstructionProcessor(Opcodes.ADDI.value, ['Rd','Rs','imm'], Rs = OperandProcessorDefs.REG_GP, Rd = OperandProcessorDefs.REG_GP, imm = OperandProcessorDefs.IMM5_SIGNED),
+        Opcodes.SUBI.name : InstructionProcessor(Opcodes.SUBI.value, ['Rd','Rs','imm'], Rs = OperandProcessorDefs.REG_GP, Rd = OperandProcessorDefs.REG_GP, imm = OperandProcessorDefs.IMM5_SIGNED),
+        Opcodes.SLLI.name : InstructionProcessor(Opcodes.SLLI.value, ['Rd','Rs','imm'], Rs = OperandProcessorDefs.REG_GP, Rd = OperandProcessorDefs.REG_GP, imm = OperandProcessorDefs.IMM5_UNSIGNED),
+        Opcodes.SRLI.name : InstructionProcessor(Opcodes.SRLI.value, ['Rd','Rs','imm'], Rs = OperandProcessorDefs.REG_GP, Rd = OperandProcessorDefs.REG_GP, imm = OperandProcessorDefs.IMM5_UNSIGNED),
+        Opcodes.ST.name   : InstructionProcessor(Opcodes.ST.value  , ['Rd','Rs','imm'], Rs = OperandProcessorDefs.REG_GP, Rd = OperandProcessorDefs.REG_GP, imm = OperandProcessorDefs.IMM5_SIGNED),
+        Opcodes.LD.name   : InstructionProcessor(Opcodes.LD.value  , ['Rd','Rs','imm'], Rs = OperandProcessorDefs.REG_GP, Rd = OperandProcessorDefs.REG_GP, imm = OperandProcessorDefs.IMM5_SIGNED),
+        Opcodes.VLD.name  : InstructionProcessor(Opcodes.VLD.value , ['Rd','Rs','imm'], Rs = OperandProcessorDefs.REG_GP, Rd = OperandProcessorDefs.REG_GP, imm = OperandProcessorDefs.IMM5_SIGNED),
+        Opcodes.VDOT.name : InstructionProcessor(Opcodes.VDOT.value, ['Rd','Rs','ac','pad'], Rs = OperandProcessorDefs.REG_GP, Rd = OperandProcessorDefs.REG_GP, ac = OperandProcessorDefs.IMM_BOOL, pad = ImplicitOperandProcessor.ZEROS(4)),
+        Opcodes.STU.name  : InstructionProcessor(Opcodes.STU.value , ['Rd','Rs','imm'], Rs = OperandProcessorDefs.REG_GP, Rd = OperandProcessorDefs.REG_GP, imm = OperandProcessorDefs.IMM5_SIGNED),
+        Opcodes.ADD.name  : InstructionProcessor(Opcodes.ADD.value , ['Rd','Rs','Rt','alu_op'], Rs = OperandProcessorDefs.REG_GP, Rt = OperandProcessorDefs.REG_GP, Rd = OperandProcessorDefs.REG_GP, alu_op=OperandProcessorDefs.ALU_OPC_ADD),
+        Opcodes.SUB.name  : InstructionProcessor(Opcodes.SUB.value , ['Rd','Rs','Rt','alu_op'], Rs = OperandProcessorDefs.REG_GP, Rt = OperandProcessorDefs.REG_GP, Rd = OperandProcessorDefs.REG_GP, alu_op=OperandProcessorDefs.ALU_OPC_SUB),
+        Opcodes.SEQ.name  : InstructionProcessor(Opcodes.SEQ.value , ['Rd','Rs','Rt','alu_op'], Rs = OperandProcessorDefs.REG_GP, Rt = OperandProcessorDefs.REG_GP, Rd = OperandProcessorDefs.REG_GP, alu_op=OperandProcessorDefs.ALU_OPC_XX),
+        Opcodes.SLT.name  : InstructionProcessor(Opcodes.SLT.value , ['Rd','Rs','Rt','alu_op'], Rs = OperandProcessorDefs.REG_GP, Rt = OperandProcessorDefs.REG_GP, Rd = OperandProcessorDefs.REG_GP, alu_op=OperandProcessorDefs.ALU_OPC_XX),
+        Opcodes.SLE.name  : InstructionProcessor(Opcodes.SLE.value , ['Rd','Rs','Rt','alu_op'], Rs = OperandProcessorDefs.REG_GP, Rt = OperandProcessorDefs.REG_GP, Rd = OperandProcessorDefs.REG_GP, alu_op=OperandProcessorDefs.ALU_OPC_XX),
+        Opcodes.SCO.name  : InstructionProcessor(Opcodes.SCO.value , ['Rd','Rs','Rt','alu_op'], Rs = OperandProcessorDefs.REG_GP, Rt = OperandProcessorDefs.REG_GP, Rd = OperandProcessorDefs.REG_GP, alu_op=OperandProcessorDefs.ALU_OPC_XX),
+        Opcodes.BEQZ.name : InstructionProcessor(Opcodes.BEQZ.value, Rs = OperandProcessorDefs.REG_GP, imm = OperandProcessorDefs.DISP8_SIGNED),
+        Opcodes.BLTZ.name : InstructionProcessor(Opcodes.BLTZ.value, Rs = OperandProcessorDefs.REG_GP, imm = OperandProcessorDefs.DISP8_SIGNED),
+        Opcodes.BGEZ.name : InstructionProcessor(Opcodes.BGEZ.value, Rs = OperandProcessorDefs.REG_GP, imm = OperandProcessorDefs.DISP8_SIGNED),
+        Opcodes.LBI.name  : InstructionProcessor(Opcodes.LBI.value , Rs = OperandProcessorDefs.REG_GP, imm = OperandProcessorDefs.IMM8_SIGNED),
+        Opcodes.SLBI.name : InstructionProcessor(Opcodes.SLBI.value, Rs = OperandProcessorDefs.REG_GP, imm = OperandProcessorDefs.IMM8_UNSIGNED),
+        Opcodes.J.name    : InstructionProcessor(Opcodes.J.value   , immediate = OperandProcessorDefs.DISP11_SIGNED),
+        Opcodes.JR.name   : InstructionProcessor(Opcodes.JR.value  , Rs = OperandProcessorDefs.REG_GP, imm = OperandProcessorDefs.DISP8_SIGNED),
+        Opcodes.JALR.name : InstructionProcessor(Opcodes.JALR.value, Rs = OperandProcessorDefs.REG_GP, imm = OperandProcessorDefs.DISP8_SIGNED),
+    }
+
+# Opcodes whose displacement is relative to the PC (JR/JALR displacements are relative to a register)
+PC_RELATIVE_OPCODES = [Opcodes.BEQZ.name, Opcodes.BLTZ.name, Opcodes.BGEZ.name, Opcodes.J.name]
+
+'''
+Builds the peephole rule table (see assembler.peephole) on first use. SUBI isn't listed: it computes
+imm - Rs, so SUBI $r, $r, #0 negates $r.
+'''
+@lru_cache(maxsize=None)
+def get_peephole_rules() -> 'PeepholeRuleTable':
+    from assembler.peephole import PeepholeRule, same_register_zero_immediate, followed_by_same_instruction, overwritten_by_next, jumps_to_next
+    return {
+        Opcodes.ADDI.name : [PeepholeRule('addi-zero', same_register_zero_immediate)],
+        Opcodes.SLLI.name : [PeepholeRule('shift-zero', same_register_zero_immediate)],
+        Opcodes.SRLI.name : [PeepholeRule('shift-zero', same_register_zero_immediate)],
+        Opcodes.NOP.name  : [PeepholeRule('nop-run', followed_by_same_instruction)],
+        Opcodes.LBI.name  : [PeepholeRule('lbi-overwritten', overwritten_by_next)],
+        Opcodes.J.name    : [PeepholeRule('jump-to-next', jumps_to_next)],
+    }
+
+'''
+Builds the table of branches that are relaxed when their label is out of range (see assembler.relaxation)
+on first use. There's no BNEZ, so BEQZ branches over a jump past the long jump. JR/JALR can't be
+relaxed: their displacement is added to a register, not to the PC.
+'''
+@lru_cache(maxsize=None)
+def get_branch_relaxations() -> 'RelaxationTable':
+    from assembler.relaxation import BranchRelaxation
+    return {
+        Opcodes.BEQZ.name : BranchRelaxation(),
+        Opcodes.BLTZ.name : BranchRelaxation(Opcodes.BGEZ.name),
+        Opcodes.BGEZ.name : BranchRelaxation(Opcodes.BLTZ.name),
+    }
+
+'''
+Builds the table of how every control transfer opcode moves the PC (see assembler.analysis) on first use.
+'''
+@lru_cache(maxsize=None)
+def get_control_flow_opcodes() -> 'ControlFlowTable':
+    from assembler.analysis import FLOW_BRANCH, FLOW_JUMP, FLOW_CALL, FLOW_INDIRECT, FLOW_HALT
+    return {
+        Opcodes.BEQZ.name : FLOW_BRANCH,
+        Opcodes.BLTZ.name : FLOW_BRANCH,
+        Opcodes.BGEZ.name : FLOW_BRANCH,
+        Opcodes.J.name    : FLOW_JUMP,
+        Opcodes.JALR.name : FLOW_CALL,
+        Opcodes.JR.name   : FLOW_INDIRECT,
+        Opcodes.HALT.name : FLOW_HALT,
+    }
+
+'''
+Builds the default cycle model (see assembler.analysis) on first use. It follows a WISC-SP13 like
+5-stage pipeline: one cycle per instruction, a memory stall on LD, VLD fetching a 4-word vector and VDOT
+taking 4 cycles in the multiply-accumulate unit, and taken branches and jumps flushing the 2 instructions
+fetched after them (they're resolved in decode).
+'''
+@lru_cache(maxsize=None)
+def get_cycle_model() -> 'CycleModel':
+    from assembler.analysis import CycleModel
+    return CycleModel({
+        Opcodes.LD.name   : 2,
+        Opcodes.VLD.name  : 4,
+        Opcodes.VDOT.name : 4,
+    }, taken_penalty=2)
+
+'''
+Builds the semantics table of the simulator (see assembler.simulator) on first use.
+'''
+@lru_cache(maxsize=None)
+def get_semantics() -> 'SemanticsTable':
+    from assembler.simulator import (halt, nop, add_immediate, subtract_from_immediate, shift_left_immediate, shift_right_immediate,
+                                     store, load, vector_load, vector_dot, store_update, add, subtract, set_if_equal, set_if_less_than, set_if_less_or_equal,
+                                     set_if_carry_out, branch_if_zero, branch_if_negative, branch_if_not_negative, load_byte_immediate, shift_load_byte_immediate,
+                                     jump, jump_register, jump_and_link_register)
+    return {
+        Opcodes.HALT.name : halt,
+        Opcodes.NOP.name  : nop,
+        Opcodes.ADDI.name : add_immediate,
+        Opcodes.SUBI.name : subtract_from_immediate,
+        Opcodes.SLLI.name : shift_left_immediate,
+        Opcodes.SRLI.name : shift_right_immediate,
+        Opcodes.ST.name   : store,
+        Opcodes.LD.name   : load,
+        Opcodes.VLD.name  : vector_load,
+        Opcodes.VDOT.name : vector_dot,
+        Opcodes.STU.name  : store_update,
+        Opcodes.ADD.name  : add,
+        Opcodes.SUB.name  : subtract,
+        Opcodes.SEQ.name  : set_if_equal,
+        Opcodes.SLT.name  : set_if_less_than,
+        Opcodes.SLE.name  : set_if_less_or_equal,
+        Opcodes.SCO.name  : set_if_carry_out,
+        Opcodes.BEQZ.name : branch_if_zero,
+        Opcodes.BLTZ.name : branch_if_negative,
+        Opcodes.BGEZ.name : branch_if_not_negative,
+        Opcodes.LBI.name  : load_byte_immediate,
+        Opcodes.SLBI.name : shift_load_byte_immediate,
+        Opcodes.J.name    : jump,
+        Opcodes.JR.name   : jump_register,
+        Opcodes.JALR.name : jump_and_link_register,
+    }
 
 class Directives(Enum):
     SEGMENT = auto()
     DEFINE = auto()
     ENTRY = auto()
+    WORD = auto()
+    FILL = auto()
+    INCBIN = auto()
+    INCLUDE = auto()
+
+'''
+Builds the directive table on first use.
+'''
+@lru_cache(maxsize=None)
+def get_directive_table() -> DirectiveTable:
+    return {
+        Directives.SEGMENT.name: SegmentDirectiveProcessor(Directives.SEGMENT.name),
+        Directives.DEFINE.name: DefineDirectiveProcessor(Directives.DEFINE.name, illegal_tokens = {
+            PREFIX_BLK_COMMENT_E, 
+            PREFIX_BLK_COMMENT_S, 
+            PREFIX_DIRECTIVE, 
+            PREFIX_IMMEDIATE, 
+            PREFIX_LINE_COMMENT, 
+            PREFIX_REGISTER, 
+            SUFFIX_LABEL, 
+            INSTR_OPD_DELIM
+        }),
+        Directives.ENTRY.name: None,
+        Directives.WORD.name: WordDirectiveProcessor(Directives.WORD.name),
+        Directives.FILL.name: FillDirectiveProcessor(Directives.FILL.name),
+        Directives.INCBIN.name: IncbinDirectiveProcessor(Directives.INCBIN.name),
+        Directives.INCLUDE.name: IncludeDirectiveProcessor(Directives.INCLUDE.name),
+    }
 
-DIRECTIVE_TABLE: DirectiveTable = {
-    Directives.SEGMENT.name: SegmentDirectiveProcessor(Directives.SEGMENT.name),
-    Directives.DEFINE.name: DefineDirectiveProcessor(Directives.DEFINE.name, illegal_tokens = {
-        PREFIX_BLK_COMMENT_E, 
-        PREFIX_BLK_COMMENT_S, 
-        PREFIX_DIRECTIVE, 
-        PREFIX_IMMEDIATE, 
-        PREFIX_LINE_COMMENT, 
-        PREFIX_REGISTER, 
-        SUFFIX_LABEL, 
-        INSTR_OPD_DELIM
-    }),
-    Directives.ENTRY.name: None,
-}
 
-class CustomPreprocessor(Preprocessor):
+class CustomPreprocessor(TokenPreprocessor):
+
+    def __init__(self):
+        # The lexer keeps block comment state so a new instance must be constructed for each preprocessor
+        lexer = Lexer(PREFIX_LINE_COMMENT, BlockCommentPrefix(PREFIX_BLK_COMMENT_S, PREFIX_BLK_COMMENT_E), PREFIX_DIRECTIVE, SUFFIX_LABEL,
+                      PREFIX_REGISTER, PREFIX_IMMEDIATE, INSTR_OPD_DELIM)
+        super().__init__(lexer, get_directive_table())
+
+'''
+The same preprocessing as CustomPreprocessor done by the original chain of string processing tasks.
+'''
+class CustomTaskPreprocessor(Preprocessor):
 
     def __init__(self):
         # Preprocessor tasks can have state so new instances must be constructed for each preprocessor
         PREPROCESSOR_TASKS: List[PreprocessorTask] = [
             StripCommentsTask(PREFIX_LINE_COMMENT, BlockCommentPrefix(PREFIX_BLK_COMMENT_S, PREFIX_BLK_COMMENT_E)),
             StripWhitespaceTask(),
-            DirectiveTask(PREFIX_DIRECTIVE, DIRECTIVE_TABLE),
+            DirectiveTask(PREFIX_DIRECTIVE, get_directive_table()),
             LabelTask(SUFFIX_LABEL),
             SubstituteTokensTask(),
         ]
@@ -172,10 +313,66 @@ class CustomSynthesizer(Synthesizer):
 
     def __init__(self):
         # Instruction processors are stateless so instances can be shared across synthesizer instances
-        super().__init__(INSTRUCTION_SET)
+        super().__init__(get_instruction_set())
 
 
 class CustomAssembler(Assembler):
 
-    def __init__(self):
-        super().__init__(CustomPreprocessor(), CustomSynthesizer())
+    def __init__(self, verbosity: int = VERBOSITY_QUIET):
+        from assembler.peephole import PeepholeOptimizer
+        from assembler.relaxation import BranchRelaxer
+        super().__init__(CustomPreprocessor(), CustomSynthesizer(), verbosity)
+        self.peephole = PeepholeOptimizer(get_instruction_set(), get_peephole_rules(), PC_RELATIVE_OPCODES)
+        self.relaxer = BranchRelaxer(get_instruction_set(), get_branch_relaxations(), Opcodes.J.name, PC_RELATIVE_OPCODES)
+
+
+'''
+Builds the CustomDisassembler class on first use (its base class is only imported then).
+'''
+@lru_cache(maxsize=None)
+def get_disassembler_class() -> type:
+    from assembler.disassembler import Disassembler
+
+    class CustomDisassembler(Disassembler):
+
+        def __init__(self):
+            # JR/JALR displacements are relative to a register rather than the PC, so they never become labels
+            super().__init__(get_instruction_set(), PC_RELATIVE_OPCODES)
+
+    CustomDisassembler.__module__, CustomDisassembler.__qualname__ = __name__, 'CustomDisassembler'
+    return CustomDisassembler
+
+'''
+Builds the CustomSimulator class on first use (its base class is only imported then).
+'''
+@lru_cache(maxsize=None)
+def get_simulator_class() -> type:
+    from assembler.simulator import Simulator
+
+    class CustomSimulator(Simulator):
+
+        def __init__(self, model: 'CycleModel' = None):
+            super().__init__(get_instruction_set(), get_semantics(), model if model is not None else get_cycle_model())
+
+    CustomSimulator.__module__, CustomSimulator.__qualname__ = __name__, 'CustomSimulator'
+    return CustomSimulator
+
+
+# Module level names for the lazily built tables and classes (PEP 562)
+LAZY_TABLES = {
+    'INSTRUCTION_SET': get_instruction_set,
+    'DIRECTIVE_TABLE': get_directive_table,
+    'PEEPHOLE_RULES': get_peephole_rules,
+    'BRANCH_RELAXATIONS': get_branch_relaxations,
+    'CONTROL_FLOW_OPCODES': get_control_flow_opcodes,
+    'CYCLE_MODEL': get_cycle_model,
+    'SEMANTICS': get_semantics,
+    'CustomDisassembler': get_disassembler_class,
+    'CustomSimulator': get_simulator_class,
+}
+
+def __getattr__(name: str):
+    try:
+        return LAZY_TABLES[name]()
+    except KeyError:
+        raise AttributeError('module \'{}\' has no attribute \'{}\''.format(__name__, name))
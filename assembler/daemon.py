@@ -0,0 +1,162 @@
+import asyncio
+import io
+import json
+import os
+import signal
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional, Tuple
+
+from assembler.custom_assembler import CustomAssembler
+from assembler.daemon_client import FRAME_HEADER, MAX_FRAME_SIZE, encode_frame
+from assembler.exceptions import AssemblerException
+from assembler.listing import Listing
+from assembler.writers import IMAGE_WRITERS, encode_image
+
+DEFAULT_WORKERS = 2
+DEFAULT_MAX_PENDING = 64
+
+'''
+Persistent assembler server listening on a Unix domain socket (see assembler.daemon_client for the
+wire protocol).
+
+The server keeps a fixed set of warm CustomAssembler instances. A request waits for a free instance,
+so at most 'workers' requests are assembled at once (in a thread pool, keeping the event loop free
+to accept and read other requests). Requests beyond 'max_pending' in flight are answered right away
+with a busy response, which clients retry with backoff. Responses are written with drain() so slow
+readers can't make the server buffer unbounded amounts of output. Files pulled in with .include are
+read and lowered once per version for all requests (see assembler.includes).
+'''
+class AssemblerDaemon(object):
+
+    def __init__(self, socket_path: str, workers: int = DEFAULT_WORKERS, max_pending: int = DEFAULT_MAX_PENDING):
+        self.socket_path = socket_path
+        self.workers = workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self.requests_served = 0
+        self.__executor = ThreadPoolExecutor(max_workers=workers)
+        self.__assemblers: asyncio.Queue = None
+
+    '''
+    Assembles a request with the given assembler (runs in a worker thread).
+    Returns the response header, the image bytes and the listing bytes.
+    '''
+    @staticmethod
+    def assemble_request(assembler: CustomAssembler, request: Dict[str, Any]) -> Tuple[Dict[str, Any], bytes, bytes]:
+        format = request.get('format', 'binary')
+        if format not in IMAGE_WRITERS:
+            return AssemblerDaemon.error_response('Invalid output format \'{}\'.'.format(format))
+        listing = Listing() if request.get('listing') else None
+        assembler.include_paths = request.get('include_paths', [])
+        assembler.relax = request.get('relax', True)
+        try:
+            if 'path' in request:
+                words = assembler.assemble_file(request['path'], as_words=True, listing=listing)
+            else:
+                words = assembler.assemble(request.get('source', ''), request.get('filename'), as_words=True, listing=listing)
+        except AssemblerException as e:
+            return { 'ok': False, 'errors': [ { 'tag': e.tag, 'msg': str(e.args[0]), 'filename': e.filename, 'lineno': e.lineno, 'line': e.line, 'at_token': e.at_token, 'column': e.column } ] }, b'', b''
+        except (OSError, UnicodeDecodeError, ValueError) as e:
+            return AssemblerDaemon.error_response(str(e), request.get('path'))
+
+        image = encode_image(words, format, request.get('byteorder', 'big'))
+        listing_bytes = b''
+        if listing is not None:
+            listing_out = io.StringIO()
+            listing.write(listing_out)
+            listing_bytes = listing_out.getvalue().encode('utf-8')
+        return { 'ok': True, 'words': len(words), 'image_size': len(image), 'listing_size': len(listing_bytes),
+                 'relaxed': [branch._asdict() for branch in assembler.relaxed_branches] }, image, listing_bytes
+
+    @staticmethod
+    def error_response(msg: str, filename: str = None) -> Tuple[Dict[str, Any], bytes, bytes]:
+        error = { 'tag': 'ERROR', 'msg': msg }
+        if filename is not None:
+            error['filename'] = filename
+        return { 'ok': False, 'errors': [ error ] }, b'', b''
+
+    '''
+    Returns the error response for a malformed assemble request, or None if it's well formed.
+    '''
+    @staticmethod
+    def check_request(request: Dict[str, Any]) -> Optional[Tuple[Dict[str, Any], bytes, bytes]]:
+        for key in ('path', 'source', 'filename', 'format', 'byteorder'):
+            if request.get(key) is not None and not isinstance(request[key], str):
+                return AssemblerDaemon.error_response('Invalid request: \'{}\' must be a string.'.format(key))
+        include_paths = request.get('include_paths', [])
+        if not isinstance(include_paths, list) or not all(isinstance(path, str) for path in include_paths):
+            return AssemblerDaemon.error_response('Invalid request: \'include_paths\' must be a list of strings.')
+        return None
+
+    async def __handle_request(self, request: Dict[str, Any]) -> Tuple[Dict[str, Any], bytes, bytes]:
+        if not isinstance(request, dict):
+            return AssemblerDaemon.error_response('Invalid request: expected a JSON object.')
+        op = request.get('op')
+        if op == 'ping':
+            return { 'ok': True, 'pending': self.pending, 'served': self.requests_served }, b'', b''
+        if op != 'assemble':
+            return AssemblerDaemon.error_response('Unknown request op \'{}\'.'.format(op))
+        invalid = AssemblerDaemon.check_request(request)
+        if invalid is not None:
+            return invalid
+        if self.pending >= self.max_pending:
+            return { 'ok': False, 'busy': True }, b'', b''
+
+        self.pending += 1
+        try:
+            assembler = await self.__assemblers.get() # bounds the number of requests assembled at once
+            try:
+                return await asyncio.get_event_loop().run_in_executor(self.__executor, AssemblerDaemon.assemble_request, assembler, request)
+            except Exception as e: # a bug shouldn't drop the connection (or the daemon) without a response
+                return AssemblerDaemon.error_response('Internal assembler error: {}: {}'.format(type(e).__name__, e), request.get('path'))
+            finally:
+                self.__assemblers.put_nowait(assembler)
+        finally:
+            self.pending -= 1
+            self.requests_served += 1
+
+    async def __handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                try:
+                    size, = FRAME_HEADER.unpack(await reader.readexactly(FRAME_HEADER.size))
+                except asyncio.IncompleteReadError:
+                    break # client closed the connection
+                if size > MAX_FRAME_SIZE:
+                    break
+                try:
+                    request = json.loads((await reader.readexactly(size)).decode('utf-8'))
+                except ValueError:
+                    request = {}
+                header, image, listing = await self.__handle_request(request)
+                writer.write(encode_frame(header))
+                writer.write(image)
+                writer.write(listing)
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self):
+        self.__assemblers = asyncio.Queue()
+        for _ in range(self.workers):
+            self.__assemblers.put_nowait(CustomAssembler())
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path) # stale socket from a previous run
+        server = await asyncio.start_unix_server(self.__handle_connection, path=self.socket_path)
+        asyncio.get_event_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel) # shut down cleanly on SIGTERM
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+
+    def run(self):
+        try:
+            asyncio.run(self.serve())
+        except (KeyboardInterrupt, asyncio.CancelledError):
+            pass
+        finally:
+            self.__executor.shutdown(wait=False)
@@ -0,0 +1,118 @@
+import json
+import socket
+import struct
+import time
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+'''
+Wire protocol shared by the assembler daemon (assembler.daemon) and its clients.
+
+Every message is a frame: a 4-byte big-endian length followed by that many bytes of UTF-8 JSON.
+A request frame holds an object with an 'op' ('assemble' or 'ping'). The response to an assemble
+request is a JSON header frame followed by 'image_size' bytes of image data and 'listing_size'
+bytes of UTF-8 listing text (when requested).
+
+This module only depends on the standard library so that client mode starts fast.
+'''
+FRAME_HEADER = struct.Struct('>I')
+MAX_FRAME_SIZE = 64 << 20
+BUSY_RETRIES = 50
+BUSY_RETRY_DELAY = 0.05 # seconds, doubled after each retry up to 1 second
+
+class DaemonError(Exception):
+    pass
+
+
+def encode_frame(message: Dict[str, Any]) -> bytes:
+    payload = json.dumps(message).encode('utf-8')
+    return FRAME_HEADER.pack(len(payload)) + payload
+
+
+def recv_exactly(sock: socket.socket, size: int) -> bytes:
+    buf = bytearray(size)
+    view = memoryview(buf)
+    received = 0
+    while received < size:
+        n = sock.recv_into(view[received:])
+        if not n:
+            raise DaemonError('Connection closed by the assembler daemon.')
+        received += n
+    return bytes(buf)
+
+
+def recv_frame(sock: socket.socket) -> Dict[str, Any]:
+    size, = FRAME_HEADER.unpack(recv_exactly(sock, FRAME_HEADER.size))
+    if size > MAX_FRAME_SIZE:
+        raise DaemonError('Response frame of {} bytes is too large.'.format(size))
+    return json.loads(recv_exactly(sock, size).decode('utf-8'))
+
+
+'''
+Result of an assemble request. errors holds the daemon's structured diagnostics (dicts with the
+fields of AssemblerException) when success is False. relaxed holds the fields of every branch that was
+relaxed (see assembler.relaxation.RelaxedBranch).
+'''
+class DaemonResult(NamedTuple):
+    success: bool
+    words: int
+    image: bytes
+    listing: Optional[str]
+    errors: List[Dict[str, Any]]
+    relaxed: List[Dict[str, Any]] = []
+
+
+'''
+Synchronous client for the assembler daemon. One connection is reused for every request.
+'''
+class DaemonClient(object):
+
+    def __init__(self, socket_path: str, timeout: float = None):
+        self.socket_path = socket_path
+        self.__sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.__sock.settimeout(timeout)
+        self.__sock.connect(socket_path)
+
+    def close(self):
+        self.__sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __request(self, message: Dict[str, Any]) -> Tuple[Dict[str, Any], bytes, bytes]:
+        self.__sock.sendall(encode_frame(message))
+        header = recv_frame(self.__sock)
+        image = recv_exactly(self.__sock, header.get('image_size', 0))
+        listing = recv_exactly(self.__sock, header.get('listing_size', 0))
+        return header, image, listing
+
+    def ping(self) -> bool:
+        header, _, _ = self.__request({'op': 'ping'})
+        return header.get('ok', False)
+
+    '''
+    Asks the daemon to assemble a file (path) or source text (source). include_paths must be absolute
+    (the daemon has its own working directory). relax=False fails on out of range branches instead of
+    relaxing them. Retries with backoff while the daemon reports that it's busy.
+    '''
+    def assemble(self, path: str = None, source: str = None, filename: str = None, format: str = 'binary', byteorder: str = 'big', listing: bool = False, include_paths: List[str] = (), relax: bool = True) -> DaemonResult:
+        message = {'op': 'assemble', 'format': format, 'byteorder': byteorder, 'listing': listing, 'relax': relax}
+        if include_paths:
+            message['include_paths'] = list(include_paths)
+        if path is not None:
+            message['path'] = path
+        else:
+            message['source'] = source
+            message['filename'] = filename
+        delay = BUSY_RETRY_DELAY
+        for _ in range(BUSY_RETRIES):
+            header, image, listing_bytes = self.__request(message)
+            if not header.get('busy'):
+                break
+            time.sleep(delay)
+            delay = min(delay * 2, 1.0)
+        else:
+            raise DaemonError('The assembler daemon is busy.')
+        return DaemonResult(header.get('ok', False), header.get('words', 0), image, listing_bytes.decode('utf-8') if listing else None, header.get('errors', []), header.get('relaxed', []))
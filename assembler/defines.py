@@ -0,0 +1,96 @@
+import itertools
+import re
+from collections.abc import Mapping
+from typing import Dict, Iterator, Optional, Pattern, Set
+
+# Matches a single identifier-like token. Define names made up entirely of these characters
+# can be found with a plain hash lookup per token instead of a regex alternation.
+WORD_TOKEN_RE: Pattern = re.compile(r'\w+')
+
+
+'''
+Table of define directive names and their substitution values.
+
+The table owns the substitution engine used by the preprocessor. Names that consist only of word
+characters (the common case) are resolved by scanning each line's tokens once and looking them up in
+the table, so the per-line cost doesn't depend on how many defines exist. Names containing other
+characters can't be found by token lookup, so those are matched with a precompiled '\\bNAME\\b'
+alternation that's rebuilt only when such a name is added (never per line).
+'''
+class DefineTable(Mapping):
+
+    def __init__(self):
+        self.__values: Dict[str, str] = {}
+        self.__irregular_names: Dict[str, None] = {} # names that aren't a single word token (ordered set)
+        self.__irregular_re: Optional[Pattern] = None
+        self.__irregular_dirty = False
+
+    def __getitem__(self, name: str) -> str:
+        return self.__values[name]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.__values)
+
+    def __len__(self) -> int:
+        return len(self.__values)
+
+    '''
+    Adds (or redefines) a define. The precompiled matcher is only invalidated once the table
+    holds a name outside the word-token fast path.
+    '''
+    def add(self, name: str, value: str):
+        if name not in self.__values:
+            if not WORD_TOKEN_RE.fullmatch(name):
+                self.__irregular_names[name] = None
+            if self.__irregular_names:
+                self.__irregular_dirty = True # the alternation covers every name, so any new name invalidates it
+        self.__values[name] = value
+
+    '''
+    Whether this table and other substitute the same values into a line made up of the given word
+    tokens (see WORD_TOKEN_RE). Names that aren't word tokens can match anywhere, so if either table
+    has one the tables must be identical.
+    '''
+    def agrees_on(self, other: 'DefineTable', tokens: Set[str]) -> bool:
+        values, other_values = self.__values, other.__values
+        if self.__irregular_names or other.__irregular_names:
+            return list(values.items()) == list(other_values.items())
+        if len(tokens) < len(values) + len(other_values):
+            return all(values.get(token) == other_values.get(token) for token in tokens)
+        return all(values.get(name) == other_values.get(name) for name in itertools.chain(values, other_values) if name in tokens)
+
+    def clear(self):
+        self.__values.clear()
+        self.__irregular_names.clear()
+        self.__irregular_re = None
+        self.__irregular_dirty = False
+
+    def __replace_match(self, match) -> str:
+        return self.__values[match.group(0)]
+
+    def __replace_token(self, match) -> str:
+        token = match.group(0)
+        return self.__values.get(token, token)
+
+    def __get_matcher(self) -> Pattern:
+        if self.__irregular_dirty:
+            # Same matching rules as the original per-line regex, but built once per added name.
+            # Every name is included so the leftmost-match/first-alternative behavior is unchanged.
+            self.__irregular_re = re.compile('|'.join(r'\b%s\b' % re.escape(s) for s in self.__values))
+            self.__irregular_dirty = False
+        return self.__irregular_re
+
+    '''
+    Replaces every whole-token occurrence of a define name in the line with its value.
+    Substitution is a single left-to-right pass; substituted values are not rescanned.
+    '''
+    def substitute(self, line: str) -> str:
+        if not line or not self.__values:
+            return line
+        if self.__irregular_names:
+            return self.__get_matcher().sub(self.__replace_match, line)
+        values = self.__values
+        for token in WORD_TOKEN_RE.findall(line):
+            if token in values:
+                return WORD_TOKEN_RE.sub(self.__replace_token, line)
+        return line # fast path: no defined identifiers on this line
@@ -1,5 +1,7 @@
 from typing import List
-from assembler.memory import MemorySegment
+from assembler.defines import WORD_TOKEN_RE
+from assembler.isa import IMMEDIATE_PREFIX, parse_literal
+from assembler.memory import DATA_WORD_BITS, MemorySegment
 from .directive_processor import DirectiveProcessor
 from assembler.state import AssemblerPassState
 from assembler.exceptions import AssemblerError
@@ -55,4 +57,118 @@ class DefineDirectiveProcessor(DirectiveProcessor):
             aps.add_define(def_name.strip(), def_val) # add to the definition table
             
         except ValueError:
-            raise AssemblerError('Invalid format for define directive. Expected \'.define <NAME> <VALUE>\'', aps.filename, aps.lineno, at_token=value)
\ No newline at end of file
+            raise AssemblerError('Invalid format for define directive. Expected \'.define <NAME> <VALUE>\'', aps.filename, aps.lineno, at_token=value)
+
+'''
+Base class of the data directives, which place data in the DATA segment. Data words are literals in
+decimal, hex, octal or binary (optionally with the immediate prefix) that fit in a data word, or (where
+allowed) symbols, whose address is filled in once the program is laid out.
+'''
+class DataDirectiveProcessor(DirectiveProcessor):
+
+    def check_segment(self, aps: AssemblerPassState):
+        if aps.segment is not MemorySegment.DATA:
+            raise AssemblerError('Data directive \'.{}\' must be placed in the DATA segment (\'.segment DATA\').'.format(self.name.lower()), aps.filename, aps.lineno, None, None)
+
+    '''
+    Parses a data word literal. Raises an exception if it's malformed or doesn't fit in a data word.
+    '''
+    def parse_word(self, text: str, aps: AssemblerPassState) -> int:
+        literal = text[len(IMMEDIATE_PREFIX):] if text.startswith(IMMEDIATE_PREFIX) else text
+        try:
+            value, width = parse_literal(literal)
+        except Exception:
+            raise AssemblerError('Invalid data word \'{}\'.'.format(text), aps.filename, aps.lineno, at_token=text)
+        if (width or DATA_WORD_BITS) > DATA_WORD_BITS or not -(1 << (DATA_WORD_BITS - 1)) <= value < (1 << DATA_WORD_BITS):
+            raise AssemblerError('Data word \'{}\' doesn\'t fit in {} bits.'.format(text, DATA_WORD_BITS), aps.filename, aps.lineno, at_token=text)
+        return value & ((1 << DATA_WORD_BITS) - 1)
+
+    def is_literal(self, text: str) -> bool:
+        return text[:1].isdigit() or text[:1] in ('-', '+', IMMEDIATE_PREFIX)
+
+
+'''
+Processes "word" directives: '.word <value>[, <value>...]' places data words. Values may be literals,
+defines or symbols (the word then holds the symbol's address).
+'''
+class WordDirectiveProcessor(DataDirectiveProcessor):
+
+    def process(self, value: str, aps: AssemblerPassState):
+        self.check_segment(aps)
+        if not value: raise AssemblerError('Expected values after directive token \'.word\'.', aps.filename, aps.lineno, None, None)
+        if aps.get_define_table():
+            value = aps.substitute_defines(value)
+        words, refs = [], []
+        for text in value.split(','):
+            text = text.strip()
+            if self.is_literal(text):
+                words.append(self.parse_word(text, aps))
+            elif WORD_TOKEN_RE.fullmatch(text):
+                refs.append((len(words), text))
+                words.append(0)
+            else:
+                raise AssemblerError('Invalid data word \'{}\'. Expected a literal or a symbol.'.format(text), aps.filename, aps.lineno, at_token=text or value)
+        aps.data.add_words(words, aps.lineno, refs)
+
+
+'''
+Processes "fill" directives: '.fill <count>[, <value>]' places count copies of a data word (0 by default).
+'''
+class FillDirectiveProcessor(DataDirectiveProcessor):
+
+    def process(self, value: str, aps: AssemblerPassState):
+        self.check_segment(aps)
+        if not value: raise AssemblerError('Expected count after directive token \'.fill\'.', aps.filename, aps.lineno, None, None)
+        if aps.get_define_table():
+            value = aps.substitute_defines(value)
+        count_text, _, fill_text = (text.strip() for text in value.partition(','))
+        try:
+            count = parse_literal(count_text)[0]
+        except Exception:
+            count = -1
+        if count < 0:
+            raise AssemblerError('Invalid fill count \'{}\'. Expected a non-negative literal.'.format(count_text), aps.filename, aps.lineno, at_token=count_text)
+        aps.data.add_fill(count, self.parse_word(fill_text, aps) if fill_text else 0, aps.lineno)
+
+
+'''
+Processes "incbin" directives: '.incbin <file>' places a binary file's bytes as big-endian data words
+(an odd last byte is padded with a zero byte). Relative paths are relative to the source file's
+directory. The file is only memory mapped when the program is laid out (see DataSegment).
+'''
+class IncbinDirectiveProcessor(DataDirectiveProcessor):
+
+    def process(self, value: str, aps: AssemblerPassState):
+        self.check_segment(aps)
+        filepath = value.strip('"\'') if value else value
+        if not filepath: raise AssemblerError('Expected file path after directive token \'.incbin\'.', aps.filename, aps.lineno, None, None)
+        import os
+        if aps.filename and not os.path.isabs(filepath):
+            filepath = os.path.join(os.path.dirname(aps.filename), filepath)
+        try:
+            num_bytes = os.stat(filepath).st_size
+        except OSError as e:
+            raise AssemblerError('Can\'t read binary file \'{}\': {}'.format(filepath, e.strerror), aps.filename, aps.lineno, at_token=value)
+        aps.data.add_file(filepath, num_bytes, aps.lineno)
+
+
+'''
+Processes "include" directives: '.include <file>' assembles another source file in place of the
+directive, as if its lines were written there (its labels, defines and data join the including file's).
+Relative paths are looked up next to the including file, then in the include paths (see
+assembler.includes.find_include()). A file can't include itself, directly or not.
+'''
+class IncludeDirectiveProcessor(DirectiveProcessor):
+
+    def process(self, value: str, aps: AssemblerPassState):
+        name = value.strip('"\'') if value else value
+        if not name: raise AssemblerError('Expected file path after directive token \'.include\'.', aps.filename, aps.lineno, None, None)
+        if aps.include is None:
+            raise AssemblerError('Include directives aren\'t supported in this mode.', aps.filename, aps.lineno, at_token=value)
+        from assembler.includes import find_include
+        filepath = find_include(name, aps.filename, aps.include_paths)
+        if filepath is None:
+            raise AssemblerError('Can\'t find include file \'{}\'.'.format(name), aps.filename, aps.lineno, at_token=value)
+        if filepath in aps.include_stack:
+            raise AssemblerError('Circular include of \'{}\' ({}).'.format(name, ' -> '.join(aps.include_stack + [filepath])), aps.filename, aps.lineno, at_token=value)
+        aps.include(filepath)
@@ -0,0 +1,275 @@
+import mmap
+import sys
+from array import array
+from typing import IO, Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+from assembler.isa import InstructionSet, ImplicitOperandProcessor, RegisterOperandProcessor, DisplacementOperandProcessor, REGISTER_PREFIX, IMMEDIATE_PREFIX, to_signed
+from assembler.writers import IMAGE_WRITERS, WORD_TYPECODE
+
+INDENT = '    '         # instructions are indented, labels are not
+LABEL_PREFIX = 'L_'     # synthesized labels are named after their address (ex. L_002a)
+ADDRESS_COLUMN = 32     # column of the address/encoding comment with addresses=True
+WRITE_CHUNK_LINES = 1 << 16
+DATA_WORDS_PER_LINE = 8 # words per .word line of a disassembled DATA segment
+
+'''
+A decoded instruction word. operands are the operand texts in source order. If the instruction has a
+PC relative displacement that can be turned into a label, target_operand is its index in operands
+and displacement its (signed) value.
+'''
+class DecodedInstruction(NamedTuple):
+    mnemonic: str
+    operands: Tuple[str, ...]
+    target_operand: Optional[int] = None
+    displacement: Optional[int] = None
+
+    def text(self, target: str = None) -> str:
+        operands = self.operands
+        if target is not None:
+            operands = operands[:self.target_operand] + (target,) + operands[self.target_operand + 1:]
+        return '{} {}'.format(self.mnemonic, ', '.join(operands)) if operands else self.mnemonic
+
+
+'''
+Result of disassembling an image. lines is the program text (one label or instruction per line,
+without line endings). Words that don't decode to an instruction are written as comments, so the
+text only reassembles to the same image if undecodable is 0.
+'''
+class Disassembly(NamedTuple):
+    lines: List[str]
+    words: int
+    labels: int
+    undecodable: int
+
+    def write(self, fp: IO):
+        lines = self.lines
+        for start in range(0, len(lines), WRITE_CHUNK_LINES):
+            fp.write('\n'.join(lines[start:start + WRITE_CHUNK_LINES]))
+            fp.write('\n')
+
+    def write_file(self, filepath: str):
+        with open(filepath, 'w') as fp:
+            self.write(fp)
+
+
+'''
+Imports numpy if it's installed. The disassembler works without it; numpy only vectorizes the bulk steps.
+'''
+def import_numpy():
+    try:
+        import numpy
+        return numpy
+    except ImportError:
+        return None
+
+
+'''
+Reads an image written by assemble.py (see assembler.writers). Binary images are memory mapped; with
+numpy the words are a zero-copy view of the mapping, otherwise they're copied into an array('H') in
+one go. Text and hex images have one word per line.
+'''
+def load_image(filepath: str, format: str = 'binary', byteorder: str = 'big', numpy = None) -> Sequence[int]:
+    if format not in IMAGE_WRITERS:
+        raise ValueError('Invalid image format \'{}\'. Expected one of {}.'.format(format, ', '.join(IMAGE_WRITERS)))
+    if not IMAGE_WRITERS[format].BINARY:
+        base = 16 if format == 'hex' else 2
+        with open(filepath, 'r') as fp:
+            values = [int(line, base) for line in fp if line.strip()]
+        return numpy.array(values, dtype=numpy.uint16) if numpy else array(WORD_TYPECODE, values)
+
+    if byteorder not in ('big', 'little'):
+        raise ValueError('Invalid byte order \'{}\'. Expected \'big\' or \'little\'.'.format(byteorder))
+    with open(filepath, 'rb') as fp:
+        size = fp.seek(0, 2)
+        if size % 2:
+            raise ValueError('Image size ({} bytes) is not a whole number of 16-bit words.'.format(size))
+        if size == 0:
+            return numpy.zeros(0, dtype=numpy.uint16) if numpy else array(WORD_TYPECODE)
+        mapped = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+    if numpy:
+        return numpy.frombuffer(mapped, dtype='>u2' if byteorder == 'big' else '<u2') # keeps the mapping alive
+    words = array(WORD_TYPECODE)
+    words.frombytes(mapped)
+    mapped.close()
+    if byteorder != sys.byteorder:
+        words.byteswap()
+    return words
+
+
+DecodeTable = List[List[Tuple[int, int, str]]] # (fixed bits mask, fixed bits, opcode name) of every instruction, by opcode bits
+
+'''
+Builds the decode table of an instruction set (see Disassembler): slot i lists the instructions whose
+opcode bits are i, most specific first.
+'''
+def decode_table(instr_set: InstructionSet, word_length: int, opcode_length: int) -> DecodeTable:
+    table: DecodeTable = [ [] for _ in range(1 << opcode_length) ]
+    word_mask = (1 << word_length) - 1
+    for name, instr_proc in instr_set.items():
+        fixed_mask = word_mask
+        for _, opd_proc, shift in instr_proc.fields:
+            if type(opd_proc) != ImplicitOperandProcessor:
+                fixed_mask &= ~(((1 << opd_proc.length) - 1) << shift)
+        table[instr_proc.opcode_word >> (word_length - opcode_length)].append((fixed_mask, instr_proc.implicit_word, name))
+    for slot in table:
+        slot.sort(key=lambda entry: -bin(entry[0]).count('1')) # most specific first
+    return table
+
+
+'''
+Table driven disassembler for images produced by an assembler with the same instruction set.
+
+The decode table is derived from the instruction set: it's indexed by the opcode bits at the top of the
+word and every slot lists the instructions with that opcode, along with the bits their opcode and
+implicit fields (ex. ALU sub-operations, padding) fix. A word decodes to the first instruction whose
+fixed bits match, so instructions sharing an opcode (ADD/SUB) are told apart by their sub-operation.
+Words with any other value in a fixed field don't decode, since they couldn't be reassembled.
+
+Only distinct word values are decoded (programs reuse few of the 65536 possible words), and rendering
+is a table lookup per word. Displacements of the instructions in label_opcodes (PC relative branches
+and jumps) are replaced with synthesized labels when the target is inside the image.
+'''
+class Disassembler(object):
+
+    def __init__(self, instr_set: InstructionSet, label_opcodes: Iterable[str] = None):
+        self.word_length: int = max((instr_proc.length for instr_proc in instr_set.values()), default=0)
+        self.opcode_length: int = min((instr_proc.opcode.length for instr_proc in instr_set.values()), default=0)
+        self.__instr_set = instr_set
+        self.__label_opcodes = set(label_opcodes) if label_opcodes is not None else None
+        self.__table = decode_table(instr_set, self.word_length, self.opcode_length)
+        self.__decoded: Dict[int, Optional[DecodedInstruction]] = {}
+
+    '''
+    Decodes a single word, or returns None if it isn't a valid instruction.
+    '''
+    def decode(self, word: int) -> Optional[DecodedInstruction]:
+        try:
+            return self.__decoded[word]
+        except KeyError:
+            pass
+        decoded = self.__decoded[word] = self.__decode(word)
+        return decoded
+
+    def __decode(self, word: int) -> Optional[DecodedInstruction]:
+        for fixed_mask, fixed_word, name in self.__table[word >> (self.word_length - self.opcode_length)]:
+            if word & fixed_mask == fixed_word:
+                break
+        else:
+            return None
+        operands = []
+        target_operand = displacement = None
+        for _, opd_proc, shift in self.__instr_set[name].fields:
+            if type(opd_proc) == ImplicitOperandProcessor:
+                continue
+            value = (word >> shift) & ((1 << opd_proc.length) - 1)
+            if isinstance(opd_proc, RegisterOperandProcessor):
+                reg_name = opd_proc.register_names.get(value)
+                if reg_name is None:
+                    return None
+                operands.append(REGISTER_PREFIX + reg_name)
+                continue
+            if opd_proc.is_signed:
+                value = to_signed(value, opd_proc.length)
+            if isinstance(opd_proc, DisplacementOperandProcessor) and (self.__label_opcodes is None or name in self.__label_opcodes):
+                target_operand, displacement = len(operands), value
+            operands.append(IMMEDIATE_PREFIX + str(value))
+        return DecodedInstruction(name, tuple(operands), target_operand, displacement)
+
+    def label_name(self, address: int, width: int = 4) -> str:
+        return '{}{:0{}x}'.format(LABEL_PREFIX, address, width)
+
+    '''
+    Disassembles an image (any sequence of words, ex. from load_image()). With labels, displacements
+    that target an address in the image (or the address right after it) become labels. With addresses,
+    every instruction is followed by a comment with its address and encoding. If data_start is given,
+    the words from that address on are the DATA segment and are written as .word directives.
+    '''
+    def disassemble(self, words: Sequence[int], labels: bool = True, addresses: bool = False, numpy = None, data_start: int = None) -> Disassembly:
+        if data_start is not None and data_start < len(words):
+            text = self.disassemble(words[:data_start], labels, addresses, numpy)
+            data = words[data_start:].tolist() if numpy is not None else words[data_start:]
+            data_lines = ['.segment DATA'] + [ '.word ' + ', '.join('0x{:04x}'.format(word) for word in data[start:start + DATA_WORDS_PER_LINE])
+                                             for start in range(0, len(data), DATA_WORDS_PER_LINE) ]
+            return text._replace(lines=text.lines + data_lines, words=len(words))
+        if numpy is not None and not isinstance(words, numpy.ndarray):
+            words = numpy.asarray(words, dtype=numpy.uint16)
+        num_words = len(words)
+        values = words.tolist() if numpy is not None else words
+        distinct = numpy.unique(words).tolist() if numpy is not None else set(words)
+
+        # Every distinct word is decoded and rendered once
+        texts: Dict[int, str] = {}
+        targets: Dict[int, DecodedInstruction] = {} # words whose displacement can become a label
+        undecodable_words = set()
+        for word in distinct:
+            decoded = self.decode(word)
+            if decoded is None:
+                undecodable_words.add(word)
+                texts[word] = '{}; 0x{:04x} is not a valid instruction'.format(INDENT, word)
+                continue
+            texts[word] = INDENT + decoded.text()
+            if labels and decoded.target_operand is not None:
+                targets[word] = decoded
+
+        label_addresses: Dict[int, int] = {} # instruction address -> target address
+        if targets:
+            label_addresses = self.__find_targets(words, values, targets, num_words, numpy)
+
+        if addresses:
+            lines = [ '{:<{}s}; {:04x}: {:04x}'.format(texts[word], ADDRESS_COLUMN, addr, word) for addr, word in enumerate(values) ]
+        else:
+            lines = [ texts[word] for word in values ]
+
+        if not label_addresses:
+            return Disassembly(lines, num_words, 0, self.__count(words, values, undecodable_words, numpy))
+
+        width = max(4, len('{:x}'.format(num_words)))
+        for addr, target in label_addresses.items():
+            text = INDENT + targets[values[addr]].text(self.label_name(target, width))
+            lines[addr] = '{:<{}s}; {:04x}: {:04x}'.format(text, ADDRESS_COLUMN, addr, values[addr]) if addresses else text
+
+        # Interleave the label lines with the instructions
+        label_targets = sorted(set(label_addresses.values()))
+        out: List[str] = []
+        start = 0
+        for target in label_targets:
+            out.extend(lines[start:target])
+            out.append(self.label_name(target, width) + ':')
+            start = target
+        out.extend(lines[start:])
+        return Disassembly(out, num_words, len(label_targets), self.__count(words, values, undecodable_words, numpy))
+
+    # {instruction address: target address} of every label-able displacement that lands in [0, num_words]
+    def __find_targets(self, words, values, targets: Dict[int, DecodedInstruction], num_words: int, numpy) -> Dict[int, int]:
+        if numpy is not None:
+            label_words = numpy.fromiter(targets.keys(), dtype=numpy.uint16, count=len(targets))
+            displacements = numpy.zeros(1 << self.word_length, dtype=numpy.int64)
+            displacements[label_words] = [ decoded.displacement for decoded in targets.values() ]
+            addrs = numpy.nonzero(numpy.isin(words, label_words))[0]
+            target_addrs = addrs + 1 + displacements[words[addrs]]
+            in_image = (target_addrs >= 0) & (target_addrs <= num_words)
+            return dict(zip(addrs[in_image].tolist(), target_addrs[in_image].tolist()))
+        label_addresses = {}
+        for addr, word in enumerate(values):
+            decoded = targets.get(word)
+            if decoded is not None:
+                target = addr + 1 + decoded.displacement # PC (target) = PC + 1 + displacement
+                if 0 <= target <= num_words:
+                    label_addresses[addr] = target
+        return label_addresses
+
+    @staticmethod
+    def __count(words, values, undecodable_words: set, numpy) -> int:
+        if not undecodable_words:
+            return 0
+        if numpy is not None:
+            return int(numpy.isin(words, list(undecodable_words)).sum())
+        return sum(1 for word in values if word in undecodable_words)
+
+    '''
+    Loads and disassembles an image file (see load_image()). numpy is used if it's installed, unless
+    use_numpy is False.
+    '''
+    def disassemble_file(self, filepath: str, format: str = 'binary', byteorder: str = 'big', labels: bool = True, addresses: bool = False, use_numpy: bool = True, data_start: int = None) -> Disassembly:
+        numpy = import_numpy() if use_numpy else None
+        return self.disassemble(load_image(filepath, format, byteorder, numpy), labels, addresses, numpy, data_start)
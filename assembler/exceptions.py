@@ -2,28 +2,30 @@
 
 class AssemblerException(Exception):
     
-    def __init__(self, msg: str, tag: str = 'AssemblerException', filename: str = None, lineno: int = 0, line:str = None, at_token: str = None):
+    def __init__(self, msg: str, tag: str = 'AssemblerException', filename: str = None, lineno: int = 0, line:str = None, at_token: str = None, column: int = None):
         super().__init__(msg)
         self.tag = tag
         self.filename = filename
         self.lineno = lineno
         self.line = line
         self.at_token = at_token
+        self.column = column # 0-based offset of at_token in line, if known
 
     def tostring(self):
-        return '{}:{}: {}:\nWHAT: {}\nWHERE: at token \'{}\' in line \'{}\''.format(self.filename, self.lineno+1, self.tag, self.args[0], self.at_token, self.line)
+        location = '{}:{}'.format(self.filename, self.lineno+1) if self.column is None else '{}:{}:{}'.format(self.filename, self.lineno+1, self.column+1)
+        return '{}: {}:\nWHAT: {}\nWHERE: at token \'{}\' in line \'{}\''.format(location, self.tag, self.args[0], self.at_token, self.line)
 
 class AssemblerWarning(AssemblerException):
     
     TAG: str = 'WARN'
 
-    def __init__(self, msg: str, filename: str = None, lineno: int = 0, line:str = None, at_token: str = None):
-        super().__init__(msg, AssemblerWarning.TAG, filename, lineno, line, at_token)
+    def __init__(self, msg: str, filename: str = None, lineno: int = 0, line:str = None, at_token: str = None, column: int = None):
+        super().__init__(msg, AssemblerWarning.TAG, filename, lineno, line, at_token, column)
 
 
 class AssemblerError(AssemblerException):
     
     TAG: str = 'ERROR'
 
-    def __init__(self, msg: str, filename: str = None, lineno: int = 0, line:str = None, at_token: str = None):
-        super().__init__(msg, AssemblerError.TAG, filename, lineno, line, at_token)
\ No newline at end of file
+    def __init__(self, msg: str, filename: str = None, lineno: int = 0, line:str = None, at_token: str = None, column: int = None):
+        super().__init__(msg, AssemblerError.TAG, filename, lineno, line, at_token, column)
\ No newline at end of file
@@ -0,0 +1,141 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, List, NamedTuple, Optional, Sequence, Set, Tuple
+
+from assembler.ir import InstructionIR
+from assembler.memory import DataFile, DataSegment, MemorySegment
+from assembler.state import SymbolTable
+from assembler.stream import SOURCE_ENCODING
+
+INCLUDE_CACHE_SIZE = 256 # lowered include files kept per process (least recently used are dropped)
+
+'''
+An included file lowered on its own (see Assembler.include_file()), ready to be merged where it's
+included like a chunk of the including source (see assembler.parallel): labels are relative to its first
+instruction, defines are the ones it declares (in order) and segment is the segment it leaves active.
+used_tokens holds every word token of its lines (and of the files it includes), so it can be checked
+against the defines of the including file. files holds the real path and content hash of every source
+file it read (itself first, then the files it includes).
+'''
+class IncludeUnit(NamedTuple):
+    ir: InstructionIR
+    labels: SymbolTable
+    defines: List[Tuple[str, str]]
+    data: DataSegment
+    segment: MemorySegment
+    used_tokens: Set[str]
+    files: List[Tuple[str, str]]
+
+'''
+Size, modification time and content hash of a file, as of the last time it was read.
+'''
+class FileVersion(NamedTuple):
+    mtime_ns: int
+    size: int
+    digest: str
+
+
+'''
+Returns the real path of the file an .include names: relative paths are looked up next to the
+including file (or in the working directory if it has no name), then in every include path in order.
+Returns None if there's no such file.
+'''
+def find_include(name: str, including_file: Optional[str], include_paths: Sequence[str] = ()) -> Optional[str]:
+    if os.path.isabs(name):
+        candidates = [name]
+    else:
+        candidates = [os.path.join(os.path.dirname(including_file) if including_file else '', name)]
+        candidates.extend(os.path.join(directory, name) for directory in include_paths)
+    for candidate in candidates:
+        if os.path.isfile(candidate):
+            return os.path.realpath(candidate)
+    return None
+
+
+'''
+Per process cache of the files .include reads, so a header shared by many programs (or requests to
+the same daemon) is only read and lowered once.
+
+Files are known by real path, modification time, size and content hash. A file whose modification time
+and size haven't changed since it was last read isn't read again; one that has is read and hashed, and
+a unit lowered from it is only reused if the hash (and those of the files it includes) is unchanged.
+Units are kept per file version and per segment active at the .include, include paths and instruction
+set fingerprint, since lowering depends on those too. Units are shared, so they must not be modified.
+'''
+class IncludeCache(object):
+
+    def __init__(self, max_units: int = INCLUDE_CACHE_SIZE):
+        self.max_units = max_units
+        self.hits = 0
+        self.misses = 0
+        self.__versions: Dict[str, FileVersion] = {}
+        self.__units: 'OrderedDict[Tuple[str, str, Tuple], IncludeUnit]' = OrderedDict()
+        self.__lock = threading.Lock() # daemon worker threads share the cache
+
+    '''
+    Returns the version of a file, and its lines (decoded like source files are) if it had to be read:
+    it's only read and hashed if its modification time or size changed since it was last seen. Raises
+    OSError if it can't be read.
+    '''
+    def stat(self, filepath: str) -> Tuple[FileVersion, Optional[List[str]]]:
+        st = os.stat(filepath)
+        known = self.__versions.get(filepath)
+        if known is not None and known.mtime_ns == st.st_mtime_ns and known.size == st.st_size:
+            return known, None
+        return self.read(filepath)
+
+    '''
+    Reads a file. Returns its version and its lines.
+    '''
+    def read(self, filepath: str) -> Tuple[FileVersion, List[str]]:
+        with open(filepath, 'rb') as fp:
+            st = os.fstat(fp.fileno())
+            data = fp.read()
+        version = self.__versions[filepath] = FileVersion(st.st_mtime_ns, st.st_size, hashlib.sha256(data).hexdigest())
+        return version, data.decode(SOURCE_ENCODING).splitlines(keepends=True)
+
+    '''
+    Whether every file a unit read (see IncludeUnit.files) is unchanged, and every binary file its
+    .incbin directives placed still has the size pass 1 laid out (its bytes are only read afterwards).
+    '''
+    def is_current(self, unit: IncludeUnit) -> bool:
+        try:
+            return (all(self.stat(filepath)[0].digest == digest for filepath, digest in unit.files)
+                    and all(os.stat(piece.filepath).st_size == piece.num_bytes for piece in unit.data.pieces if isinstance(piece, DataFile)))
+        except (OSError, UnicodeDecodeError):
+            return False
+
+    '''
+    Returns the unit lowered from a file version, or None. key is anything else the lowering depended on
+    (segment, include paths, instruction set fingerprint...).
+    '''
+    def get(self, filepath: str, digest: str, key: Tuple) -> Optional[IncludeUnit]:
+        with self.__lock:
+            unit = self.__units.get((filepath, digest, key))
+            if unit is None:
+                self.misses += 1
+                return None
+            self.__units.move_to_end((filepath, digest, key))
+            self.hits += 1
+            return unit
+
+    def put(self, filepath: str, digest: str, key: Tuple, unit: IncludeUnit):
+        with self.__lock:
+            self.__units[(filepath, digest, key)] = unit
+            while len(self.__units) > self.max_units:
+                self.__units.popitem(last=False)
+
+    def clear(self):
+        with self.__lock:
+            self.__versions.clear()
+            self.__units.clear()
+            self.hits = self.misses = 0
+
+
+# Include cache shared by every assembler in this process (and so by every request a daemon serves)
+_include_cache = IncludeCache()
+
+def get_include_cache() -> IncludeCache:
+    return _include_cache
@@ -0,0 +1,207 @@
+import os
+import time
+from array import array
+from bisect import bisect_left
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from assembler.assembler import Assembler
+from assembler.defines import DefineTable, WORD_TOKEN_RE
+from assembler.exceptions import AssemblerError
+from assembler.state import SymbolTable
+
+WATCH_INTERVAL = 0.25 # seconds between checks for edited files
+COMPARE_BLOCK = 1024  # words compared at once when looking for the words that changed
+
+'''
+Outcome of one build: the number of words in the image, whether only the edited lines were
+reassembled (False if both passes ran over the whole source) and the (start, end) ranges of image
+words that changed since the previous build.
+'''
+class IncrementalBuild(NamedTuple):
+    words: int
+    incremental: bool
+    changed: List[Tuple[int, int]]
+
+
+'''
+Returns the (start, end) ranges of words that differ between two images of the same length. Blocks of
+words are compared at once, so only blocks holding a change are compared word by word.
+'''
+def changed_ranges(old: array, new: array) -> List[Tuple[int, int]]:
+    ranges = []
+    for block in range(0, len(new), COMPARE_BLOCK):
+        block_end = min(block + COMPARE_BLOCK, len(new))
+        if old[block:block_end] == new[block:block_end]:
+            continue
+        for index in range(block, block_end):
+            if old[index] != new[index]:
+                if ranges and ranges[-1][1] == index:
+                    ranges[-1] = (ranges[-1][0], index + 1)
+                else:
+                    ranges.append((index, index + 1))
+    return ranges
+
+
+'''
+Reassembles a source file after every edit (assemble.py --watch), redoing as little as it can.
+
+The state pass 1 left behind is kept between builds: the source lines, the line of every instruction
+(the IR's line numbers), the lines that start inside a block comment, the symbol and define tables
+(with the line of every define) and the image. An edit is found by trimming the lines the old and new
+source have in common at both ends. If no block comment is open where the edit starts or where the
+lines after it start, the edited lines only ever held instructions (no labels, directives or block comments, see
+Assembler.assemble_region()), still hold as many instructions, and use no define declared at or after
+them, no label moved: only those lines are lowered and synthesized again, and their words replace the
+old ones. Anything else (or peephole optimization, which looks across lines, or an edited include)
+runs both passes over the whole source. Either way, only the words that changed are rewritten in the
+output file.
+'''
+class IncrementalAssembler(object):
+
+    def __init__(self, assembler: Assembler, filepath: str, output_path: str = None, format: str = 'binary', byteorder: str = 'big'):
+        self.assembler = assembler
+        self.filepath = filepath
+        self.output_path = output_path
+        self.format = format
+        self.byteorder = byteorder
+        self.source_lines: Optional[List[str]] = None # source of the last successful build (None to run both passes)
+        self.words: Optional[array] = None
+        self.linenos: Optional[array] = None
+        self.comment_lines: Optional[array] = None # lines that start inside a block comment (see Assembler.build_ir())
+        self.symbol_table: SymbolTable = {}
+        self.defines = DefineTable()
+        self.define_lines: Dict[str, int] = {}
+        self.__stamps: Dict[str, int] = {}          # modification time of the source and every included file
+        self.__written: Optional[array] = None      # image in the output file
+
+    '''
+    Whether the source or a file it includes changed since the last build.
+    '''
+    def changed(self) -> bool:
+        return not self.__stamps or any(self.__stamp(filepath) != stamp for filepath, stamp in self.__stamps.items())
+
+    '''
+    Waits until the source or a file it includes changes.
+    '''
+    def wait(self, interval: float = WATCH_INTERVAL):
+        while not self.changed():
+            time.sleep(interval)
+
+    '''
+    Reads the source, assembles it and writes the changed words of the image to the output file.
+    Raises AssemblerError (and forgets the state of the previous build) if the source doesn't assemble.
+    '''
+    def build(self) -> IncrementalBuild:
+        stamps = { filepath: self.__stamp(filepath) for filepath in [self.filepath] + self.assembler.included_files } # before reading, so edits made meanwhile aren't missed
+        if any(stamp != self.__stamps.get(filepath) for filepath, stamp in stamps.items() if filepath != self.filepath):
+            self.source_lines = None # an included file changed
+        try:
+            with open(self.filepath, 'r') as src_file:
+                source_lines = src_file.readlines()
+            build = self.assemble_lines(source_lines)
+        finally:
+            for filepath in self.assembler.included_files:
+                if filepath not in stamps:
+                    stamps[filepath] = self.__stamp(filepath)
+            self.__stamps = stamps # a failed build is only retried once a file changes again
+        if self.output_path is not None:
+            self.__write(build)
+        return build
+
+    @staticmethod
+    def __stamp(filepath: str) -> Optional[int]:
+        try:
+            return os.stat(filepath).st_mtime_ns
+        except OSError:
+            return None
+
+    def __write(self, build: IncrementalBuild):
+        from assembler.writers import patch_image, write_image
+        written = self.__written
+        if written is None or len(written) != len(self.words) or not patch_image(self.output_path, self.words, build.changed, self.format, self.byteorder):
+            write_image(self.output_path, self.words, self.format, self.byteorder)
+        self.__written = array('H', self.words)
+
+    '''
+    Assembles the new source lines, incrementally if the edit allows it (see the class description).
+    '''
+    def assemble_lines(self, source_lines: List[str]) -> IncrementalBuild:
+        old_words = self.words
+        try:
+            changed = self.__reassemble_edit(source_lines)
+            if changed is not None:
+                return IncrementalBuild(len(self.words), True, changed)
+        except AssemblerError:
+            pass # reported by the full build, with the rest of the program around it
+        self.source_lines = None
+        comment_lines = array('I')
+        ir, aps, words = self.assembler.build_program(source_lines, self.filepath, comment_lines=comment_lines)
+        self.source_lines, self.words, self.linenos, self.comment_lines = source_lines, words, ir.linenos, comment_lines
+        self.symbol_table, self.defines = aps.get_symbol_table(), aps.get_define_table()
+        self.define_lines = { name: aps.get_define_line(name) for name in self.defines }
+        self.assembler.included_files = [filepath for filepath, _ in aps.included] + aps.data.files()
+        if old_words is None or len(old_words) != len(words):
+            return IncrementalBuild(len(words), False, [(0, len(words))])
+        return IncrementalBuild(len(words), False, changed_ranges(old_words, words))
+
+    '''
+    Reassembles only the edited lines. Returns the ranges of words that changed, or None if the edit
+    needs both passes over the whole source.
+    '''
+    def __reassemble_edit(self, source_lines: List[str]) -> Optional[List[Tuple[int, int]]]:
+        old_lines = self.source_lines
+        if old_lines is None or self.assembler.optimize:
+            return None
+        start, limit = 0, min(len(old_lines), len(source_lines))
+        while start < limit and old_lines[start] == source_lines[start]:
+            start += 1
+        old_end, new_end = len(old_lines), len(source_lines)
+        while old_end > start and new_end > start and old_lines[old_end - 1] == source_lines[new_end - 1]:
+            old_end -= 1
+            new_end -= 1
+        if start == old_end == new_end:
+            self.source_lines = source_lines
+            return []
+
+        # The edited lines are assembled as if no block comment was open before them, and the lines after
+        # them must not see one opened or closed by the edit
+        comment_lines = self.comment_lines
+        comment_first, comment_last = bisect_left(comment_lines, start), bisect_left(comment_lines, old_end)
+        if comment_lines[comment_first:comment_first + 1] == array('I', [start]) or comment_lines[comment_last:comment_last + 1] == array('I', [old_end]):
+            return None
+
+        old_region, new_region = old_lines[start:old_end], source_lines[start:new_end]
+        define_lines = self.define_lines
+        for token in WORD_TOKEN_RE.findall(''.join(old_region + new_region)):
+            if define_lines.get(token, -1) >= start: # declared (or redeclared) after the edit starts
+                return None
+        if any(not WORD_TOKEN_RE.fullmatch(name) for name in self.defines): # substituted anywhere, not just in tokens
+            return None
+
+        # The old lines must assemble on their own to what they assembled to in the program (they would not,
+        # ex. if the edit starts inside a block comment)
+        linenos = self.linenos
+        first, last = bisect_left(linenos, start), bisect_left(linenos, old_end)
+        region = self.__assemble_region(old_region, start, first)
+        if region is None or region[0] != linenos[first:last] or region[1] != self.words[first:last]:
+            return None
+        region_comment_lines = array('I')
+        region = self.__assemble_region(new_region, start, first, region_comment_lines)
+        if region is None or len(region[1]) != last - first: # labels after the edit would move
+            return None
+
+        new_linenos, new_words = region
+        changed = [(first + start_index, first + end_index) for start_index, end_index in changed_ranges(self.words[first:last], new_words)]
+        self.words[first:last] = new_words
+        shift = new_end - old_end
+        tail = linenos[last:] if not shift else array('I', [lineno + shift for lineno in linenos[last:]])
+        self.linenos = linenos[:first] + new_linenos + tail
+        comment_tail = comment_lines[comment_last:] if not shift else array('I', [lineno + shift for lineno in comment_lines[comment_last:]])
+        self.comment_lines = comment_lines[:comment_first] + region_comment_lines + comment_tail
+        if shift:
+            self.define_lines = { name: lineno + shift if lineno >= old_end else lineno for name, lineno in define_lines.items() }
+        self.source_lines = source_lines
+        return changed
+
+    def __assemble_region(self, lines: Sequence[str], lineno: int, address: int, comment_lines: array = None) -> Optional[Tuple[array, array]]:
+        return self.assembler.assemble_region(lines, self.filepath, lineno, address, self.defines, self.symbol_table, comment_lines)
@@ -0,0 +1,121 @@
+from array import array
+from typing import Dict, Iterable, List, Tuple
+
+# Operand kinds
+OPERAND_IMPLICIT  = 0 # value is the field value of an implicit operand (ex. padding, ALU sub-opcodes)
+OPERAND_REGISTER  = 1 # value is the register's encoding
+OPERAND_IMMEDIATE = 2 # value is the immediate encoded as an unsigned field
+OPERAND_SYMBOL    = 3 # value is an index into InstructionIR.symbols, resolved in pass 2
+
+OPERAND_KIND_NAMES = ('implicit', 'register', 'immediate', 'symbol')
+
+'''
+Compact intermediate representation of the instructions produced by assembler pass 1.
+
+Instructions are stored column-wise in parallel arrays; instruction i is at address i:
+    opcodes[i]     index into opcode_names of the instruction's opcode
+    linenos[i]     source line (0-based) the instruction came from
+    base_words[i]  the instruction word with every field encoded except symbol references (which are 0)
+    opd_start[i]   index of the instruction's first operand in the operand arrays (opd_start[i+1] is one past its last)
+
+Operands are stored in instruction field order (source order, with implicit operands included):
+    opd_kinds[j]   one of the OPERAND_* kinds
+    opd_values[j]  register/immediate/implicit field value, or symbol index for OPERAND_SYMBOL
+
+Symbol references are also indexed by ref_instrs/ref_operands (instruction index and operand index of each
+reference, in source order), so pass 2 only has to visit the operands it actually needs to resolve.
+'''
+class InstructionIR(object):
+
+    __slots__ = ('opcode_names', 'opcodes', 'linenos', 'base_words', 'opd_start', 'opd_kinds', 'opd_values',
+                 'symbols', 'symbol_ids', 'ref_instrs', 'ref_operands')
+
+    def __init__(self, opcode_names: List[str]):
+        self.opcode_names: List[str] = opcode_names
+        self.opcodes: array = array('B')
+        self.linenos: array = array('I')
+        self.base_words: array = array('H')
+        self.opd_start: array = array('I', [0])
+        self.opd_kinds: array = array('B')
+        self.opd_values: array = array('i')
+        self.symbols: List[str] = []
+        self.symbol_ids: Dict[str, int] = {}
+        self.ref_instrs: array = array('I')
+        self.ref_operands: array = array('I')
+
+    def __len__(self) -> int:
+        return len(self.opcodes)
+
+    '''
+    Returns the index of the symbol name in symbols, adding it if needed.
+    '''
+    def symbol_id(self, name: str) -> int:
+        sym_id = self.symbol_ids.get(name)
+        if sym_id is None:
+            sym_id = self.symbol_ids[name] = len(self.symbols)
+            self.symbols.append(name)
+        return sym_id
+
+    '''
+    Appends an instruction. kinds and values are its operands' kinds and values in field order.
+    '''
+    def append(self, opcode: int, lineno: int, base_word: int, kinds: List[int], values: List[int]):
+        opd_index = len(self.opd_kinds)
+        self.opcodes.append(opcode)
+        self.linenos.append(lineno)
+        self.base_words.append(base_word)
+        self.opd_kinds.extend(kinds)
+        self.opd_values.extend(values)
+        self.opd_start.append(opd_index + len(kinds))
+        if OPERAND_SYMBOL in kinds:
+            instr_index = len(self.opcodes) - 1
+            for i, kind in enumerate(kinds):
+                if kind == OPERAND_SYMBOL:
+                    self.ref_instrs.append(instr_index)
+                    self.ref_operands.append(opd_index + i)
+
+    '''
+    Appends every instruction of another IR (ex. lowered from a later chunk of the same source, see
+    assembler.parallel, or an included file). Its instructions follow this IR's, and its symbol references
+    are remapped to this IR's symbol indexes. If lineno is given, its instructions are attributed to that
+    source line instead of their own (ex. the .include that brought them in).
+    '''
+    def extend(self, other: 'InstructionIR', lineno: int = None):
+        instr_offset, opd_offset = len(self.opcodes), len(self.opd_kinds)
+        self.opcodes.extend(other.opcodes)
+        self.linenos.extend(other.linenos if lineno is None else array('I', [lineno]) * len(other.opcodes))
+        self.base_words.extend(other.base_words)
+        self.opd_kinds.extend(other.opd_kinds)
+        self.opd_values.extend(other.opd_values)
+        self.opd_start.extend([start + opd_offset for start in other.opd_start[1:]])
+        self.ref_instrs.extend([instr_index + instr_offset for instr_index in other.ref_instrs])
+        self.ref_operands.extend([opd_index + opd_offset for opd_index in other.ref_operands])
+        if other.ref_operands:
+            symbol_id, other_symbols, opd_values = self.symbol_id, other.symbols, self.opd_values
+            symbol_ids = [symbol_id(name) for name in other_symbols]
+            for opd_index in other.ref_operands:
+                opd_values[opd_index + opd_offset] = symbol_ids[opd_values[opd_index + opd_offset]]
+
+    '''
+    Returns a new IR holding only the given instructions (in the order given), ex. what's left after the
+    peephole optimizer removed some (see assembler.peephole). Symbol indexes are kept as they are.
+    '''
+    def select(self, instr_indexes: Iterable[int]) -> 'InstructionIR':
+        ir = InstructionIR(self.opcode_names)
+        ir.symbols, ir.symbol_ids = list(self.symbols), dict(self.symbol_ids)
+        opcodes, linenos, base_words, opd_start, opd_kinds, opd_values = self.opcodes, self.linenos, self.base_words, self.opd_start, self.opd_kinds, self.opd_values
+        append = ir.append
+        for instr_index in instr_indexes:
+            start, end = opd_start[instr_index], opd_start[instr_index + 1]
+            append(opcodes[instr_index], linenos[instr_index], base_words[instr_index], opd_kinds[start:end], opd_values[start:end])
+        return ir
+
+    def opcode_name(self, instr_index: int) -> str:
+        return self.opcode_names[self.opcodes[instr_index]]
+
+    '''
+    Returns the instruction's operands as a list of (kind, value).
+    '''
+    def operands(self, instr_index: int) -> List[Tuple[int, int]]:
+        start, end = self.opd_start[instr_index], self.opd_start[instr_index + 1]
+        return list(zip(self.opd_kinds[start:end], self.opd_values[start:end]))
@@ -1,91 +1,254 @@
 from abc import abstractmethod
-from typing import NamedTuple, Dict, List
-
-from bitstring import BitArray, Bits, BitStream, BitString, CreationError
+from typing import Any, Callable, NamedTuple, Dict, List, Optional, Tuple, TYPE_CHECKING
 
 from assembler.exceptions import AssemblerWarning, AssemblerError
+from assembler.ir import OPERAND_IMPLICIT, OPERAND_REGISTER, OPERAND_IMMEDIATE, OPERAND_SYMBOL
 from assembler.state import AssemblerPassState
 from assembler.utils import print_info, resize_bits
 
+# bitstring is only needed by the Bits based API, so it's imported on first use to keep startup fast
+if TYPE_CHECKING:
+    from bitstring import Bits
+
 class Opcode(NamedTuple):
     name: str
-    bitstring: Bits
+    code: int
+    length: int
+
+    @property
+    def bitstring(self) -> 'Bits':
+        from bitstring import Bits
+        return Bits(uint=self.code, length=self.length)
 
 class Register(NamedTuple):
     name: str
-    bitstring: Bits
+    code: int
+    length: int
+
+    @property
+    def bitstring(self) -> 'Bits':
+        from bitstring import Bits
+        return Bits(uint=self.code, length=self.length)
 
 # Type Aliases (equiv to typedef in C++)
 OpcodeTable = Dict[str, Opcode]     # Maps opcode names to opcodes
 RegisterTable = Dict[str, Register] # Maps register names to registers
 
+REGISTER_PREFIX  = '$'
+IMMEDIATE_PREFIX = '#'
+
 class AssembledBitString(NamedTuple):
-    bitstring: Bits
+    bitstring: 'Bits'
     warnings: List[AssemblerWarning]
 
+# Bits per digit for literal prefixes whose written width is significant (same widths bitstring uses)
+LITERAL_PREFIX_WIDTHS: Dict[str, Tuple[int, int]] = {
+    '0x': (16, 4),
+    '0o': (8, 3),
+    '0b': (2, 1),
+}
+
+'''
+Parses an immediate literal into (value, width). Hex, octal and binary literals are bit patterns, so their
+width is the number of bits written and the value is unsigned. Decimal literals have no width (None).
+Raises ValueError if the literal is malformed.
+'''
+def parse_literal(imm_str: str) -> Tuple[int, Optional[int]]:
+    prefix = LITERAL_PREFIX_WIDTHS.get(imm_str[:2].lower())
+    if prefix:
+        digits = imm_str[2:]
+        if not digits or not digits.isalnum():
+            raise ValueError('Invalid literal \'{}\'.'.format(imm_str))
+        return int(digits, prefix[0]), len(digits) * prefix[1]
+    try:
+        return int(imm_str), None
+    except ValueError:
+        # Anything else is left to bitstring's auto initializer (ex. 'uint:5=3') to keep the old syntax working
+        from bitstring import Bits
+        bits = Bits(auto=imm_str)
+        bits.int # raises if the bitstring is empty
+        return bits.uint, bits.length
+
+def to_signed(value: int, length: int) -> int:
+    return value - (1 << length) if value & (1 << (length - 1)) else value
+
+'''
+Integer equivalent of resize_bits() for a value that's already masked to 'width' bits (an unsigned bit pattern).
+Returns the value as an unsigned 'length'-bit field or raises ValueError when it doesn't fit.
+'''
+def resize_field(value: int, width: int, length: int, is_signed: bool = False) -> int:
+    if width > length:
+        resize = value & ((1 << length) - 1)
+        if is_signed and to_signed(resize, length) != to_signed(value, width):
+            raise ValueError('Signed integer \'{}\' is too large to be represented as a {}-bit signed integer.'.format(to_signed(value, width), length))
+        elif not is_signed and resize != value:
+            raise ValueError('Unsigned integer \'{}\' is too large to be represented as a {}-bit unsigned integer.'.format(value, length))
+        return resize
+    elif width < length and is_signed and value >> (width - 1) & 1:
+        return value | (((1 << length) - 1) ^ ((1 << width) - 1)) # sign extend
+    return value
+
+'''
+Returns the integer as an unsigned 'length'-bit field, or raises ValueError when it's out of range.
+'''
+def int_to_field(value: int, length: int, is_signed: bool = False) -> int:
+    if is_signed:
+        if not -(1 << (length - 1)) <= value < (1 << (length - 1)):
+            raise ValueError('Signed integer \'{}\' is too large to be represented as a {}-bit signed integer.'.format(value, length))
+        return value & ((1 << length) - 1)
+    if not 0 <= value < (1 << length):
+        raise ValueError('Unsigned integer \'{}\' is too large to be represented as a {}-bit unsigned integer.'.format(value, length))
+    return value
+
+OPERAND_CACHE_SIZE = 4096 # max entries per operand cache
+
+'''
+Bounded memo of encoded operand fields keyed on the operand text (and whatever else the encoding
+depends on). Programs reuse a small set of operand spellings, so a hit skips parsing and range checks.
+Only successful encodings are stored, so errors are always raised by the full path. When the cache
+is full it's cleared rather than tracking recency; a working set that large isn't worth memoizing.
+'''
+class OperandCache(object):
+
+    __slots__ = ('name', 'max_size', 'values', 'hits', 'misses')
+
+    def __init__(self, name: str, max_size: int = OPERAND_CACHE_SIZE):
+        self.name = name
+        self.max_size = max_size
+        self.values: Dict[Any, int] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def store(self, key: Any, value: int):
+        if len(self.values) >= self.max_size:
+            self.values.clear()
+        self.values[key] = value
+
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def clear(self):
+        self.values.clear()
+        self.hits = 0
+        self.misses = 0
+
+# Every operand cache, so their counters can be reported (see operand_cache_stats())
+OPERAND_CACHES: List[OperandCache] = []
+
+def new_operand_cache(name: str) -> OperandCache:
+    cache = OperandCache(name)
+    OPERAND_CACHES.append(cache)
+    return cache
+
+# Immediates are shared by every immediate processor: the key is (operand text, field length, is_signed)
+IMMEDIATE_CACHE = new_operand_cache('immediate')
+
+'''
+Returns {cache name: (hits, misses, entries)}, summed over caches with the same name.
+'''
+def operand_cache_stats() -> Dict[str, Tuple[int, int, int]]:
+    stats: Dict[str, Tuple[int, int, int]] = {}
+    for cache in OPERAND_CACHES:
+        hits, misses, entries = stats.get(cache.name, (0, 0, 0))
+        stats[cache.name] = (hits + cache.hits, misses + cache.misses, entries + len(cache.values))
+    return stats
+
+'''
+Operand processors translate a single operand into its field of the instruction word.
+
+The encode_* methods are the integer path used by the synthesizer: they return the field as an
+unsigned int of 'length' bits. The process_* methods return bitstrings and are kept for callers
+that work with Bits directly.
+'''
 class OperandProcessor(object):
 
     def __init__(self, length: int):
         self.length = length
 
     @abstractmethod
-    def process_str(self, opd_str: str, aps: AssemblerPassState) -> AssembledBitString:
+    def encode_str(self, opd_str: str, aps: AssemblerPassState) -> int:
         pass
 
+    def encode_symbol(self, sym_value: int, aps: AssemblerPassState) -> int:
+        raise AssemblerError('Unexpected symbol provided for operand. Operand does not support symbols.')
+
+    def process_str(self, opd_str: str, aps: AssemblerPassState) -> AssembledBitString:
+        from bitstring import Bits
+        return AssembledBitString(Bits(uint=self.encode_str(opd_str, aps), length=self.length), warnings=None)
+
     @abstractmethod
-    def process_bits(self, opd_bits: Bits, aps: AssemblerPassState) -> AssembledBitString:
+    def process_bits(self, opd_bits: 'Bits', aps: AssemblerPassState) -> AssembledBitString:
         pass
 
-    def process_symbol(self, sym_bits: Bits, aps: AssemblerPassState) -> AssembledBitString:
-        raise AssemblerError('Unexpected symbol provided for operand. Operand does not support symbols.')
+    def process_symbol(self, sym_value: int, aps: AssemblerPassState) -> AssembledBitString:
+        from bitstring import Bits
+        return AssembledBitString(Bits(uint=self.encode_symbol(sym_value, aps), length=self.length), warnings=None)
 
 class ImplicitOperandProcessor(OperandProcessor):
 
-    def __init__(self, value: Bits):
-        super().__init__(len(value))
-        self.__value = value
+    def __init__(self, value: int, length: int):
+        super().__init__(length)
+        self.value = value
 
     @classmethod
     def ZEROS(cls, length: int):
-        return cls(Bits(length))
+        return cls(0, length)
 
     @classmethod
     def DONT_CARES(cls, length: int):
         return cls.ZEROS(length)
 
-    def process_str(self, opd_str: str, aps: AssemblerPassState) -> AssembledBitString:
+    def encode_str(self, opd_str: str, aps: AssemblerPassState) -> int:
         if opd_str:
             raise AssemblerError('Unexpected operand.')
-        return (self.__value, None)
+        return self.value
 
-    def process_bits(self, opd_bits: Bits, aps: AssemblerPassState) -> AssembledBitString:
+    def process_bits(self, opd_bits: 'Bits', aps: AssemblerPassState) -> AssembledBitString:
         if opd_bits:
             raise AssemblerError('Unexpected operand.')
-        return (self.__value, None)
+        from bitstring import Bits
+        return (Bits(uint=self.value, length=self.length), None)
 
 class RegisterOperandProcessor(OperandProcessor):
 
     def __init__(self, length: int, registers: RegisterTable):
         super().__init__(length)
         self.registers = registers
-
-    def process_str(self, opd_str: str, aps: AssemblerPassState) -> AssembledBitString:
+        self.register_codes: Dict[str, int] = { name: reg.code for name, reg in registers.items() }
+        self.register_names: Dict[int, str] = {} # reverse index: register code -> name (first name wins for aliases)
+        for name, reg in registers.items():
+            self.register_names.setdefault(reg.code, name)
+        self.__cache = new_operand_cache('register')
+
+    def encode_str(self, opd_str: str, aps: AssemblerPassState) -> int:
+        cache = self.__cache
+        code = cache.values.get(opd_str)
+        if code is not None:
+            cache.hits += 1
+            return code
+        cache.misses += 1
+        code = self.__encode_str(opd_str)
+        cache.store(opd_str, code)
+        return code
+
+    def __encode_str(self, opd_str: str) -> int:
         opd_str = opd_str.strip()
-        if opd_str[0] != '$': raise AssemblerError('Unknown format specifier \'{}\' for operand of type \'register\'. Expected \'{}\'.'.format(opd_str[0], '$'), at_token=opd_str)
+        if opd_str[0] != REGISTER_PREFIX: raise AssemblerError('Unknown format specifier \'{}\' for operand of type \'register\'. Expected \'{}\'.'.format(opd_str[0], REGISTER_PREFIX), at_token=opd_str)
 
         reg_name, *t = opd_str[1:].split(' ', maxsplit=1)
         if t:
             raise AssemblerError('Unexpected additional token \'{}\' found for operand of type \'register\'.'.format(t[0]), at_token=opd_str)
 
         try:
-            return AssembledBitString(self.registers[reg_name].bitstring, warnings=None)
+            return self.register_codes[reg_name]
         except KeyError:
             raise AssemblerError('Unknown CPU register \'{}\'.'.format(reg_name), at_token=opd_str)
 
-    def process_bits(self, opd_bits: Bits, aps: AssemblerPassState) -> AssembledBitString:
+    def process_bits(self, opd_bits: 'Bits', aps: AssemblerPassState) -> AssembledBitString:
         try:
             opd_bits = resize_bits(opd_bits, self.length, is_signed=False)
-            if not opd_bits in self.registers.values():
+            if not opd_bits.uint in self.register_names:
                 raise AssemblerError('Unknown CPU register symbol \'{}\'.'.format(opd_bits.bin))
             else:
                 return AssembledBitString(opd_bits, warnings=None)
@@ -99,9 +262,21 @@ class ImmediateOperandProcessor(OperandProcessor):
         super().__init__(length)
         self.is_signed = is_signed
 
-    def process_str(self, opd_str: str, aps: AssemblerPassState) -> AssembledBitString:
+    def encode_str(self, opd_str: str, aps: AssemblerPassState) -> int:
+        key = (opd_str, self.length, self.is_signed)
+        cache = IMMEDIATE_CACHE
+        value = cache.values.get(key)
+        if value is not None:
+            cache.hits += 1
+            return value
+        cache.misses += 1
+        value = self.__encode_str(opd_str)
+        cache.store(key, value)
+        return value
+
+    def __encode_str(self, opd_str: str) -> int:
         opd_str = opd_str.strip()
-        if opd_str[0] != '#': raise AssemblerError('Unknown format specifier \'{}\' for operand of type \'immediate\'. Expected \'{}\'.'.format(opd_str[0], '#'), at_token=opd_str)
+        if opd_str[0] != IMMEDIATE_PREFIX: raise AssemblerError('Unknown format specifier \'{}\' for operand of type \'immediate\'. Expected \'{}\'.'.format(opd_str[0], IMMEDIATE_PREFIX), at_token=opd_str)
 
         imm_str, *t = opd_str[1:].split(' ', maxsplit=1)
 
@@ -109,25 +284,17 @@ class ImmediateOperandProcessor(OperandProcessor):
             raise AssemblerError('Unexpected additional token \'{}\' found for operand of type \'immediate\'.'.format(t[0]), at_token=opd_str)
 
         try:
-            imm_bits = Bits(auto=imm_str)
-            imm_bits.int
-            try:
-               return self.process_bits(imm_bits, aps)
-            except AssemblerError as e:
-                e.at_token = opd_str
-                raise e
+            value, width = parse_literal(imm_str)
         except ValueError:
-            try:
-                imm_bits = Bits(int=int(imm_str), length=self.length) if self.is_signed else Bits(uint=int(imm_str), length=self.length)
-                try:
-                    return self.process_bits(imm_bits, aps)
-                except AssemblerError as e:
-                    e.at_token = opd_str
-                    raise e
-            except CreationError as e:
-                raise AssemblerError(str(e), at_token=opd_str)
-
-    def process_bits(self, opd_bits: Bits, aps: AssemblerPassState) -> AssembledBitString:
+            raise AssemblerError('Invalid immediate \'{}\'.'.format(imm_str), at_token=opd_str)
+        try:
+            if width is None:
+                return int_to_field(value, self.length, self.is_signed)
+            return resize_field(value, width, self.length, self.is_signed)
+        except ValueError as e:
+            raise AssemblerError(str(e), at_token=opd_str)
+
+    def process_bits(self, opd_bits: 'Bits', aps: AssemblerPassState) -> AssembledBitString:
         try:
             return AssembledBitString(resize_bits(opd_bits, self.length, self.is_signed), warnings=None)
         except ValueError as e:
@@ -137,10 +304,12 @@ class ImmediateOperandProcessor(OperandProcessor):
 
 class DisplacementOperandProcessor(ImmediateOperandProcessor):
 
-    def process_symbol(self, sym_bits: Bits, aps: AssemblerPassState):
-        displacement: int = sym_bits.uint - aps.pc_addr - 1 # PC (target/symbol) = PC (current pc/aps.pc_addr) + 1 + Displacement
-        #print_info(aps, 'Computed displacement = {} for pc = {} and symbol = {}'.format(displacement, aps.pc_addr, sym_bits.uint))
-        return self.process_bits(Bits(int=displacement, length=64), aps)
+    def encode_symbol(self, sym_value: int, aps: AssemblerPassState) -> int:
+        displacement: int = sym_value - aps.pc_addr - 1 # PC (target/symbol) = PC (current pc/aps.pc_addr) + 1 + Displacement
+        try:
+            return int_to_field(displacement, self.length, self.is_signed)
+        except ValueError as e:
+            raise AssemblerError(str(e))
 
 
 class InstructionProcessor(object):
@@ -151,7 +320,7 @@ class InstructionProcessor(object):
         self.__opcode = opcode
         self.__format = {}
         self.__operandProcessors = kwargs
-        self.length = opcode.bitstring.length
+        self.length = opcode.length
     
         for opd_proc in self.__operandProcessors.values():
             self.length += opd_proc.length
@@ -160,51 +329,125 @@ class InstructionProcessor(object):
         if len(self.__format) != len(self.__operandProcessors):
             raise ValueError('Number of operands ({}) in instruction format doesn\'t match number of operand processors ({})'.format(len(self.__format),len(self.__operandProcessors)))
 
-    def process_str(self, opds_str: str, aps: AssemblerPassState) -> AssembledBitString:
-        bitstring = BitString(self.__opcode.bitstring)
-        warnings: List[AssemblerWarning] = list()
+        # Precompute where each operand's field lives in the instruction word. Fields are packed in the
+        # order the operand processors were given (after the opcode), while operands are written in
+        # source code in the order of the format.
+        shift = self.length - opcode.length
+        self.opcode_word: int = opcode.code << shift
+        shifts: Dict[str, int] = {}
+        for opd_name, opd_proc in self.__operandProcessors.items():
+            shift -= opd_proc.length
+            shifts[opd_name] = shift
+        self.fields: List[Tuple[str, OperandProcessor, int]] = [ (opd_name, self.__operandProcessors[opd_name], shifts[opd_name]) for opd_name in self.__format ]
+
+        # IR operand kind of each field, and the word with the opcode and every implicit field already set
+        self.__field_kinds: List[int] = []
+        self.implicit_word: int = self.opcode_word
+        for opd_name, opd_proc, shift in self.fields:
+            if type(opd_proc) == ImplicitOperandProcessor:
+                self.__field_kinds.append(OPERAND_IMPLICIT)
+                self.implicit_word |= opd_proc.value << shift
+            elif isinstance(opd_proc, RegisterOperandProcessor):
+                self.__field_kinds.append(OPERAND_REGISTER)
+            else:
+                self.__field_kinds.append(OPERAND_IMMEDIATE)
+        self.__lower_fields = list(zip(range(len(self.fields)), self.fields, self.__field_kinds))
+
+    @property
+    def opcode(self) -> Opcode:
+        return self.__opcode
 
+    '''
+    Encodes the operands string into the complete instruction word as an unsigned int.
+    '''
+    def encode_str(self, opds_str: str, aps: AssemblerPassState) -> int:
         if opds_str is None: raise ValueError('opds_str cannot be None.')
 
-        if not opds_str and len(self.__operandProcessors) == 0:
-            return (bitstring, warnings)
+        word = self.opcode_word
+        if not opds_str and not self.fields:
+            return word
 
-        opd_strs = opds_str.split(InstructionProcessor.OPERAND_DELIM)
+        opd_strs = opds_str.split(InstructionProcessor.OPERAND_DELIM) if opds_str else []
+        num_opds = len(self.fields)
 
-        if len(opd_strs) > len(self.__operandProcessors):
-            bad_index = len(self.__operandProcessors)
-            raise AssemblerError('Unexpected operand \'{}\' at position {} for instruction of type \'{}\'. Expected {} operands, but {} were provided.'.format(opd_strs[bad_index], bad_index, self.__opcode.name, len(self.__operandProcessors), len(opd_strs)), at_token=opds_str)
+        if len(opd_strs) > num_opds:
+            raise AssemblerError('Unexpected operand \'{}\' at position {} for instruction of type \'{}\'. Expected {} operands, but {} were provided.'.format(opd_strs[num_opds], num_opds, self.__opcode.name, num_opds, len(opd_strs)), at_token=opds_str)
 
-        i: int = 0
-        opd_name: str
-        opd_proc: OperandProcessor
-        opd_bitstrings = {}
-        for i, opd_name in enumerate(self.__format):
-            opd_proc = self.__operandProcessors[opd_name]
+        for i, (opd_name, opd_proc, shift) in enumerate(self.fields):
             if type(opd_proc) == ImplicitOperandProcessor:
                 opd_strs.insert(i, '') # create implicit (empty) operand string
             try:
                 opd_str = opd_strs[i].strip()
-                opd_bitstring = None
-                opd_warnings = None
+                if not opd_str and type(opd_proc) != ImplicitOperandProcessor:
+                    raise AssemblerError('Missing operand \'{}\' at position {} for instruction of type \'{}\'.'.format(opd_name, i, self.__opcode.name), at_token=opd_str)
                 try:
-                    opd_bitstring, opd_warnings = opd_proc.process_symbol(aps.get_symbol(opd_str), aps)
+                    sym_value = aps.get_symbol(opd_str)
                 except KeyError:
-                    opd_bitstring, opd_warnings = opd_proc.process_str(opd_str, aps)
-                except AssemblerError as e:
-                    if not e.at_token: e.at_token = opd_str
-                    raise e
-                opd_bitstrings[opd_name] = opd_bitstring
-                #bitstring.append(opd_bitstring)
-                warnings.append(opd_warnings)
-                
+                    word |= opd_proc.encode_str(opd_str, aps) << shift
+                else:
+                    word |= opd_proc.encode_symbol(sym_value, aps) << shift
             except IndexError:
-                raise AssemblerError('Expected operand \'{}\' at position {} for instruction of type \'{}\'. Expected {} operands, only {} were provided.'.format(opd_name, i, self.__opcode.name, len(self.__operandProcessors), len(opd_strs)), at_token=opds_str)
+                raise AssemblerError('Expected operand \'{}\' at position {} for instruction of type \'{}\'. Expected {} operands, only {} were provided.'.format(opd_name, i, self.__opcode.name, num_opds, len(opd_strs)), at_token=opds_str or None)
+            except AssemblerError as e:
+                if e.at_token is None: e.at_token = opd_str
+                raise e
 
-        for opd_name in self.__operandProcessors.keys():
-            bitstring.append(opd_bitstrings[opd_name])
+        return word
 
-        return (bitstring, warnings)
+    '''
+    Lowers the operands string to the compact IR form (see assembler.ir) without resolving symbols.
+    Returns the instruction word with every non-symbol field encoded, and the kind and value of each
+    operand in field order. Operands that aren't empty and don't start with a register or immediate
+    prefix are symbol references; symbol_id maps their names to symbol indexes.
+    '''
+    def lower_str(self, opds_str: str, aps: AssemblerPassState, symbol_id: Callable[[str], int]) -> Tuple[int, List[int], List[int]]:
+        if opds_str is None: raise ValueError('opds_str cannot be None.')
+        if not opds_str and not self.fields:
+            return self.implicit_word, [], []
+        return self.lower_operands(opds_str.split(InstructionProcessor.OPERAND_DELIM) if opds_str else [], aps, symbol_id)
+
+    '''
+    Same as lower_str() for operands that are already split (ex. by the lexer). The list is modified.
+    '''
+    def lower_operands(self, opd_strs: List[str], aps: AssemblerPassState, symbol_id: Callable[[str], int]) -> Tuple[int, List[int], List[int]]:
+        word = self.implicit_word
+        kinds: List[int] = []
+        values: List[int] = []
+        num_opds = len(self.fields)
+
+        if len(opd_strs) > num_opds:
+            raise AssemblerError('Unexpected operand \'{}\' at position {} for instruction of type \'{}\'. Expected {} operands, but {} were provided.'.format(opd_strs[num_opds], num_opds, self.__opcode.name, num_opds, len(opd_strs)), at_token=opd_strs[num_opds].strip())
+
+        for i, (opd_name, opd_proc, shift), kind in self.__lower_fields:
+            if kind == OPERAND_IMPLICIT:
+                opd_strs.insert(i, '') # create implicit (empty) operand string
+                kinds.append(kind)
+                values.append(opd_proc.value)
+                continue
+            try:
+                opd_str = opd_strs[i].strip()
+                if not opd_str:
+                    # An empty operand (ex. 'ADD $1,,$2') is reported as its own (empty) token, so it's located by its column
+                    raise AssemblerError('Missing operand \'{}\' at position {} for instruction of type \'{}\'.'.format(opd_name, i, self.__opcode.name), at_token=opd_str)
+                if opd_str[0] != REGISTER_PREFIX and opd_str[0] != IMMEDIATE_PREFIX:
+                    kinds.append(OPERAND_SYMBOL)
+                    values.append(symbol_id(opd_str))
+                    continue
+                value = opd_proc.encode_str(opd_str, aps)
+                word |= value << shift
+                kinds.append(kind)
+                values.append(value)
+            except IndexError:
+                raise AssemblerError('Expected operand \'{}\' at position {} for instruction of type \'{}\'. Expected {} operands, only {} were provided.'.format(opd_name, i, self.__opcode.name, num_opds, len(opd_strs)), at_token=', '.join([opd.strip() for opd in opd_strs if opd]) or None)
+            except AssemblerError as e:
+                if e.at_token is None: e.at_token = opd_str
+                raise e
+
+        return word, kinds, values
+
+    def process_str(self, opds_str: str, aps: AssemblerPassState) -> AssembledBitString:
+        from bitstring import Bits
+        return (Bits(uint=self.encode_str(opds_str, aps), length=self.length), list())
 
 
 # Type Aliases (equiv to typedef in C++)
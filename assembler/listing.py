@@ -0,0 +1,76 @@
+from array import array
+from typing import Dict, IO, Iterator, List, Optional, Sequence
+
+# Assembler verbosity levels
+VERBOSITY_QUIET = 0 # no per-instruction output (default)
+VERBOSITY_INFO  = 1 # print an INFO line for every synthesized instruction
+
+LISTING_BUFFER_SIZE = 1 << 20
+LISTING_HEADER = 'ADDR  WORD   LINE  SOURCE\n'
+
+'''
+Record of an assembled program used to produce listing (.lst) files and verbose output.
+
+Pass 2 only records which source line produced each instruction word (the word's index is its
+address), so the cost of keeping a listing is one array append per instruction. All formatting is
+deferred until the listing is written.
+'''
+class Listing(object):
+
+    def __init__(self):
+        self.filename: str = None
+        self.source_lines: Sequence[str] = []
+        self.instr_lines: Sequence[str] = []  # preprocessed instruction text, indexed by source line
+        self.words: array = array('H')
+        self.linenos: array = array('I')      # source line (0-based) of each instruction word
+        self.data_lines: Dict[int, int] = {}  # source line (0-based) of each data directive -> address of its data
+        self.text: Optional[str] = None       # pre-rendered body (ex. from the build cache), written as is
+
+    def lines(self) -> Iterator[str]:
+        yield '; {}\n'.format(self.filename)
+        yield from self.body_lines()
+
+    '''
+    Listing lines after the filename line. They only depend on the source and the machine code.
+    '''
+    def body_lines(self) -> Iterator[str]:
+        if self.text is not None:
+            yield self.text
+            return
+        yield LISTING_HEADER
+        word_index = 0
+        num_instrs = len(self.linenos)
+        words, linenos, data_lines = self.words, self.linenos, self.data_lines
+        for lineno, line in enumerate(self.source_lines):
+            source = line.rstrip('\r\n')
+            if word_index < num_instrs and linenos[word_index] == lineno:
+                yield '{:04x}  {:04x}  {:5d}  {}\n'.format(word_index, words[word_index], lineno + 1, source)
+                word_index += 1
+                while word_index < num_instrs and linenos[word_index] == lineno: # the rest of a relaxed branch
+                    yield '{:04x}  {:04x}\n'.format(word_index, words[word_index])
+                    word_index += 1
+            elif lineno in data_lines: # data directives show their first word
+                addr = data_lines[lineno]
+                yield '{:04x}  {:4s}  {:5d}  {}\n'.format(addr, '{:04x}'.format(words[addr]) if addr < len(words) else '', lineno + 1, source)
+            else:
+                yield '{:10s}  {:5d}  {}\n'.format('', lineno + 1, source)
+
+    '''
+    Lines in the same format print_info() used to print during pass 2. Instructions of an included file
+    show the .include line they come from (it has no preprocessed instruction of its own).
+    '''
+    def info_lines(self) -> Iterator[str]:
+        instr_lines, source_lines = self.instr_lines, self.source_lines
+        for addr, lineno in enumerate(self.linenos):
+            word = self.words[addr]
+            instr = instr_lines[lineno]
+            if instr is None:
+                instr = source_lines[lineno].strip()
+            yield '{}:{}: INFO: \'{:20s}\' -> {:016b} (0x{:04x})\n'.format(self.filename, lineno + 1, instr, word, word)
+
+    def write(self, fp: IO):
+        fp.writelines(self.lines())
+
+    def write_file(self, filepath: str):
+        with open(filepath, 'w', buffering=LISTING_BUFFER_SIZE) as fp:
+            self.write(fp)
@@ -1,5 +1,157 @@
+import mmap
+import sys
+from array import array
 from enum import Enum, auto
+from typing import Dict, Iterable, List, NamedTuple, Tuple, Union, TYPE_CHECKING
+
+from assembler.exceptions import AssemblerError
+
+if TYPE_CHECKING:
+    from assembler.state import AssemblerPassState
+
+DATA_WORD_TYPECODE = 'H' # 16-bit data words, like instruction words
+DATA_WORD_BITS = 16
 
 class MemorySegment(Enum):
     DATA = auto()
-    TEXT = auto()
\ No newline at end of file
+    TEXT = auto()
+
+# Per line checks compare against these; looking up an enum member on its class is ~10x slower
+DATA_SEGMENT = MemorySegment.DATA
+TEXT_SEGMENT = MemorySegment.TEXT
+
+
+'''
+A binary file placed in the DATA segment (.incbin). Only its size is known during pass 1; its bytes
+are memory mapped and copied into the image when the segment is laid out.
+'''
+class DataFile(NamedTuple):
+    filepath: str
+    num_bytes: int
+    lineno: int
+
+
+'''
+Contents of the DATA segment, built during pass 1 by the data directives (.word, .fill, .incbin).
+
+The segment is laid out right after the TEXT segment, so its addresses are only known once pass 1 has
+counted the instructions: labels in it are kept as offsets until place() adds them to the symbol table,
+and words that hold a symbol's address (refs) are filled in by words(). Consecutive .word/.fill data
+shares one array; .incbin files are only referenced until words() reads them.
+'''
+class DataSegment(object):
+
+    def __init__(self):
+        self.pieces: List[Union[array, DataFile]] = []
+        self.size: int = 0                         # words
+        self.labels: Dict[str, int] = {}           # label name -> offset
+        self.refs: List[Tuple[int, str, int]] = [] # (offset, symbol, lineno) of words holding a symbol's address
+        self.lines: List[Tuple[int, int]] = []     # (lineno, offset) of every data directive (for listings)
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __words_piece(self) -> array:
+        if not self.pieces or not isinstance(self.pieces[-1], array):
+            self.pieces.append(array(DATA_WORD_TYPECODE))
+        return self.pieces[-1]
+
+    '''
+    Appends words. refs lists (index in words, symbol name) for words that hold a symbol's address.
+    '''
+    def add_words(self, words: Iterable[int], lineno: int, refs: Iterable[Tuple[int, str]] = ()):
+        self.lines.append((lineno, self.size))
+        for index, symbol in refs:
+            self.refs.append((self.size + index, symbol, lineno))
+        piece = self.__words_piece()
+        start = len(piece)
+        piece.extend(words)
+        self.size += len(piece) - start
+
+    def add_fill(self, count: int, value: int, lineno: int):
+        self.lines.append((lineno, self.size))
+        self.__words_piece().extend(array(DATA_WORD_TYPECODE, [value]) * count)
+        self.size += count
+
+    '''
+    Appends a binary file's bytes as big-endian words (an odd last byte is padded with a zero byte).
+    '''
+    def add_file(self, filepath: str, num_bytes: int, lineno: int):
+        self.lines.append((lineno, self.size))
+        self.pieces.append(DataFile(filepath, num_bytes, lineno))
+        self.size += (num_bytes + 1) // 2
+
+    def add_label(self, name: str):
+        self.labels[name] = self.size
+
+    def files(self) -> List[str]:
+        return [piece.filepath for piece in self.pieces if isinstance(piece, DataFile)]
+
+    '''
+    Appends the contents of another segment (ex. built from a later chunk of the same source, or from an
+    included file). other is left as it is. If lineno is given, all of other's data is attributed to
+    that source line (ex. the .include that brought it in).
+    '''
+    def extend(self, other: 'DataSegment', lineno: int = None):
+        offset = self.size
+        for piece in other.pieces:
+            if isinstance(piece, array):
+                self.pieces.append(array(DATA_WORD_TYPECODE, piece)) # copied, since later data is added to the last array
+            else:
+                self.pieces.append(piece if lineno is None else piece._replace(lineno=lineno))
+        self.labels.update((name, offset + label) for name, label in other.labels.items())
+        if lineno is None:
+            self.refs.extend((offset + ref, symbol, ref_lineno) for ref, symbol, ref_lineno in other.refs)
+            self.lines.extend((line_lineno, offset + line) for line_lineno, line in other.lines)
+        else:
+            self.refs.extend((offset + ref, symbol, lineno) for ref, symbol, _ in other.refs)
+            if other.lines: self.lines.append((lineno, offset))
+        self.size += other.size
+
+    '''
+    Adds the segment's labels to the symbol table, for a segment starting at address base.
+    '''
+    def place(self, base: int, aps: 'AssemblerPassState'):
+        for name, offset in self.labels.items():
+            aps.add_symbol(name, base + offset)
+
+    '''
+    Lays out the segment's words, filling in the symbol addresses (see place()).
+    '''
+    def words(self, aps: 'AssemblerPassState') -> array:
+        words = array(DATA_WORD_TYPECODE)
+        for piece in self.pieces:
+            words.extend(piece if isinstance(piece, array) else read_data_file(piece, aps.filename))
+        mask = (1 << DATA_WORD_BITS) - 1
+        for offset, symbol, lineno in self.refs:
+            try:
+                words[offset] = aps.get_symbol(symbol) & mask
+            except KeyError:
+                raise AssemblerError('Undefined symbol \'{}\' in data.'.format(symbol), aps.filename, lineno, None, symbol)
+        return words
+
+
+'''
+Reads a DataFile's bytes as big-endian words. The file is memory mapped and copied straight into the
+word array (byte swapped in place on little-endian machines), without reading it into a bytes object.
+'''
+def read_data_file(data_file: DataFile, filename: str = None) -> array:
+    words = array(DATA_WORD_TYPECODE)
+    if not data_file.num_bytes:
+        return words
+    try:
+        with open(data_file.filepath, 'rb') as fp:
+            mapped = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError) as e:
+        raise AssemblerError('Can\'t read binary file \'{}\': {}'.format(data_file.filepath, e), filename, data_file.lineno, None, data_file.filepath)
+    with mapped:
+        if len(mapped) != data_file.num_bytes:
+            raise AssemblerError('Binary file \'{}\' changed during assembly.'.format(data_file.filepath), filename, data_file.lineno, None, data_file.filepath)
+        even = data_file.num_bytes & ~1
+        with memoryview(mapped) as view:
+            words.frombytes(view[:even])
+        if sys.byteorder != 'big':
+            words.byteswap()
+        if even != data_file.num_bytes:
+            words.append(mapped[even] << 8)
+    return words
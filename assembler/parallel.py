@@ -0,0 +1,191 @@
+from array import array
+from typing import Iterator, List, NamedTuple, Optional, Sequence, Set, Tuple
+
+from assembler.defines import DefineTable, WORD_TOKEN_RE
+from assembler.exceptions import AssemblerError
+from assembler.ir import InstructionIR
+from assembler.memory import DataSegment, MemorySegment
+from assembler.preprocessor.preprocessor import Preprocessor
+from assembler.state import AssemblerPassState, SymbolTable
+from assembler.synthesis import Synthesizer
+
+PARALLEL_PASS1_MIN_LINES = 1 << 18        # smaller sources are preprocessed serially
+PARALLEL_PASS2_MIN_INSTRUCTIONS = 1 << 18 # smaller programs are synthesized serially; forking the pool costs more than it saves
+CHUNKS_PER_WORKER = 4                     # more chunks than workers evens out uneven chunks
+
+'''
+Caps a requested number of worker processes at the number of CPUs (more workers than CPUs only adds overhead).
+'''
+def usable_workers(num_workers: int) -> int:
+    import os
+    return max(1, min(num_workers, os.cpu_count() or 1))
+
+'''
+Splits the range [0, num_instrs) (instructions or source lines) into about num_chunks contiguous (start, end) ranges.
+'''
+def split_range(num_instrs: int, num_chunks: int) -> List[Tuple[int, int]]:
+    num_chunks = max(1, min(num_chunks, num_instrs))
+    size, extra = divmod(num_instrs, num_chunks)
+    chunks = []
+    start = 0
+    for i in range(num_chunks):
+        end = start + size + (1 if i < extra else 0)
+        chunks.append((start, end))
+        start = end
+    return chunks
+
+
+# Pass 2 worker state, set once per worker process by the pool initializer
+_pass2_synthesizer: Synthesizer = None
+_pass2_ir: InstructionIR = None
+_pass2_aps: AssemblerPassState = None
+
+def _init_pass2_worker(synthesizer: Synthesizer, ir: InstructionIR, symbol_table: SymbolTable, filename: str):
+    global _pass2_synthesizer, _pass2_ir, _pass2_aps
+    _pass2_synthesizer, _pass2_ir = synthesizer, ir
+    _pass2_aps = AssemblerPassState()
+    _pass2_aps.filename = filename
+    _pass2_aps.get_symbol_table().update(symbol_table)
+
+def _synthesize_pass2_chunk(chunk: Tuple[int, int]) -> array:
+    return _pass2_synthesizer.synthesize_ir(_pass2_ir, _pass2_aps, *chunk)
+
+
+'''
+Parallel pass 2: splits the IR into contiguous instruction ranges (each one's starting PC is its first
+index) and synthesizes them in a pool of num_workers processes. The synthesizer, IR and frozen symbol
+table are shipped to each worker once, when it starts; chunks only carry their range, and come back as
+their finished words, which are concatenated in address order. The result is identical to
+Synthesizer.synthesize_ir().
+
+Chunks are collected in order, so if several fail the error raised is the one from the earliest chunk,
+which is the first error in source order (each chunk stops at its first error, like the serial pass).
+'''
+def synthesize_ir_parallel(synthesizer: Synthesizer, ir: InstructionIR, aps: AssemblerPassState, num_workers: int) -> array:
+    from concurrent.futures import ProcessPoolExecutor
+    chunks = split_range(len(ir), num_workers * CHUNKS_PER_WORKER)
+    words = array('H')
+    with ProcessPoolExecutor(max_workers=num_workers, initializer=_init_pass2_worker, initargs=(synthesizer, ir, aps.get_symbol_table(), aps.filename)) as pool:
+        for chunk_words in pool.map(_synthesize_pass2_chunk, chunks):
+            words.extend(chunk_words)
+    aps.pc_addr = len(ir)
+    return words
+
+
+'''
+Pass 1 of one chunk of the source, lowered speculatively: as if it started outside a block comment, at
+address 0, with the define table and segment scan_directives() predicts for it. labels holds the
+chunk's label addresses relative to its first instruction, defines the defines it adds (line, name,
+value, in order), data its part of the DATA segment, segment the segment it ends in, used_tokens every
+word token of its instructions as written (see WORD_TOKEN_RE) and in_block_comment whether it ends
+inside a block comment.
+'''
+class Pass1Chunk(NamedTuple):
+    ir: InstructionIR
+    labels: SymbolTable
+    defines: List[Tuple[int, str, str]]
+    data: DataSegment
+    segment: MemorySegment
+    used_tokens: Set[str]
+    in_block_comment: bool
+
+'''
+What a chunk is lowered from: its line range and the define table and segment predicted at its start.
+'''
+class Pass1Assumptions(NamedTuple):
+    start: int
+    end: int
+    defines: DefineTable
+    segment: MemorySegment
+
+
+'''
+Predicts the define table and segment at the start of every chunk, so chunks of sources that use
+defines (usually all declared at the top) don't all have to be redone. Only lines containing the
+directive prefix are preprocessed, each on its own; a directive that's actually commented out or
+fails still makes it into the prediction, which is why chunks are checked against the true state when
+they're merged.
+'''
+def scan_directives(preprocessor: Preprocessor, source_lines: Sequence[str], chunks: List[Tuple[int, int]]) -> List[Pass1Assumptions]:
+    prefix = preprocessor.directive_prefix
+    aps = AssemblerPassState()
+    assumptions = []
+    candidates = iter([lineno for lineno, line in enumerate(source_lines) if prefix in line] + [len(source_lines)])
+    lineno = next(candidates)
+    for start, end in chunks:
+        while lineno < start:
+            preprocessor.in_block_comment = False
+            try:
+                preprocessor.lex_line(source_lines[lineno], aps)
+            except AssemblerError:
+                pass
+            lineno = next(candidates)
+        table = DefineTable()
+        for name, value in aps.get_defines():
+            table.add(name, value)
+        assumptions.append(Pass1Assumptions(start, end, table, aps.segment))
+    preprocessor.reset()
+    return assumptions
+
+
+# Pass 1 worker state, set once per worker process by the pool initializer
+_pass1_preprocessor: Preprocessor = None
+_pass1_synthesizer: Synthesizer = None
+_pass1_lines: Sequence[str] = None
+_pass1_filename: str = None
+
+def _init_pass1_worker(preprocessor: Preprocessor, synthesizer: Synthesizer, source_lines: Sequence[str], filename: str):
+    global _pass1_preprocessor, _pass1_synthesizer, _pass1_lines, _pass1_filename
+    _pass1_preprocessor, _pass1_synthesizer, _pass1_lines, _pass1_filename = preprocessor, synthesizer, source_lines, filename
+
+def _lower_pass1_chunk(assumptions: Pass1Assumptions) -> Optional[Pass1Chunk]:
+    start, end, assumed_defines, segment = assumptions
+    preprocessor, synthesizer = _pass1_preprocessor, _pass1_synthesizer
+    preprocessor.reset()
+    synthesizer.reset()
+    aps = AssemblerPassState()
+    aps.filename = _pass1_filename
+    aps.lineno = start
+    aps.segment = segment
+    for name, value in assumed_defines.items():
+        aps.add_define(name, value)
+    defines = []
+    add_define = aps.add_define
+    def record_define(name: str, value: str):
+        defines.append((aps.lineno, name, value))
+        add_define(name, value)
+    aps.add_define = record_define
+
+    ir = synthesizer.new_ir()
+    used_tokens = set()
+    find_tokens = WORD_TOKEN_RE.findall
+    lex_line = preprocessor.lex_line
+    lower_lexed = synthesizer.lower_lexed
+    try:
+        for line in _pass1_lines[start:end]:
+            instr = lex_line(line, aps)
+            if instr:
+                used_tokens.update(find_tokens(instr.origin or instr.code))
+                lower_lexed(instr, line, aps, ir)
+            aps.lineno += 1
+    except AssemblerError:
+        return None # the error may be an artifact of the assumptions; the chunk is redone serially
+    return Pass1Chunk(ir, aps.get_symbol_table(), defines, aps.data, aps.segment, used_tokens, preprocessor.in_block_comment)
+
+
+'''
+Parallel pass 1 (speculative half): splits the source lines into contiguous chunks and lowers each one
+in a pool of num_workers processes (see Pass1Chunk). Yields every chunk's assumptions and result (None
+if it failed) in source order, as soon as it's ready, so the caller can merge chunks while later ones
+are still being lowered. The preprocessor must be SPLITTABLE.
+
+Lowering doesn't depend on addresses or on the symbol table, so a chunk only comes out wrong if it
+actually starts inside a block comment or in another segment, or its instructions use a define whose
+true value differs from the assumed one. The caller (see Assembler.build_ir_parallel) checks these
+while it merges and redoes those chunks serially.
+'''
+def lower_chunks_parallel(preprocessor: Preprocessor, synthesizer: Synthesizer, source_lines: Sequence[str], filename: str, num_workers: int) -> Iterator[Tuple[Pass1Assumptions, Optional[Pass1Chunk]]]:
+    from concurrent.futures import ProcessPoolExecutor
+    assumptions = scan_directives(preprocessor, source_lines, split_range(len(source_lines), num_workers * CHUNKS_PER_WORKER))
+    with ProcessPoolExecutor(max_workers=num_workers, initializer=_init_pass1_worker, initargs=(preprocessor, synthesizer, source_lines, filename)) as pool:
+        yield from zip(assumptions, pool.map(_lower_pass1_chunk, assumptions))
@@ -0,0 +1,125 @@
+from array import array
+from typing import Callable, Dict, List, NamedTuple, Optional, Sequence
+
+from assembler.ir import InstructionIR, OPERAND_IMMEDIATE, OPERAND_REGISTER
+from assembler.isa import InstructionSet
+from assembler.relocation import branch_target, displacement_fields, relocate
+from assembler.state import AssemblerPassState
+
+'''
+A peephole rule. matches(optimizer, index, next_index) returns True if the instruction at index can be
+removed; next_index is the index of the next instruction that's still in the program (len(ir) if it's
+the last one). A rule may only look at the instruction it's given and the ones after it, and must only
+match instructions whose removal changes nothing on any path through them: the instruction after a
+removed one takes over its address (and its labels), so a branch to it still lands in the right place.
+'''
+class PeepholeRule(NamedTuple):
+    name: str # reported with the number of instructions the rule removed
+    matches: Callable[['PeepholeOptimizer', int, int], bool]
+
+PeepholeRuleTable = Dict[str, List[PeepholeRule]] # rules tried on each instruction, by opcode name
+
+
+'''
+Optional pass between pass 1 and pass 2 that removes redundant instructions from the IR (see
+Assembler.optimize). Rules are tried on every instruction, last to first, and rounds are repeated
+until no rule matches. The remaining instructions are then packed and everything that refers to an
+address is moved along with them: labels in the symbol table (a label on a removed instruction moves
+to the next remaining one) and the numeric displacements of pc_relative opcodes. Symbol references
+are resolved in pass 2 from the updated labels.
+
+Code addresses must only be taken through labels and PC relative displacements: an address computed
+into a register (ex. for JR/JALR) from numeric immediates isn't updated.
+'''
+class PeepholeOptimizer(object):
+
+    def __init__(self, instr_set: InstructionSet, rules: PeepholeRuleTable, pc_relative: Sequence[str] = ()):
+        self.__rules = rules
+        self.__displacements = displacement_fields(instr_set, pc_relative)
+        self.ir: InstructionIR = None
+        self.stats: Dict[str, int] = {} # instructions removed by each rule in the last optimize()
+        self.__aps: AssemblerPassState = None
+
+    '''
+    Returns the address the (PC relative) instruction branches or jumps to, or None if it isn't PC
+    relative or its target isn't a known label. Addresses are from before anything was removed.
+    '''
+    def target(self, index: int) -> Optional[int]:
+        return branch_target(self.ir, index, self.__displacements[self.ir.opcodes[index]], self.__aps.get_symbol_table())
+
+    '''
+    Removes the instructions the rules match and returns the IR of what's left (the same IR if nothing
+    was removed). The labels in aps's symbol table are moved to the new addresses.
+    '''
+    def optimize(self, ir: InstructionIR, aps: AssemblerPassState) -> InstructionIR:
+        self.ir, self.__aps = ir, aps
+        self.stats = { rule.name: 0 for rules in self.__rules.values() for rule in rules }
+        rules_by_opcode = [self.__rules.get(name, ()) for name in ir.opcode_names]
+        opcodes, stats = ir.opcodes, self.stats
+        removed = bytearray(len(ir))
+        try:
+            changed = True
+            while changed:
+                changed = False
+                next_index = len(ir)
+                for index in range(len(ir) - 1, -1, -1):
+                    if removed[index]: continue
+                    for rule in rules_by_opcode[opcodes[index]]:
+                        if rule.matches(self, index, next_index):
+                            removed[index] = 1
+                            stats[rule.name] += 1
+                            changed = True
+                            break
+                    else:
+                        next_index = index
+        finally:
+            self.ir, self.__aps = None, None
+        if not any(stats.values()):
+            return ir
+
+        # Every address moves down by the number of instructions removed below it, so a removed
+        # instruction's address (and labels) go to the next remaining one
+        new_addresses = array('I', [0])
+        num_removed = 0
+        for index, flag in enumerate(removed, 1):
+            num_removed += flag
+            new_addresses.append(index - num_removed)
+        kept = [index for index in range(len(ir)) if not removed[index]]
+        new_ir = ir.select(kept)
+        relocate(ir, new_ir, zip(kept, range(len(kept))), new_addresses, self.__displacements, aps.get_symbol_table()) # displacements only shrink, so they always fit
+        return new_ir
+
+
+'''
+Rule for ALU instructions with an immediate (Rd, Rs, imm) that leave Rs unchanged when imm is 0, ex.
+ADDI $r, $r, #0.
+'''
+def same_register_zero_immediate(optimizer: PeepholeOptimizer, index: int, next_index: int) -> bool:
+    operands = optimizer.ir.operands(index)
+    return (len(operands) == 3 and operands[0][0] == operands[1][0] == OPERAND_REGISTER and operands[0][1] == operands[1][1]
+            and operands[2] == (OPERAND_IMMEDIATE, 0))
+
+'''
+Rule that collapses a run of the same instruction into its last one (ex. back-to-back NOPs).
+'''
+def followed_by_same_instruction(optimizer: PeepholeOptimizer, index: int, next_index: int) -> bool:
+    ir = optimizer.ir
+    return next_index < len(ir) and ir.opcodes[next_index] == ir.opcodes[index] and ir.operands(next_index) == ir.operands(index)
+
+'''
+Rule for instructions that only write their first (register) operand, when the next instruction is
+the same kind of instruction writing the same register (ex. LBI $r immediately overwritten by another LBI $r).
+'''
+def overwritten_by_next(optimizer: PeepholeOptimizer, index: int, next_index: int) -> bool:
+    ir = optimizer.ir
+    if next_index == len(ir) or ir.opcodes[next_index] != ir.opcodes[index]: return False
+    register = ir.operands(index)[0]
+    return register[0] == OPERAND_REGISTER and ir.operands(next_index)[0] == register
+
+'''
+Rule for jumps to the next remaining instruction (or to a removed instruction in between).
+'''
+def jumps_to_next(optimizer: PeepholeOptimizer, index: int, next_index: int) -> bool:
+    target = optimizer.target(index)
+    return target is not None and index < target <= next_index
+
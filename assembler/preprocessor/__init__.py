@@ -1,4 +1,6 @@
 from .preprocessor import *
 
 from .preprocessor_task import *
-from .preprocessor_tasks import *
\ No newline at end of file
+from .preprocessor_tasks import *
+from .lexer import *
+from .token_preprocessor import *
\ No newline at end of file
@@ -0,0 +1,249 @@
+from typing import Iterator, List, NamedTuple, Optional, Tuple
+
+from .preprocessor_tasks import BlockCommentPrefix
+from assembler.isa import REGISTER_PREFIX, IMMEDIATE_PREFIX
+
+# Token kinds
+TOKEN_LABEL      = 0 # label name (without the label suffix)
+TOKEN_DIRECTIVE  = 1 # directive name (without the directive prefix)
+TOKEN_MNEMONIC   = 2 # instruction opcode as written
+TOKEN_REGISTER   = 3 # register operand (with its prefix)
+TOKEN_IMMEDIATE  = 4 # immediate operand (with its prefix)
+TOKEN_IDENTIFIER = 5 # any other operand (symbol references, directive values)
+
+TOKEN_KIND_NAMES = ('label', 'directive', 'mnemonic', 'register', 'immediate', 'identifier')
+
+COUNT_SLICE_BYTES = 1 << 20 # newlines in skipped block comments are counted this many bytes at a time
+SCAN_SLICE_BYTES = 1 << 16  # bytes of a mapped source split into lines at a time (see Lexer.iter_code_lines())
+
+'''
+A token of a source line. column is the 0-based offset of the token's first character in the line.
+'''
+class Token(NamedTuple):
+    kind: int
+    text: str
+    column: int
+
+
+'''
+An instruction as lexed by the preprocessor: its mnemonic and operand texts, which is all the
+synthesizer needs. Typed tokens with columns are built on demand (tokens()), ex. for diagnostics,
+so lexing an instruction allocates one object rather than one per token.
+
+code is the instruction text the operands were split from (after define substitution) and column is
+where it starts in the source line. If defines changed the text, origin holds the text as written so
+token columns still point at what's in the source.
+'''
+class LexedInstruction(NamedTuple):
+    mnemonic: str
+    operands: List[str]
+    code: str
+    column: int
+    origin: Optional[str] = None
+
+    def tokens(self) -> List[Token]:
+        tokens = split_instruction(self.code, self.column)
+        if self.origin is not None:
+            written = split_instruction(self.origin, self.column)
+            if len(written) == len(tokens):
+                tokens = [token._replace(column=written_token.column) for token, written_token in zip(tokens, written)]
+        return tokens
+
+    '''
+    Returns the column of the token with the given text, or None if the instruction has no such token.
+    '''
+    def locate(self, text: str) -> Optional[int]:
+        for token in self.tokens():
+            if token.text == text:
+                return token.column
+        return None
+
+
+'''
+Single pass lexer for assembly source lines.
+
+Each line is scanned once for comments (the block comment state carries over between lines), and the
+remaining code is dispatched on its first significant character: the directive prefix starts a
+directive, a line ending in the label suffix is a label and anything else is an instruction, which is
+split into a mnemonic and its operands. Every token records its column in the original line, so
+diagnostics can point at the exact position of the offending token.
+
+Block comments are blanked out rather than removed, so columns after a block comment on the same line
+stay exact.
+'''
+class Lexer(object):
+
+    def __init__(self, lineCommentPrefix: str, blockCommentPrefix: BlockCommentPrefix, directivePrefix: str, labelSuffix: str,
+                 registerPrefix: str = REGISTER_PREFIX, immediatePrefix: str = IMMEDIATE_PREFIX, operandDelim: str = ','):
+        self.__line_comment = lineCommentPrefix
+        self.__block_begin, self.__block_end = blockCommentPrefix
+        self.directive_prefix = directivePrefix
+        self.label_suffix = labelSuffix
+        self.__register_prefix = registerPrefix
+        self.__immediate_prefix = immediatePrefix
+        self.__operand_delim = operandDelim
+        self.in_block_comment = False
+
+    def reset(self):
+        self.in_block_comment = False
+
+    '''
+    Strips the comments from a line. Returns the remaining code with surrounding whitespace removed
+    and the column it starts at. The code is empty if the whole line is whitespace or comments.
+    '''
+    def scan(self, line: str) -> Tuple[str, int]:
+        if self.in_block_comment or self.__block_begin in line:
+            line = self.__blank_block_comments(line)
+        comment = line.find(self.__line_comment)
+        code = line if comment < 0 else line[:comment]
+        stripped = code.lstrip()
+        return stripped.rstrip(), len(code) - len(stripped)
+
+    def __blank_block_comments(self, line: str) -> str:
+        block_begin, block_end = self.__block_begin, self.__block_end
+        parts = []
+        pos = 0
+        while True:
+            if self.in_block_comment:
+                end = line.find(block_end, pos)
+                if end < 0:
+                    parts.append(' ' * (len(line) - pos))
+                    break
+                end += len(block_end)
+                parts.append(' ' * (end - pos))
+                pos = end
+                self.in_block_comment = False
+            else:
+                begin = line.find(block_begin, pos)
+                if begin < 0:
+                    parts.append(line[pos:])
+                    break
+                parts.append(line[pos:begin])
+                parts.append(' ' * len(block_begin))
+                pos = begin + len(block_begin)
+                self.in_block_comment = True
+        return ''.join(parts)
+
+    '''
+    Yields (lineno, line) for the lines of a source held as bytes (ex. a memory mapped file) that may
+    hold code, decoding only those. It must be consumed in step with scan(), whose block comment state
+    it follows: blank lines and line comments are skipped without being decoded, and so is everything
+    inside a block comment, up to the line that closes it, in a single search however many lines it spans.
+    '''
+    def iter_code_lines(self, buffer: bytes, encoding: str = 'utf-8') -> Iterator[Tuple[int, str]]:
+        line_comment = self.__line_comment.encode(encoding)
+        block_begin, block_end = self.__block_begin.encode(encoding), self.__block_end.encode(encoding)
+        size = len(buffer)
+        pos = lineno = 0
+        while pos < size:
+            if self.in_block_comment:
+                end = buffer.find(block_end, pos)
+                if end < 0:
+                    return # the rest of the source is commented out
+                newline = buffer.rfind(b'\n', pos, end)
+                if newline >= 0:
+                    lineno += count_newlines(buffer, pos, newline + 1)
+                    pos = newline + 1
+            # Lines are split a slice at a time; a block comment opening ends the slice early
+            end = buffer.rfind(b'\n', pos, pos + SCAN_SLICE_BYTES) + 1 or buffer.find(b'\n', pos) + 1 or size
+            raw_lines = buffer[pos:end].split(b'\n')
+            if not raw_lines[-1]:
+                raw_lines.pop() # the slice ends with a newline
+            for raw_line in raw_lines:
+                pos += len(raw_line) + 1
+                code = raw_line.lstrip()
+                if code and (self.in_block_comment or not code.startswith(line_comment) or block_begin in raw_line):
+                    yield lineno, raw_line.decode(encoding)
+                    if self.in_block_comment:
+                        lineno += 1
+                        break
+                lineno += 1
+
+    '''
+    Tokenizes a line (see scan()). Returns an empty list for lines without code.
+    '''
+    def tokenize(self, line: str) -> List[Token]:
+        code, column = self.scan(line)
+        return self.tokenize_code(code, column) if code else []
+
+    '''
+    Tokenizes code returned by scan(), dispatching on its first character.
+    '''
+    def tokenize_code(self, code: str, column: int) -> List[Token]:
+        if self.directive_prefix and code.startswith(self.directive_prefix):
+            name, _, value = code[len(self.directive_prefix):].partition(' ')
+            tokens = [Token(TOKEN_DIRECTIVE, name, column + len(self.directive_prefix))]
+            stripped = value.lstrip()
+            if stripped:
+                tokens.append(Token(self.operand_kind(stripped), stripped, column + len(code) - len(stripped)))
+            return tokens
+        if self.label_suffix and code.endswith(self.label_suffix):
+            return [Token(TOKEN_LABEL, code[:-len(self.label_suffix)].rstrip(), column)]
+        return self.tokenize_instruction(code, column)
+
+    def tokenize_instruction(self, code: str, column: int) -> List[Token]:
+        return split_instruction(code, column, self.__operand_delim, self.__register_prefix, self.__immediate_prefix)
+
+    def lex_instruction(self, code: str, column: int, origin: str = None) -> LexedInstruction:
+        return lex_instruction(code, column, origin, self.__operand_delim)
+
+    def operand_kind(self, text: str) -> int:
+        return operand_kind(text, self.__register_prefix, self.__immediate_prefix)
+
+    '''
+    Returns the column of the token with the given text in a line (lexed on its own, without the
+    block comment state of the surrounding lines). Falls back to a plain search of the line.
+    Returns None if the text isn't found.
+    '''
+    def locate(self, line: str, text: str) -> Optional[int]:
+        in_block_comment = self.in_block_comment
+        self.in_block_comment = False
+        try:
+            for token in self.tokenize(line):
+                if token.text == text:
+                    return token.column
+        finally:
+            self.in_block_comment = in_block_comment
+        column = line.find(text) if text else -1
+        return column if column >= 0 else None
+
+
+'''
+Counts the newlines in buffer[start:end] (mmap has no count()). Large spans are counted in slices of
+COUNT_SLICE_BYTES, so memory stays bounded.
+'''
+def count_newlines(buffer: bytes, start: int, end: int) -> int:
+    count = 0
+    for pos in range(start, end, COUNT_SLICE_BYTES):
+        count += buffer[pos:min(pos + COUNT_SLICE_BYTES, end)].count(b'\n')
+    return count
+
+def operand_kind(text: str, registerPrefix: str = REGISTER_PREFIX, immediatePrefix: str = IMMEDIATE_PREFIX) -> int:
+    if text.startswith(registerPrefix):
+        return TOKEN_REGISTER
+    if text.startswith(immediatePrefix):
+        return TOKEN_IMMEDIATE
+    return TOKEN_IDENTIFIER
+
+'''
+Splits instruction code (no comments or surrounding whitespace) into its mnemonic and operand tokens.
+Operands are the text between operand delimiters with surrounding whitespace removed (possibly empty,
+ex. 'ADD $1,,$2').
+'''
+def split_instruction(code: str, column: int = 0, operandDelim: str = ',', registerPrefix: str = REGISTER_PREFIX, immediatePrefix: str = IMMEDIATE_PREFIX) -> List[Token]:
+    mnemonic, sep, operands = code.partition(' ')
+    tokens = [Token(TOKEN_MNEMONIC, mnemonic, column)]
+    if sep:
+        opd_column = column + len(mnemonic) + 1
+        for field in operands.split(operandDelim):
+            text = field.strip()
+            tokens.append(Token(operand_kind(text, registerPrefix, immediatePrefix), text, opd_column + len(field) - len(field.lstrip())))
+            opd_column += len(field) + 1
+    return tokens
+
+'''
+Splits instruction code into its mnemonic and operand texts (the same split as split_instruction()).
+'''
+def lex_instruction(code: str, column: int = 0, origin: str = None, operandDelim: str = ',') -> LexedInstruction:
+    mnemonic, sep, operands = code.partition(' ')
+    return LexedInstruction(mnemonic, [field.strip() for field in operands.split(operandDelim)] if sep else [], code, column, origin)
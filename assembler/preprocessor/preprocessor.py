@@ -1,7 +1,13 @@
-from typing import List
+from typing import Iterator, List, Optional, Tuple, TYPE_CHECKING
 from .preprocessor_task import PreprocessorTask
+from .lexer import LexedInstruction, lex_instruction
+from assembler.exceptions import AssemblerError
+from assembler.memory import DATA_SEGMENT
 from assembler.state import AssemblerPassState
 
+if TYPE_CHECKING:
+    from assembler.profiling import Profiler
+
 
 '''
 The preprocessor is reponsible for stripping source code down to just the instructions
@@ -12,12 +18,21 @@ it for the synthesizer.
 '''
 class Preprocessor(object):
 
+    SPLITTABLE = False # whether the source can be preprocessed in chunks (see assembler.parallel); needs in_block_comment and directive_prefix
+
     def __init__(self, tasks: List[PreprocessorTask]):
         self.__tasks = tasks
 
     def reset(self):
         for task in self.__tasks:
             task.reset()
+
+    '''
+    Profiling hook (see assembler.profiling): times every task under 'pass1.<task class name>'.
+    '''
+    def instrument(self, profiler: 'Profiler'):
+        for task in self.__tasks:
+            profiler.instrument(task, 'process_line', 'pass1.' + type(task).__name__)
     
     def process_line(self, line: str, aps: AssemblerPassState) -> str:
         current_line = line
@@ -29,5 +44,36 @@ class Preprocessor(object):
                 break
             current_line = task.process_line(current_line, aps)
         if current_line and not consumed_line:
+            if aps.segment is DATA_SEGMENT:
+                raise AssemblerError('Instructions must be placed in the TEXT segment, not the DATA segment.', aps.filename, aps.lineno, line, current_line.partition(' ')[0])
             aps.pc_addr += 1 # Uneaten lines are instructions, increment the PC for each instruction
-        return current_line
\ No newline at end of file
+        return current_line
+
+    '''
+    Returns the line's instruction split into its mnemonic and operands (see lexer.LexedInstruction),
+    or None if the line has no instruction. Task based preprocessors split what process_line() returns.
+    '''
+    def lex_line(self, line: str, aps: AssemblerPassState) -> Optional[LexedInstruction]:
+        instr = self.process_line(line, aps)
+        return lex_instruction(instr) if instr else None
+
+    '''
+    Yields (lineno, line) for the lines of a source held as bytes (ex. a memory mapped file) that may
+    hold code. Task based preprocessors only see whole lines, so every line is decoded.
+    '''
+    def iter_code_lines(self, buffer: bytes, encoding: str = 'utf-8') -> Iterator[Tuple[int, str]]:
+        size = len(buffer)
+        pos = lineno = 0
+        while pos < size:
+            newline = buffer.find(b'\n', pos)
+            next_pos = size if newline < 0 else newline + 1
+            yield lineno, buffer[pos:next_pos].decode(encoding)
+            pos = next_pos
+            lineno += 1
+
+    '''
+    Returns the column of the given token text in a source line, or None if it isn't found.
+    '''
+    def locate(self, line: str, text: str) -> Optional[int]:
+        column = line.find(text) if text else -1
+        return column if column >= 0 else None
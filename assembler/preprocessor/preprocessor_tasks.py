@@ -1,12 +1,9 @@
-import re
 from typing import Any, Dict, NamedTuple
 
 from .preprocessor_task import *
 from assembler.directives.directive_processor import DirectiveProcessor, DirectiveTable
 from assembler.exceptions import AssemblerError
 
-from bitstring import Bits
-
 
 '''
 Preprocessor task to process labels in the source code.
@@ -28,8 +25,7 @@ class LabelTask(PreprocessorTask):
         if not line: return None
         if self.__labelSuffix and line.endswith(self.__labelSuffix):
             label_name = line[:-len(self.__labelSuffix)].strip() # exclude label suffix from the name
-            label_addr = Bits(uint=aps.pc_addr, length=64)
-            aps.add_symbol(label_name, label_addr)
+            aps.add_label(label_name)
             return None # strip entire line from source code
         return line
 
@@ -130,16 +126,11 @@ class DirectiveTask(PreprocessorTask):
 
 '''
 Preprocessor task that substitutes values in the assembler definition table.
-These definition values come from define directives.
+These definition values come from define directives. The matching itself is done by the
+definition table, which keeps its matcher up to date as defines are added instead of
+rebuilding it for every line.
 '''
 class SubstituteTokensTask(PreprocessorTask):
 
-    replacements = None
-
-    def replace_token(match):
-        return SubstituteTokensTask.replacements[match.group(0)]
-
     def process_line(self, line: str, aps: AssemblerPassState) -> str:
-        SubstituteTokensTask.replacements = aps.get_define_table()
-        line = re.sub('|'.join(r'\b%s\b' % re.escape(s) for s in SubstituteTokensTask.replacements), SubstituteTokensTask.replace_token, line) 
-        return line
\ No newline at end of file
+        return aps.substitute_defines(line)
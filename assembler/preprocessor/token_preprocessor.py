@@ -0,0 +1,107 @@
+from typing import Iterator, List, Optional, Tuple, TYPE_CHECKING
+
+from .preprocessor import Preprocessor
+from .lexer import Lexer, LexedInstruction, Token
+from assembler.directives.directive_processor import DirectiveProcessor, DirectiveTable
+from assembler.exceptions import AssemblerError
+from assembler.memory import DATA_SEGMENT
+from assembler.state import AssemblerPassState
+
+if TYPE_CHECKING:
+    from assembler.profiling import Profiler
+
+
+'''
+Preprocessor that runs over the tokens of a single pass lexer (see lexer.Lexer) instead of a chain of
+string processing tasks. Each line is scanned once; labels are added to the symbol table, directives
+are handed to their directive processors and instructions have their defines substituted. Equivalent
+to the StripCommentsTask, StripWhitespaceTask, DirectiveTask, LabelTask, SubstituteTokensTask chain.
+'''
+class TokenPreprocessor(Preprocessor):
+
+    SPLITTABLE = True
+
+    def __init__(self, lexer: Lexer, directiveTable: DirectiveTable):
+        super().__init__([])
+        self.__lexer = lexer
+        self.__directiveTable = directiveTable
+
+    def reset(self):
+        self.__lexer.reset()
+
+    '''
+    Whether the next line starts inside a block comment. The only state carried from one line to the
+    next besides the pass state, so setting it lets preprocessing resume in the middle of a source.
+    '''
+    @property
+    def in_block_comment(self) -> bool:
+        return self.__lexer.in_block_comment
+
+    @in_block_comment.setter
+    def in_block_comment(self, value: bool):
+        self.__lexer.in_block_comment = value
+
+    @property
+    def directive_prefix(self) -> str:
+        return self.__lexer.directive_prefix
+
+    '''
+    Profiling hook: times comment stripping, directives and instruction splitting. Labels and define
+    substitution are timed on the pass state (see Assembler).
+    '''
+    def instrument(self, profiler: 'Profiler'):
+        profiler.instrument(self.__lexer, 'scan', 'pass1.comments')
+        profiler.instrument(self, 'process_directive', 'pass1.directives')
+        profiler.instrument(self.__lexer, 'lex_instruction', 'pass1.lex')
+
+    '''
+    Returns the line's instruction (see lexer.LexedInstruction), or None if the line has no instruction.
+    '''
+    def lex_line(self, line: str, aps: AssemblerPassState) -> Optional[LexedInstruction]:
+        lexer = self.__lexer
+        code, column = lexer.scan(line)
+        if not code: return None
+        if lexer.directive_prefix and code.startswith(lexer.directive_prefix):
+            self.process_directive(lexer.tokenize_code(code, column), code, line, aps)
+            return None
+        if lexer.label_suffix and code.endswith(lexer.label_suffix):
+            aps.add_label(lexer.tokenize_code(code, column)[0].text)
+            return None
+
+        if aps.segment is DATA_SEGMENT:
+            raise AssemblerError('Instructions must be placed in the TEXT segment, not the DATA segment.', aps.filename, aps.lineno, line, code.partition(' ')[0], column)
+        aps.pc_addr += 1 # Every instruction takes one word
+        if aps.get_define_table():
+            substituted = aps.substitute_defines(code)
+            if substituted != code:
+                return lexer.lex_instruction(substituted, column, code)
+        return lexer.lex_instruction(code, column)
+
+    '''
+    Yields the lines of a source held as bytes that may hold code (see Lexer.iter_code_lines()).
+    Comment-only lines are skipped without being decoded.
+    '''
+    def iter_code_lines(self, buffer: bytes, encoding: str = 'utf-8') -> Iterator[Tuple[int, str]]:
+        return self.__lexer.iter_code_lines(buffer, encoding)
+
+    def process_line(self, line: str, aps: AssemblerPassState) -> str:
+        instr = self.lex_line(line, aps)
+        return instr.code if instr else None
+
+    def process_directive(self, tokens: List[Token], code: str, line: str, aps: AssemblerPassState):
+        dir_name = tokens[0].text
+        if len(tokens) < 2:
+            raise AssemblerError('Invalid assembler directive format \'{}\''.format(code), aps.filename, aps.lineno, line, dir_name, tokens[0].column)
+        try:
+            dir_processor: DirectiveProcessor = self.__directiveTable[dir_name.upper()] # uppercase makes the names case insensitive
+        except KeyError:
+            raise AssemblerError('Invalid assembler directive name \'{}\''.format(dir_name), aps.filename, aps.lineno, line, dir_name, tokens[0].column)
+        try:
+            if dir_processor: dir_processor.process(tokens[1].text, aps)
+        except AssemblerError as e:
+            if not e.line: e.line = line
+            if not e.at_token: e.at_token = tokens[1].text
+            raise e
+
+    def locate(self, line: str, text: str) -> Optional[int]:
+        return self.__lexer.locate(line, text)
@@ -0,0 +1,175 @@
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+# Top level phases of an assembly, in the order they run (sub-phases are named '<phase>.<part>')
+PHASE_READ     = 'read'     # reading the source file
+PHASE_PASS1    = 'pass1'    # preprocessing and lowering to the IR
+PHASE_OPTIMIZE = 'optimize' # peephole optimization of the IR (see Assembler.optimize)
+PHASE_RELAX    = 'relax'    # relaxing out of range branches (see Assembler.relax)
+PHASE_PASS2    = 'pass2'    # symbol resolution (in stream mode, encoding the spilled instructions)
+PHASE_WRITE    = 'write'    # encoding and writing the image (in stream mode this includes pass 2)
+
+TOP_LEVEL_PHASES = (PHASE_READ, PHASE_PASS1, PHASE_OPTIMIZE, PHASE_RELAX, PHASE_PASS2, PHASE_WRITE)
+
+'''
+Totals recorded for one phase. peak_bytes is the tracemalloc peak above the memory in use when the
+phase started (only recorded for top level phases, and only when tracing memory).
+'''
+class PhaseStats(object):
+
+    __slots__ = ('calls', 'seconds', 'peak_bytes')
+
+    def __init__(self, calls: int = 0, seconds: float = 0.0, peak_bytes: Optional[int] = None):
+        self.calls = calls
+        self.seconds = seconds
+        self.peak_bytes = peak_bytes
+
+    def __repr__(self):
+        return 'PhaseStats(calls={}, seconds={}, peak_bytes={})'.format(self.calls, self.seconds, self.peak_bytes)
+
+
+'''
+Collects wall time, call counts and (optionally) tracemalloc peaks per phase of an assembly.
+
+Top level phases are timed with phase(). Finer grained parts (preprocessor tasks, encoding per opcode)
+are timed by instrument(), which shadows a method on one object with a timing wrapper until restore()
+is called. Nothing is patched while no profiler is installed, so the assembler's hot loops pay
+nothing when profiling is off (see Assembler.profiler).
+
+Memory tracing (trace_memory) starts tracemalloc on the first phase, which slows everything down
+considerably; times recorded with it are only useful relative to each other.
+'''
+class Profiler(object):
+
+    def __init__(self, trace_memory: bool = False):
+        self.trace_memory = trace_memory
+        self.stats: Dict[str, PhaseStats] = {}
+        self.__patches: List[Tuple[Any, str]] = []
+        self.__started_tracing = False
+        from assembler.isa import operand_cache_stats
+        self.__cache_baseline = operand_cache_stats()
+
+    def get(self, name: str) -> PhaseStats:
+        stats = self.stats.get(name)
+        if stats is None:
+            stats = self.stats[name] = PhaseStats()
+        return stats
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        stats = self.get(name)
+        tracemalloc = None
+        if self.trace_memory:
+            import tracemalloc
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self.__started_tracing = True
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            stats.seconds += time.perf_counter() - start
+            stats.calls += 1
+            if tracemalloc is not None:
+                peak = tracemalloc.get_traced_memory()[1] - base
+                stats.peak_bytes = max(stats.peak_bytes or 0, peak)
+
+    '''
+    Returns a wrapper of fn that adds the time of every call to the named phase.
+    '''
+    def wrap(self, name: str, fn: Callable) -> Callable:
+        stats = self.get(name)
+        perf_counter = time.perf_counter
+        def timed(*args, **kwargs):
+            start = perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                stats.seconds += perf_counter() - start
+                stats.calls += 1
+        return timed
+
+    '''
+    Times every call of obj.method_name as the named phase, until restore() is called.
+    '''
+    def instrument(self, obj: Any, method_name: str, name: str):
+        setattr(obj, method_name, self.wrap(name, getattr(obj, method_name)))
+        self.__patches.append((obj, method_name))
+
+    '''
+    Removes every wrapper installed by instrument() (most recent first).
+    '''
+    def restore(self):
+        while self.__patches:
+            obj, method_name = self.__patches.pop()
+            try:
+                delattr(obj, method_name)
+            except AttributeError:
+                pass
+
+    def close(self):
+        self.restore()
+        if self.__started_tracing:
+            import tracemalloc
+            tracemalloc.stop()
+            self.__started_tracing = False
+
+    '''
+    Returns the stats as plain data (ex. to send them between processes), including the operand
+    cache hits and misses since the profiler was created.
+    '''
+    def to_dict(self) -> Dict[str, Any]:
+        from assembler.isa import operand_cache_stats
+        caches = {}
+        for cache_name, (hits, misses, _) in operand_cache_stats().items():
+            base_hits, base_misses, _ = self.__cache_baseline.get(cache_name, (0, 0, 0))
+            caches[cache_name] = [hits - base_hits, misses - base_misses]
+        return {
+            'phases': { name: [stats.calls, stats.seconds, stats.peak_bytes] for name, stats in self.stats.items() if stats.calls },
+            'operand_caches': caches,
+        }
+
+
+'''
+Adds stats returned by Profiler.to_dict() to total (which has the same form). Returns total.
+'''
+def merge_stats(total: Dict[str, Any], stats: Dict[str, Any]) -> Dict[str, Any]:
+    phases = total.setdefault('phases', {})
+    for name, (calls, seconds, peak_bytes) in stats.get('phases', {}).items():
+        old_calls, old_seconds, old_peak = phases.get(name, (0, 0.0, None))
+        peaks = [peak for peak in (old_peak, peak_bytes) if peak is not None]
+        phases[name] = [old_calls + calls, old_seconds + seconds, max(peaks) if peaks else None]
+    caches = total.setdefault('operand_caches', {})
+    for name, (hits, misses) in stats.get('operand_caches', {}).items():
+        old_hits, old_misses = caches.get(name, (0, 0))
+        caches[name] = [old_hits + hits, old_misses + misses]
+    return total
+
+'''
+Renders stats (see Profiler.to_dict()) as a table. Sub-phases are listed under their phase, slowest first.
+'''
+def format_stats(stats: Dict[str, Any]) -> List[str]:
+    phases = stats.get('phases', {})
+    lines = ['{:34s} {:>10s} {:>12s} {:>14s} {:>9s}'.format('phase', 'calls', 'total (ms)', 'per call (us)', 'peak MB')]
+    def row(name: str, label: str):
+        calls, seconds, peak_bytes = phases[name]
+        lines.append('{:34s} {:>10d} {:>12.2f} {:>14.3f} {:>9s}'.format(label, calls, seconds * 1000, seconds / calls * 1e6 if calls else 0.0,
+                                                                     '{:.2f}'.format(peak_bytes / (1 << 20)) if peak_bytes is not None else '-'))
+    top_level = [name for name in TOP_LEVEL_PHASES if name in phases] + sorted(name for name in phases if '.' not in name and name not in TOP_LEVEL_PHASES)
+    for name in top_level:
+        row(name, name)
+        for sub_name in sorted((sub for sub in phases if sub.startswith(name + '.')), key=lambda sub: -phases[sub][1]):
+            row(sub_name, '  ' + sub_name[len(name) + 1:])
+    for cache_name, (hits, misses) in sorted(stats.get('operand_caches', {}).items()):
+        if hits + misses:
+            lines.append('operand cache \'{}\': {} hit(s), {} miss(es) ({:.1%} hit rate)'.format(cache_name, hits, misses, hits / (hits + misses)))
+    return lines
+
+'''
+Returns profiler.phase(name), or a no-op context if profiler is None.
+'''
+def profile_phase(profiler: Optional[Profiler], name: str):
+    return profiler.phase(name) if profiler is not None else nullcontext()
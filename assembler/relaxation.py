@@ -0,0 +1,180 @@
+from array import array
+from bisect import bisect_left
+from typing import Dict, List, NamedTuple, Optional, Sequence
+
+from assembler.exceptions import AssemblerError
+from assembler.ir import InstructionIR, OPERAND_IMMEDIATE, OPERAND_IMPLICIT, OPERAND_SYMBOL
+from assembler.isa import InstructionSet, InstructionProcessor, int_to_field
+from assembler.relocation import displacement_fields, relocate
+from assembler.state import AssemblerPassState
+
+'''
+How a branch is rewritten when its label is out of reach of its displacement. With an inverse (a
+branch with the same operands taken exactly when this one isn't), it skips a long jump to the label;
+without one, the branch itself skips a jump over the long jump:
+
+    BLTZ $r, FAR  ->  BGEZ $r, #1        BEQZ $r, FAR  ->  BEQZ $r, #1
+                      J FAR                                J #1
+                                                           J FAR
+'''
+class BranchRelaxation(NamedTuple):
+    inverse: Optional[str] = None # opcode name of the inverse branch
+
+RelaxationTable = Dict[str, BranchRelaxation] # branches that can be relaxed, by opcode name
+
+'''
+A branch that was relaxed. displacement is the one the short form would have needed; words is the
+size of the sequence it was rewritten into, and taken/not_taken the number of instructions it
+executes when the branch is taken or not (both are 1 for the short form).
+'''
+class RelaxedBranch(NamedTuple):
+    lineno: int
+    opcode: str
+    symbol: str
+    displacement: int
+    words: int
+    taken: int
+    not_taken: int
+
+
+'''
+Pass between pass 1 and pass 2 that rewrites branches whose label doesn't fit their displacement field
+(see BranchRelaxation), instead of letting pass 2 fail on them. Every branch starts in its short form;
+relaxing one moves everything after it, which can push other branches out of range, so rounds are
+repeated until no more branches have to be relaxed (branches only ever grow, so this ends). Labels and
+numeric displacements are then moved to the new addresses, as the peephole optimizer does (see
+assembler.relocation).
+
+Only branches to labels are relaxed: a numeric displacement is taken as written (and reported if it no
+longer fits once branches around it grow). jump is the opcode of the long jump, which must have a PC
+relative displacement as its only operand.
+'''
+class BranchRelaxer(object):
+
+    def __init__(self, instr_set: InstructionSet, relaxations: RelaxationTable, jump: str, pc_relative: Sequence[str]):
+        self.__relaxations = relaxations
+        self.__instr_procs: List[InstructionProcessor] = list(instr_set.values())
+        self.__opcode_indexes = { name: i for i, name in enumerate(instr_set.keys()) }
+        self.__displacements = displacement_fields(instr_set, pc_relative)
+        self.__jump = self.__opcode_indexes[jump]
+        self.sites: List[RelaxedBranch] = [] # branches relaxed by the last relax()
+
+    '''
+    Returns the IR with every out of range branch relaxed (the same IR if none are), and moves the labels
+    in aps's symbol table to the new addresses.
+    '''
+    def relax(self, ir: InstructionIR, aps: AssemblerPassState) -> InstructionIR:
+        self.sites = []
+        sym_table = aps.get_symbol_table()
+        displacements = self.__displacements
+
+        # Range of the short form of every relaxable opcode (by IR opcode index), and each symbol's address before relaxing
+        ranges = [None] * len(ir.opcode_names)
+        for opcode, name in enumerate(ir.opcode_names):
+            if name in self.__relaxations:
+                opd_offset, opd_proc, shift = displacements[opcode]
+                if opd_proc.is_signed:
+                    ranges[opcode] = (opd_offset, -(1 << (opd_proc.length - 1)), (1 << (opd_proc.length - 1)) - 1)
+                else:
+                    ranges[opcode] = (opd_offset, 0, (1 << opd_proc.length) - 1)
+        get_symbol = sym_table.get
+        targets = [get_symbol(name) for name in ir.symbols]
+
+        # First round, with every branch in its short form (addresses are indexes). Branches to unknown
+        # symbols are left for pass 2 to report.
+        extra: Dict[int, int] = {} # extra[i] is the number of words relaxing instruction i added
+        opcodes, opd_start, opd_values, symbols = ir.opcodes, ir.opd_start, ir.opd_values, ir.symbols
+        for instr_index, opd_index in zip(ir.ref_instrs, ir.ref_operands):
+            short_range = ranges[opcodes[instr_index]]
+            if short_range is None: continue
+            opd_offset, low, high = short_range
+            target = targets[opd_values[opd_index]]
+            if target is not None and not low <= target - instr_index - 1 <= high and opd_index - opd_start[instr_index] == opd_offset:
+                extra[instr_index] = 1 if self.__relaxations[ir.opcode_names[opcodes[instr_index]]].inverse else 2
+        if not extra:
+            return ir
+
+        # Later rounds, until relaxing branches doesn't push any more out of range
+        branches = []
+        for instr_index, opd_index in zip(ir.ref_instrs, ir.ref_operands):
+            short_range = ranges[opcodes[instr_index]]
+            if short_range is None: continue
+            opd_offset, low, high = short_range
+            target = targets[opd_values[opd_index]]
+            if target is not None and instr_index not in extra and opd_index - opd_start[instr_index] == opd_offset:
+                branches.append((instr_index, target, low, high))
+
+        relaxed_indexes, extra_below = [], [0]
+        def address(index: int) -> int:
+            return index + extra_below[bisect_left(relaxed_indexes, index)]
+        grew = True
+        while grew:
+            relaxed_indexes = sorted(extra)
+            extra_below = [0]
+            for index in relaxed_indexes:
+                extra_below.append(extra_below[-1] + extra[index])
+            grew = False
+            for instr_index, target, low, high in branches:
+                if instr_index in extra: continue
+                if not low <= address(target) - address(instr_index) - 1 <= high:
+                    extra[instr_index] = 1 if self.__relaxations[ir.opcode_names[opcodes[instr_index]]].inverse else 2
+                    grew = True
+
+        for instr_index in relaxed_indexes:
+            opd_offset = displacements[opcodes[instr_index]][0]
+            symbol = symbols[opd_values[opd_start[instr_index] + opd_offset]]
+            self.sites.append(RelaxedBranch(ir.linenos[instr_index], ir.opcode_names[opcodes[instr_index]], symbol,
+                                            address(sym_table[symbol]) - address(instr_index) - 1, 1 + extra[instr_index], 2, extra[instr_index]))
+        new_ir, new_addresses, moved = self.__rewrite(ir, extra)
+        try:
+            relocate(ir, new_ir, moved, new_addresses, displacements, sym_table)
+        except ValueError as e:
+            index, msg = e.args
+            raise AssemblerError('{} (branches were relaxed in between; use a label)'.format(msg), aps.filename, ir.linenos[index])
+        return new_ir
+
+    '''
+    Copies the IR, replacing every relaxed branch by its sequence. Returns the new IR, the new address
+    of every instruction (and of the end) and the (old, new) indexes of the instructions copied as is.
+    '''
+    def __rewrite(self, ir: InstructionIR, extra: Dict[int, int]):
+        new_ir = InstructionIR(ir.opcode_names)
+        new_ir.symbols, new_ir.symbol_ids = list(ir.symbols), dict(ir.symbol_ids)
+        new_addresses = array('I')
+        moved = []
+        instr_procs, displacements, jump = self.__instr_procs, self.__displacements, self.__jump
+        opcodes, linenos, base_words, opd_start, opd_kinds, opd_values = ir.opcodes, ir.linenos, ir.base_words, ir.opd_start, ir.opd_kinds, ir.opd_values
+        append = new_ir.append
+        for index in range(len(ir)):
+            new_index = len(new_ir)
+            new_addresses.append(new_index)
+            start, end = opd_start[index], opd_start[index + 1]
+            if index not in extra:
+                moved.append((index, new_index))
+                append(opcodes[index], linenos[index], base_words[index], opd_kinds[start:end], opd_values[start:end])
+                continue
+            opcode, lineno = opcodes[index], linenos[index]
+            inverse = self.__relaxations[ir.opcode_names[opcode]].inverse
+            opd_offset, opd_proc, shift = displacements[opcode]
+            kinds, values = list(opd_kinds[start:end]), list(opd_values[start:end])
+            target_id = values[opd_offset]
+            kinds[opd_offset], values[opd_offset] = OPERAND_IMMEDIATE, 1
+            short = self.__opcode_indexes[inverse] if inverse else opcode
+            append(short, lineno, encode(instr_procs[short], kinds, values), kinds, values)
+            if not inverse:
+                append(jump, lineno, encode(instr_procs[jump], [OPERAND_IMMEDIATE], [1]), [OPERAND_IMMEDIATE], [1])
+            append(jump, lineno, instr_procs[jump].implicit_word, [OPERAND_SYMBOL], [target_id])
+        new_addresses.append(len(new_ir))
+        return new_ir, new_addresses, moved
+
+
+'''
+Returns the instruction word of an instruction with the given operands (in field order; symbol
+references are left as 0).
+'''
+def encode(instr_proc: InstructionProcessor, kinds: List[int], values: List[int]) -> int:
+    word = instr_proc.implicit_word
+    for (opd_name, opd_proc, shift), kind, value in zip(instr_proc.fields, kinds, values):
+        if kind != OPERAND_IMPLICIT and kind != OPERAND_SYMBOL:
+            word |= int_to_field(value, opd_proc.length) << shift
+    return word
@@ -0,0 +1,73 @@
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+from assembler.ir import InstructionIR, OPERAND_IMMEDIATE, OPERAND_SYMBOL
+from assembler.isa import InstructionSet, DisplacementOperandProcessor, int_to_field, to_signed
+from assembler.state import SymbolTable
+
+DisplacementField = Tuple[int, DisplacementOperandProcessor, int] # operand index, operand processor and shift of a PC relative displacement
+
+'''
+Returns the PC relative displacement field of every opcode of the instruction set (in IR opcode index
+order), or None for opcodes that aren't in pc_relative.
+'''
+def displacement_fields(instr_set: InstructionSet, pc_relative: Sequence[str]) -> List[Optional[DisplacementField]]:
+    fields = []
+    for name, instr_proc in instr_set.items():
+        field = None
+        if name in pc_relative:
+            for opd_index, (opd_name, opd_proc, shift) in enumerate(instr_proc.fields):
+                if isinstance(opd_proc, DisplacementOperandProcessor):
+                    field = (opd_index, opd_proc, shift)
+        fields.append(field)
+    return fields
+
+'''
+Returns the address a PC relative instruction of the IR branches or jumps to (through a label of
+sym_table or a numeric displacement), or None if the field is None or the label isn't known.
+'''
+def branch_target(ir: InstructionIR, index: int, field: Optional[DisplacementField], sym_table: SymbolTable) -> Optional[int]:
+    if field is None: return None
+    opd_index, opd_proc, shift = field
+    opd_index += ir.opd_start[index]
+    value, kind = ir.opd_values[opd_index], ir.opd_kinds[opd_index]
+    if kind == OPERAND_SYMBOL:
+        return sym_table.get(ir.symbols[value])
+    if kind == OPERAND_IMMEDIATE:
+        return index + 1 + (to_signed(value, opd_proc.length) if opd_proc.is_signed else value)
+    return None
+
+'''
+Moves everything that refers to a code address after instructions were removed from or inserted into
+ir to make new_ir. new_addresses[i] is the new address of ir's instruction i (new_addresses[len(ir)] is
+the new end of the program); addresses past the end move with it and negative ones stay put. moved
+holds the (old index, new index) of every instruction copied as is, whose numeric PC relative
+displacement (see displacement_fields()) is re-encoded. Labels in sym_table are moved too; references
+to them are resolved in pass 2.
+
+Raises ValueError (with the old index of the instruction) if a displacement no longer fits its field.
+'''
+def relocate(ir: InstructionIR, new_ir: InstructionIR, moved: Iterable[Tuple[int, int]], new_addresses: Sequence[int],
+             fields: List[Optional[DisplacementField]], sym_table: SymbolTable):
+    num_instrs = len(ir)
+    growth = new_addresses[num_instrs] - num_instrs
+    def new_address(addr: int) -> int:
+        if addr < 0: return addr
+        return new_addresses[addr] if addr <= num_instrs else addr + growth
+
+    opcodes = ir.opcodes
+    for index, new_index in moved:
+        field = fields[opcodes[index]]
+        if field is None: continue
+        opd_index, opd_proc, shift = field
+        new_opd_index = opd_index + new_ir.opd_start[new_index]
+        if new_ir.opd_kinds[new_opd_index] != OPERAND_IMMEDIATE: continue
+        try:
+            value = int_to_field(new_address(branch_target(ir, index, field, sym_table)) - new_index - 1, opd_proc.length, opd_proc.is_signed)
+        except ValueError as e:
+            raise ValueError(index, str(e))
+        mask = ((1 << opd_proc.length) - 1) << shift
+        new_ir.base_words[new_index] = (new_ir.base_words[new_index] & ~mask) | (value << shift)
+        new_ir.opd_values[new_opd_index] = value
+
+    for name, addr in sym_table.items():
+        sym_table[name] = new_address(addr)
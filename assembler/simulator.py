@@ -0,0 +1,393 @@
+from itertools import count
+from operator import mul
+from typing import Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from assembler.analysis import CycleModel
+from assembler.disassembler import decode_table
+from assembler.isa import InstructionSet, ImplicitOperandProcessor, RegisterOperandProcessor, to_signed
+
+NUM_REGISTERS = 8 # general purpose registers (also the number of vector registers)
+VECTOR_LENGTH = 4 # words per vector register (loaded by VLD, multiplied by VDOT)
+LINK_REGISTER = 7 # register JALR writes the return address to
+BYTE_LENGTH   = 8 # bits SLBI shifts its register by
+
+Step = Callable[[], int] # runs a pre-decoded instruction and returns the address of the next one
+
+'''
+Builds the step of an instruction: semantics(simulator, pc, *operands) returns a Step that runs the
+instruction at address pc. operands are its register numbers and immediates (sign extended if the
+field is signed) in source order, without implicit fields.
+'''
+Semantics = Callable[..., Step]
+SemanticsTable = Dict[str, Semantics] # semantics of every opcode, by opcode name
+
+
+class SimulationError(Exception):
+
+    def __init__(self, msg: str, pc: int):
+        super().__init__(msg)
+        self.pc = pc
+
+'''
+Raised by the step of a HALT instruction to leave the interpreter loop.
+'''
+class Halted(Exception):
+    pass
+
+'''
+Result of Simulator.run(). pc is the address of the HALT instruction if the program halted, or of the
+next instruction if it ran out of instructions. taken is the number of branches and jumps taken. counts
+(with counters on) holds the number of times every address was executed.
+'''
+class SimulationResult(NamedTuple):
+    halted: bool
+    pc: int
+    instructions: int
+    cycles: int
+    taken: int
+    counts: Optional[List[int]] = None
+
+    '''
+    Returns the (address, count) of the most executed addresses, most executed first.
+    '''
+    def hot_spots(self, top: int = 10) -> List[Tuple[int, int]]:
+        if self.counts is None: return []
+        executed = [(pc, n) for pc, n in enumerate(self.counts) if n]
+        executed.sort(key=lambda entry: (-entry[1], entry[0]))
+        return executed[:top]
+
+
+'''
+Functional simulator of programs assembled for an instruction set.
+
+The image is loaded at address 0 of a word addressed memory as large as a word can address, and every
+image word is decoded once, with the disassembler's decode table, into a step: a closure with its
+operands, its next address and its branch target already worked out (see Semantics). Running the
+program is then a loop that calls the step at the PC and adds its cycle cost from the model (plus the
+model's taken penalty for every taken branch or jump). Instructions are only decoded when the image
+is loaded: stores to the program's own words change memory but not the instructions that run.
+
+Registers and memory words hold unsigned values that wrap around at the word length. Words that
+aren't valid instructions and addresses past the image fail with a SimulationError when they're run.
+'''
+class Simulator(object):
+
+    def __init__(self, instr_set: InstructionSet, semantics: SemanticsTable, model: CycleModel):
+        self.word_length: int = max((instr_proc.length for instr_proc in instr_set.values()), default=0)
+        self.word_mask: int = (1 << self.word_length) - 1
+        self.sign_bit: int = 1 << (self.word_length - 1)
+        self.__opcode_length: int = min((instr_proc.opcode.length for instr_proc in instr_set.values()), default=0)
+        self.__instr_set = instr_set
+        self.__semantics = semantics
+        self.__table = decode_table(instr_set, self.word_length, self.__opcode_length)
+        self.model = model
+        self.registers: List[int] = [0] * NUM_REGISTERS
+        self.vectors: List[List[int]] = [[0] * VECTOR_LENGTH for _ in range(NUM_REGISTERS)]
+        self.memory: List[int] = []
+        self.taken: List[int] = [0] # branches and jumps taken, in a list so steps can count them
+        self.__steps: List[Step] = []
+        self.__costs: List[int] = []
+
+    '''
+    Returns the opcode name and the operands of a word, or None if it isn't a valid instruction.
+    '''
+    def decode(self, word: int) -> Optional[Tuple[str, Tuple[int, ...]]]:
+        for fixed_mask, fixed_word, name in self.__table[word >> (self.word_length - self.__opcode_length)]:
+            if word & fixed_mask == fixed_word:
+                break
+        else:
+            return None
+        operands = []
+        for _, opd_proc, shift in self.__instr_set[name].fields:
+            if type(opd_proc) == ImplicitOperandProcessor:
+                continue
+            value = (word >> shift) & ((1 << opd_proc.length) - 1)
+            if not isinstance(opd_proc, RegisterOperandProcessor) and opd_proc.is_signed:
+                value = to_signed(value, opd_proc.length)
+            operands.append(value)
+        return name, tuple(operands)
+
+    '''
+    Resets the registers and memory, loads the image (ex. the words of Assembler.assemble_lines()) at
+    address 0 and decodes it. Raises ValueError if it doesn't fit in memory.
+    '''
+    def load(self, words: Sequence[int]):
+        memory_size = self.word_mask + 1
+        if len(words) > memory_size:
+            raise ValueError('Image ({} words) doesn\'t fit in memory ({} words)'.format(len(words), memory_size))
+        self.registers[:] = [0] * NUM_REGISTERS
+        for vector in self.vectors:
+            vector[:] = [0] * VECTOR_LENGTH
+        self.memory = list(words) + [0] * (memory_size - len(words))
+        self.taken[0] = 0
+
+        decoded: Dict[int, Optional[Tuple[str, Tuple[int, ...]]]] = {} # programs reuse few of the possible words
+        steps, costs = [], []
+        cost = self.model.cost
+        for pc, word in enumerate(words):
+            instr = decoded.get(word, False)
+            if instr is False:
+                instr = decoded[word] = self.decode(word)
+            if instr is None:
+                steps.append(invalid_instruction(self, pc, word))
+                costs.append(0)
+                continue
+            name, operands = instr
+            steps.append(self.__semantics[name](self, pc, *operands))
+            costs.append(cost(name))
+        self.__steps, self.__costs = steps, costs
+
+    '''
+    Runs the loaded program from pc until it halts or max_instructions have run (no limit if None).
+    With counters, the result also counts how many times every address ran, which is slower.
+    Registers and memory are left as the program left them. Raises SimulationError (with the PC of the
+    instruction) on invalid instructions and addresses past the image.
+    '''
+    def run(self, pc: int = 0, max_instructions: int = None, counters: bool = False) -> SimulationResult:
+        steps, costs = self.__steps, self.__costs
+        taken_before = self.taken[0]
+        instructions = cycles = 0
+        counts = [0] * len(steps) if counters else None
+        halted = False
+        executed = count() if max_instructions is None else range(max_instructions)
+        try:
+            if counts is None:
+                for instructions in executed:
+                    cycles += costs[pc]
+                    pc = steps[pc]()
+                else:
+                    instructions = max_instructions
+            else:
+                for instructions in executed:
+                    cycles += costs[pc]
+                    counts[pc] += 1
+                    pc = steps[pc]()
+                else:
+                    instructions = max_instructions
+        except Halted:
+            halted = True
+            instructions += 1
+        except IndexError:
+            if pc < len(steps): raise
+            raise SimulationError('Address 0x{:04x} is past the end of the program'.format(pc), pc)
+        taken = self.taken[0] - taken_before
+        return SimulationResult(halted, pc, instructions, cycles + taken * self.model.taken_penalty, taken, counts)
+
+
+def invalid_instruction(sim: Simulator, pc: int, word: int) -> Step:
+    def step():
+        raise SimulationError('0x{:04x} at address 0x{:04x} is not a valid instruction'.format(word, pc), pc)
+    return step
+
+'''
+Semantics of the WISC-SP13 like instructions (see Semantics). Operands follow the source order of
+the instruction set: Rd, Rs, imm for ALU immediates, loads and stores, Rd, Rs, Rt for ALU registers.
+'''
+
+def halt(sim: Simulator, pc: int) -> Step:
+    def step():
+        raise Halted()
+    return step
+
+def nop(sim: Simulator, pc: int) -> Step:
+    next_pc = (pc + 1) & sim.word_mask
+    def step():
+        return next_pc
+    return step
+
+def add_immediate(sim: Simulator, pc: int, rd: int, rs: int, imm: int) -> Step:
+    r, mask, next_pc = sim.registers, sim.word_mask, (pc + 1) & sim.word_mask
+    def step():
+        r[rd] = (r[rs] + imm) & mask
+        return next_pc
+    return step
+
+def subtract_from_immediate(sim: Simulator, pc: int, rd: int, rs: int, imm: int) -> Step:
+    r, mask, next_pc = sim.registers, sim.word_mask, (pc + 1) & sim.word_mask
+    def step():
+        r[rd] = (imm - r[rs]) & mask
+        return next_pc
+    return step
+
+def shift_left_immediate(sim: Simulator, pc: int, rd: int, rs: int, imm: int) -> Step:
+    r, mask, next_pc = sim.registers, sim.word_mask, (pc + 1) & sim.word_mask
+    def step():
+        r[rd] = (r[rs] << imm) & mask
+        return next_pc
+    return step
+
+def shift_right_immediate(sim: Simulator, pc: int, rd: int, rs: int, imm: int) -> Step:
+    r, next_pc = sim.registers, (pc + 1) & sim.word_mask
+    def step():
+        r[rd] = r[rs] >> imm
+        return next_pc
+    return step
+
+def store(sim: Simulator, pc: int, rd: int, rs: int, imm: int) -> Step:
+    r, m, mask, next_pc = sim.registers, sim.memory, sim.word_mask, (pc + 1) & sim.word_mask
+    def step():
+        m[(r[rs] + imm) & mask] = r[rd]
+        return next_pc
+    return step
+
+'''
+Stores Rd like ST, then writes the address it stored to into Rs.
+'''
+def store_update(sim: Simulator, pc: int, rd: int, rs: int, imm: int) -> Step:
+    r, m, mask, next_pc = sim.registers, sim.memory, sim.word_mask, (pc + 1) & sim.word_mask
+    def step():
+        addr = (r[rs] + imm) & mask
+        m[addr] = r[rd]
+        r[rs] = addr
+        return next_pc
+    return step
+
+def load(sim: Simulator, pc: int, rd: int, rs: int, imm: int) -> Step:
+    r, m, mask, next_pc = sim.registers, sim.memory, sim.word_mask, (pc + 1) & sim.word_mask
+    def step():
+        r[rd] = m[(r[rs] + imm) & mask]
+        return next_pc
+    return step
+
+'''
+Loads the VECTOR_LENGTH words from address Rs + imm on into vector register Rd.
+'''
+def vector_load(sim: Simulator, pc: int, rd: int, rs: int, imm: int) -> Step:
+    r, m, v, mask, next_pc = sim.registers, sim.memory, sim.vectors[rd], sim.word_mask, (pc + 1) & sim.word_mask
+    last = len(sim.memory) - VECTOR_LENGTH
+    def step():
+        addr = (r[rs] + imm) & mask
+        if addr <= last:
+            v[:] = m[addr:addr + VECTOR_LENGTH]
+        else:
+            v[:] = [m[(addr + i) & mask] for i in range(VECTOR_LENGTH)]
+        return next_pc
+    return step
+
+'''
+Writes the dot product of vector registers Rd and Rs into GP register Rd, added to Rd's value if ac is 1.
+'''
+def vector_dot(sim: Simulator, pc: int, rd: int, rs: int, ac: int) -> Step:
+    r, a, b, mask, next_pc = sim.registers, sim.vectors[rd], sim.vectors[rs], sim.word_mask, (pc + 1) & sim.word_mask
+    def step():
+        r[rd] = ((r[rd] if ac else 0) + sum(map(mul, a, b))) & mask
+        return next_pc
+    return step
+
+def add(sim: Simulator, pc: int, rd: int, rs: int, rt: int) -> Step:
+    r, mask, next_pc = sim.registers, sim.word_mask, (pc + 1) & sim.word_mask
+    def step():
+        r[rd] = (r[rs] + r[rt]) & mask
+        return next_pc
+    return step
+
+'''
+Rd = Rt - Rs (the operands are the other way around from SUBI's).
+'''
+def subtract(sim: Simulator, pc: int, rd: int, rs: int, rt: int) -> Step:
+    r, mask, next_pc = sim.registers, sim.word_mask, (pc + 1) & sim.word_mask
+    def step():
+        r[rd] = (r[rt] - r[rs]) & mask
+        return next_pc
+    return step
+
+def set_if_equal(sim: Simulator, pc: int, rd: int, rs: int, rt: int) -> Step:
+    r, next_pc = sim.registers, (pc + 1) & sim.word_mask
+    def step():
+        r[rd] = 1 if r[rs] == r[rt] else 0
+        return next_pc
+    return step
+
+def set_if_less_than(sim: Simulator, pc: int, rd: int, rs: int, rt: int) -> Step:
+    r, sign, next_pc = sim.registers, sim.sign_bit, (pc + 1) & sim.word_mask
+    def step():
+        r[rd] = 1 if r[rs] ^ sign < r[rt] ^ sign else 0 # flipping the sign bits compares two's complement values
+        return next_pc
+    return step
+
+def set_if_less_or_equal(sim: Simulator, pc: int, rd: int, rs: int, rt: int) -> Step:
+    r, sign, next_pc = sim.registers, sim.sign_bit, (pc + 1) & sim.word_mask
+    def step():
+        r[rd] = 1 if r[rs] ^ sign <= r[rt] ^ sign else 0
+        return next_pc
+    return step
+
+'''
+Rd = carry out of Rs + Rt.
+'''
+def set_if_carry_out(sim: Simulator, pc: int, rd: int, rs: int, rt: int) -> Step:
+    r, length, next_pc = sim.registers, sim.word_length, (pc + 1) & sim.word_mask
+    def step():
+        r[rd] = (r[rs] + r[rt]) >> length
+        return next_pc
+    return step
+
+def branch_if_zero(sim: Simulator, pc: int, rs: int, disp: int) -> Step:
+    r, taken, next_pc, target = sim.registers, sim.taken, (pc + 1) & sim.word_mask, (pc + 1 + disp) & sim.word_mask
+    def step():
+        if r[rs] == 0:
+            taken[0] += 1
+            return target
+        return next_pc
+    return step
+
+def branch_if_negative(sim: Simulator, pc: int, rs: int, disp: int) -> Step:
+    r, sign, taken, next_pc, target = sim.registers, sim.sign_bit, sim.taken, (pc + 1) & sim.word_mask, (pc + 1 + disp) & sim.word_mask
+    def step():
+        if r[rs] & sign:
+            taken[0] += 1
+            return target
+        return next_pc
+    return step
+
+def branch_if_not_negative(sim: Simulator, pc: int, rs: int, disp: int) -> Step:
+    r, sign, taken, next_pc, target = sim.registers, sim.sign_bit, sim.taken, (pc + 1) & sim.word_mask, (pc + 1 + disp) & sim.word_mask
+    def step():
+        if not r[rs] & sign:
+            taken[0] += 1
+            return target
+        return next_pc
+    return step
+
+def load_byte_immediate(sim: Simulator, pc: int, rs: int, imm: int) -> Step:
+    r, value, next_pc = sim.registers, imm & sim.word_mask, (pc + 1) & sim.word_mask
+    def step():
+        r[rs] = value
+        return next_pc
+    return step
+
+'''
+Rs = (Rs << 8) | imm, ex. to load the low byte of a word after LBI loaded its high byte.
+'''
+def shift_load_byte_immediate(sim: Simulator, pc: int, rs: int, imm: int) -> Step:
+    r, mask, next_pc = sim.registers, sim.word_mask, (pc + 1) & sim.word_mask
+    def step():
+        r[rs] = ((r[rs] << BYTE_LENGTH) | imm) & mask
+        return next_pc
+    return step
+
+def jump(sim: Simulator, pc: int, disp: int) -> Step:
+    taken, target = sim.taken, (pc + 1 + disp) & sim.word_mask
+    def step():
+        taken[0] += 1
+        return target
+    return step
+
+def jump_register(sim: Simulator, pc: int, rs: int, imm: int) -> Step:
+    r, taken, mask = sim.registers, sim.taken, sim.word_mask
+    def step():
+        taken[0] += 1
+        return (r[rs] + imm) & mask
+    return step
+
+'''
+Jumps to Rs + imm and writes the address of the next instruction into LINK_REGISTER (after reading Rs).
+'''
+def jump_and_link_register(sim: Simulator, pc: int, rs: int, imm: int) -> Step:
+    r, taken, mask, next_pc = sim.registers, sim.taken, sim.word_mask, (pc + 1) & sim.word_mask
+    def step():
+        taken[0] += 1
+        target = (r[rs] + imm) & mask
+        r[LINK_REGISTER] = next_pc
+        return target
+    return step
@@ -1,9 +1,9 @@
-from typing import Dict
-from bitstring import Bits
+from typing import Callable, Dict, List, Optional, Tuple
 
-from assembler.memory import MemorySegment
+from assembler.defines import DefineTable
+from assembler.memory import DataSegment, MemorySegment, DATA_SEGMENT
 
-SymbolTable = Dict[str, Bits]
+SymbolTable = Dict[str, int] # Maps symbol names to addresses
 
 class AssemblerPassState(object):
 
@@ -12,18 +12,41 @@ class AssemblerPassState(object):
         self.lineno: int = 0
         self.pc_addr: int = 0
         self.segment: MemorySegment = MemorySegment.TEXT # Assume text (code) segment if none defined in source file
-        self.__sym_table = {}
-        self.__def_table = {}
-
-    def add_symbol(self, name: str, value: Bits):
+        self.data = DataSegment() # filled by the data directives, laid out after the instructions
+        self.include: Optional[Callable[[str], None]] = None # merges an included file (by real path) at the current line; None if .include isn't supported
+        self.include_paths: List[str] = []   # directories searched for included files after the including file's own
+        self.include_stack: List[str] = []   # real paths of the source file and the files including it, outermost first
+        self.included: List[Tuple[str, str]] = [] # (real path, content hash) of every file included so far
+        self.__sym_table: SymbolTable = {}
+        self.__def_table = DefineTable()
+        self.__define_lines: Dict[str, int] = {} # line of the last define directive of each name
+
+    def add_symbol(self, name: str, value: int):
         self.__sym_table[name] = value
-        #print('{}:{}: INFO: Resolved symbol \'{}\' at address {} with value 0x{}'.format(self.filename, self.lineno, name, self.pc_addr, value.hex))
-
-    def get_symbol(self, name:str) -> Bits:
+        #print('{}:{}: INFO: Resolved symbol \'{}\' at address {} with value 0x{:x}'.format(self.filename, self.lineno, name, self.pc_addr, value))
+
+    '''
+    Adds a label for the next address of the current segment. Labels in the DATA segment are placed
+    once the size of the TEXT segment is known (see DataSegment.place()).
+    '''
+    def add_label(self, name: str):
+        if self.segment is DATA_SEGMENT:
+            self.data.add_label(name)
+        else:
+            self.add_symbol(name, self.pc_addr)
+
+    def get_symbol(self, name:str) -> int:
         return self.__sym_table[name]
 
+    def get_symbol_table(self) -> SymbolTable:
+        return self.__sym_table
+
     def add_define(self, name: str, value: str):
-        self.__def_table[name] = value
+        self.__def_table.add(name, value)
+        self.__define_lines[name] = self.lineno
+
+    def get_define_line(self, name: str) -> int:
+        return self.__define_lines[name]
 
     def get_define(self, name: str) -> str:
         return self.__def_table[name]
@@ -31,6 +54,9 @@ class AssemblerPassState(object):
     def get_defines(self):
         return self.__def_table.items()
     
-    def get_define_table(self):
+    def get_define_table(self) -> DefineTable:
         return self.__def_table
 
+    def substitute_defines(self, line: str) -> str:
+        return self.__def_table.substitute(line)
+
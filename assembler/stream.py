@@ -0,0 +1,106 @@
+import mmap
+import struct
+from typing import BinaryIO, Iterator, Tuple
+
+SOURCE_ENCODING = 'utf-8'
+
+'''
+Yields (byte offset, line) for every line of a source file opened in binary mode.
+Lines are decoded one at a time so the file is never held in memory as a whole.
+'''
+def iter_source_lines(src_file: BinaryIO) -> Iterator[Tuple[int, str]]:
+    offset = 0
+    for raw_line in src_file:
+        yield offset, raw_line.decode(SOURCE_ENCODING)
+        offset += len(raw_line)
+
+'''
+Re-reads a single source line by its byte offset (used for diagnostics in streaming mode,
+where source lines aren't kept after pass 1).
+'''
+def read_source_line(src_file: BinaryIO, offset: int) -> str:
+    pos = src_file.tell()
+    try:
+        src_file.seek(offset)
+        return src_file.readline().decode(SOURCE_ENCODING).rstrip('\r\n')
+    finally:
+        src_file.seek(pos)
+
+
+'''
+A source file memory mapped read only (see Assembler.assemble_file_mapped()). buffer is the mapping
+(or empty bytes for an empty file, which can't be mapped). Lines are only decoded on demand; indexing
+with a line number (line()) finds the line by counting newlines, which is meant for diagnostics.
+'''
+class MappedSource(object):
+
+    def __init__(self, filepath: str):
+        self.filepath = filepath
+        with open(filepath, 'rb') as fp:
+            size = fp.seek(0, 2)
+            self.buffer = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+
+    def line(self, lineno: int) -> str:
+        buffer = self.buffer
+        pos = 0
+        for _ in range(lineno):
+            pos = buffer.find(b'\n', pos) + 1
+            if not pos:
+                return ''
+        end = buffer.find(b'\n', pos)
+        return buffer[pos:end if end >= 0 else len(buffer)].decode(SOURCE_ENCODING).rstrip('\r')
+
+    __getitem__ = line # lets the source stand in for source lines in diagnostics
+
+    def close(self):
+        if isinstance(self.buffer, mmap.mmap):
+            self.buffer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+'''
+Temporary file holding the per-instruction records pass 1 hands to pass 2 in streaming mode.
+Each record is the source line number, the byte offset of the source line and the preprocessed
+instruction text. Records are written and read back sequentially through buffered I/O, so memory
+use doesn't depend on the number of instructions.
+'''
+class InstructionSpill(object):
+
+    RECORD_HEADER = struct.Struct('<IQH') # lineno, source offset, instruction text length
+
+    def __init__(self):
+        import tempfile # only needed when streaming; SOURCE_ENCODING users shouldn't pay for it
+        self.__file = tempfile.TemporaryFile()
+        self.count = 0
+
+    def append(self, lineno: int, offset: int, instr: str):
+        instr_bytes = instr.encode(SOURCE_ENCODING)
+        self.__file.write(InstructionSpill.RECORD_HEADER.pack(lineno, offset, len(instr_bytes)))
+        self.__file.write(instr_bytes)
+        self.count += 1
+
+    '''
+    Yields (lineno, offset, instruction text) for every record in the order they were appended.
+    '''
+    def __iter__(self) -> Iterator[Tuple[int, int, str]]:
+        spill = self.__file
+        spill.flush()
+        spill.seek(0)
+        header = InstructionSpill.RECORD_HEADER
+        for _ in range(self.count):
+            lineno, offset, length = header.unpack(spill.read(header.size))
+            yield lineno, offset, spill.read(length).decode(SOURCE_ENCODING)
+
+    def close(self):
+        self.__file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
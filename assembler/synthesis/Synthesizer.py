@@ -1,8 +1,17 @@
+from array import array
+from bisect import bisect_left
+from typing import Optional, TYPE_CHECKING
+
+from assembler.ir import InstructionIR
 from assembler.isa import InstructionSet, InstructionProcessor, AssembledBitString
+from assembler.preprocessor.lexer import LexedInstruction
 from assembler.state import AssemblerPassState
 
 from assembler.exceptions import AssemblerWarning, AssemblerError
 
+if TYPE_CHECKING:
+    from assembler.profiling import Profiler
+
 '''
 The synthesizer represents the 2nd pass of a two pass assembler. The synthesizer's job
 is to translate assembly instructions to CPU machine code. At a higher level, this means
@@ -12,16 +21,80 @@ class Synthesizer(object):
     
     def __init__(self, instr_set: InstructionSet):
         self.__instr_set = instr_set
+        self.word_length: int = max((instr_proc.length for instr_proc in instr_set.values()), default=0)
+        # IR opcode indexes refer to the instruction set's order
+        self.opcode_names = list(instr_set.keys())
+        self.__instr_procs = list(instr_set.values())
+        self.__opcode_indexes = { name: i for i, name in enumerate(self.opcode_names) }
+        self.__fingerprint: str = None
+
+    '''
+    Hex digest identifying the instruction set's encodings (opcodes, field layout and operand
+    processor settings), used to key cached images. Changing any table entry changes the fingerprint.
+    '''
+    def fingerprint(self) -> str:
+        if self.__fingerprint is None:
+            import hashlib
+            description = [ (name, instr_proc.length, instr_proc.opcode_word, [ (field_name, type(opd_proc).__name__, shift, sorted((k, v) for k, v in vars(opd_proc).items() if not k.startswith('_'))) for field_name, opd_proc, shift in instr_proc.fields ])
+                            for name, instr_proc in self.__instr_set.items() ]
+            self.__fingerprint = hashlib.sha256(repr(description).encode('utf-8')).hexdigest()
+        return self.__fingerprint
 
     def reset(self):
         pass
 
+    '''
+    Profiling hook (see assembler.profiling): times operand encoding per opcode, under 'pass1.encode.<opcode>'
+    when lowering to the IR and 'pass2.encode.<opcode>' when encoding whole instructions (stream mode).
+    Instruction processors are shared, so only one assembler in a process should be profiled at a time.
+    '''
+    def instrument(self, profiler: 'Profiler'):
+        for name, instr_proc in self.__instr_set.items():
+            profiler.instrument(instr_proc, 'lower_operands', 'pass1.encode.' + name)
+            profiler.instrument(instr_proc, 'encode_str', 'pass2.encode.' + name)
+
     def process_instruction(self, instr_str: str, line: str, aps: AssemblerPassState) -> AssembledBitString:
         if not instr_str: return AssembledBitString(None, None)
+        word = self.encode_instruction(instr_str, line, aps)
+        from bitstring import Bits
+        return AssembledBitString(Bits(uint=word, length=self.word_length), list())
+
+    '''
+    Integer path of process_instruction(). Returns the machine code word as an unsigned int,
+    or None if the line has no instruction.
+    '''
+    def encode_instruction(self, instr_str: str, line: str, aps: AssemblerPassState) -> Optional[int]:
+        if not instr_str: return None
         try:
             opc_str, *opds_str = instr_str.split(' ', maxsplit=1)
             instr_proc: InstructionProcessor = self.__instr_set[opc_str.upper()]
-            return instr_proc.process_str(opds_str[0] if opds_str else '', aps)
+            return instr_proc.encode_str(opds_str[0] if opds_str else '', aps)
+        except KeyError as ke:
+            raise AssemblerError('Failed to resolve instruction \'{}\'. Bad opcode or bad instruction format'.format(opc_str), aps.filename, aps.lineno, line, at_token=opc_str)
+        except ValueError:
+            raise AssemblerError('Unknown instruction format \'{}\'. Expected opcode, operands.'.format(instr_str), aps.filename, aps.lineno, line, at_token=instr_str)
+        except AssemblerError as e:
+            if not e.filename: e.filename = aps.filename
+            if not e.line: e.line = instr_str
+            if e.at_token is None: e.at_token = instr_str
+            if not e.lineno: e.lineno = aps.lineno
+            raise e
+
+    def new_ir(self) -> InstructionIR:
+        return InstructionIR(self.opcode_names)
+
+    '''
+    Pass 1 half of synthesis: parses the instruction, encodes every operand that doesn't reference a
+    symbol and appends the result to the IR. Returns False if the line has no instruction.
+    '''
+    def lower_instruction(self, instr_str: str, line: str, aps: AssemblerPassState, ir: InstructionIR) -> bool:
+        if not instr_str: return False
+        try:
+            opc_str, *opds_str = instr_str.split(' ', maxsplit=1)
+            opcode = self.__opcode_indexes[opc_str.upper()]
+            word, kinds, values = self.__instr_procs[opcode].lower_str(opds_str[0] if opds_str else '', aps, ir.symbol_id)
+            ir.append(opcode, aps.lineno, word, kinds, values)
+            return True
         except KeyError as ke:
             raise AssemblerError('Failed to resolve instruction \'{}\'. Bad opcode or bad instruction format'.format(opc_str), aps.filename, aps.lineno, line, at_token=opc_str)
         except ValueError:
@@ -29,6 +102,71 @@ class Synthesizer(object):
         except AssemblerError as e:
             if not e.filename: e.filename = aps.filename
             if not e.line: e.line = instr_str
-            if not e.at_token: e.at_token = instr_str
+            if e.at_token is None: e.at_token = instr_str
             if not e.lineno: e.lineno = aps.lineno
-            raise e
\ No newline at end of file
+            raise e
+
+    '''
+    Same as lower_instruction() for an instruction that's already lexed (see Preprocessor.lex_line()).
+    Errors point at the column of the offending token.
+    '''
+    def lower_lexed(self, instr: LexedInstruction, line: str, aps: AssemblerPassState, ir: InstructionIR) -> bool:
+        try:
+            opcode = self.__opcode_indexes[instr.mnemonic.upper()]
+        except KeyError:
+            raise AssemblerError('Failed to resolve instruction \'{}\'. Bad opcode or bad instruction format'.format(instr.mnemonic), aps.filename, aps.lineno, line, at_token=instr.mnemonic, column=instr.column)
+        try:
+            word, kinds, values = self.__instr_procs[opcode].lower_operands(instr.operands, aps, ir.symbol_id)
+        except AssemblerError as e:
+            if not e.filename: e.filename = aps.filename
+            if not e.line: e.line = line
+            if e.at_token is None: e.at_token = instr.code
+            if not e.lineno: e.lineno = aps.lineno
+            if e.column is None: e.column = instr.locate(e.at_token) if e.at_token != instr.code else instr.column
+            raise e
+        except ValueError as e:
+            raise AssemblerError('Invalid operands \'{}\' for instruction \'{}\'. {}'.format(instr.operands, instr.mnemonic, e), aps.filename, aps.lineno, line, at_token=instr.code, column=instr.column)
+        ir.append(opcode, aps.lineno, word, kinds, values)
+        return True
+
+    '''
+    Pass 2 over the IR: resolves the symbol references against the (now complete) symbol table and
+    returns the finished instruction words. Instructions without symbol references are already encoded,
+    so only the references are visited. Errors leave AssemblerError.line unset for the caller to fill in
+    from the source.
+
+    start and end select a range of instructions (their addresses are their indexes), in which case only
+    the words of that range are returned. Ranges are independent, so they can be synthesized in parallel
+    (see assembler.parallel). base is the address of the IR's first instruction, for an IR holding only
+    part of a program (see Assembler.assemble_region()).
+    '''
+    def synthesize_ir(self, ir: InstructionIR, aps: AssemblerPassState, start: int = 0, end: int = None, base: int = 0) -> array:
+        if end is None: end = len(ir)
+        if start == 0 and end == len(ir):
+            words = array('H', ir.base_words)
+            ref_instrs, ref_operands = ir.ref_instrs, ir.ref_operands
+        else:
+            words = array('H', ir.base_words[start:end])
+            first, last = bisect_left(ir.ref_instrs, start), bisect_left(ir.ref_instrs, end)
+            ref_instrs, ref_operands = ir.ref_instrs[first:last], ir.ref_operands[first:last]
+        instr_procs, opcodes, opd_start, opd_values, symbols = self.__instr_procs, ir.opcodes, ir.opd_start, ir.opd_values, ir.symbols
+        get_symbol = aps.get_symbol
+        for instr_index, opd_index in zip(ref_instrs, ref_operands):
+            opd_name, opd_proc, shift = instr_procs[opcodes[instr_index]].fields[opd_index - opd_start[instr_index]]
+            sym_name = symbols[opd_values[opd_index]]
+            aps.pc_addr = base + instr_index
+            try:
+                try:
+                    sym_value = get_symbol(sym_name)
+                except KeyError:
+                    words[instr_index - start] |= opd_proc.encode_str(sym_name, aps) << shift # not a symbol, report it as a bad operand
+                else:
+                    words[instr_index - start] |= opd_proc.encode_symbol(sym_value, aps) << shift
+            except AssemblerError as e:
+                if not e.filename: e.filename = aps.filename
+                if e.at_token is None: e.at_token = sym_name
+                e.lineno = ir.linenos[instr_index]
+                raise e
+        aps.pc_addr = base + end
+        return words
+
@@ -1 +1 @@
-from .synthesizer import *
\ No newline at end of file
+from .Synthesizer import *
\ No newline at end of file
@@ -1,9 +1,14 @@
-from bitstring import Bits
+from typing import TYPE_CHECKING
+
 from assembler.exceptions import AssemblerException
 
 from assembler.state import AssemblerPassState
 
-def resize_bits(bits: Bits, length: int, is_signed: bool = False, except_on_overflow: bool = True) -> Bits:
+if TYPE_CHECKING:
+    from bitstring import Bits
+
+def resize_bits(bits: 'Bits', length: int, is_signed: bool = False, except_on_overflow: bool = True) -> 'Bits':
+    from bitstring import Bits
     if(bits.length > length):
         resize = Bits(bits[-length:])
         if except_on_overflow and is_signed and resize.int != bits.int:
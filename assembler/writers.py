@@ -0,0 +1,172 @@
+import io
+import os
+import sys
+from abc import abstractmethod
+from array import array
+from itertools import islice
+from typing import Dict, IO, Iterable, List, Tuple, Union
+
+WORD_TYPECODE = 'H' # 16-bit instruction words
+
+'''
+Abstract class for object image writers. An image writer renders instruction words to an
+output file. Writers encode whole blocks of words at once so that writing large images is
+bound by I/O rather than a per-word Python loop.
+
+Images can be written in one call (write) or streamed (write_stream), in which case words are
+gathered into blocks of CHUNK_WORDS before being encoded and written.
+'''
+class ImageWriter(object):
+
+    CHUNK_WORDS = 1 << 16 # words encoded per write when streaming or writing very large images
+    BINARY = True         # whether the output file must be opened in binary mode
+    EXTENSION = '.o'      # default file extension for images written with this writer
+
+    def __init__(self, fp: IO):
+        self.fp = fp
+        self.words_written = 0
+
+    '''
+    Method writers implement to encode a block of words to the data written to the output file.
+    '''
+    @abstractmethod
+    def encode(self, words: array) -> Union[bytes, str]:
+        pass
+
+    '''
+    Writes a complete image (or the next part of one).
+    '''
+    def write(self, words: Union[array, List[int]]):
+        if not isinstance(words, array) or words.typecode != WORD_TYPECODE:
+            words = array(WORD_TYPECODE, words)
+        if len(words) <= self.CHUNK_WORDS:
+            self.fp.write(self.encode(words))
+        else:
+            view = memoryview(words)
+            for start in range(0, len(words), self.CHUNK_WORDS):
+                self.fp.write(self.encode(array(WORD_TYPECODE, view[start:start + self.CHUNK_WORDS])))
+        self.words_written += len(words)
+
+    '''
+    Writes words from an iterable (ex. a generator) in blocks of CHUNK_WORDS.
+    '''
+    def write_stream(self, words: Iterable[int]):
+        it = iter(words)
+        while True:
+            chunk = array(WORD_TYPECODE, islice(it, self.CHUNK_WORDS))
+            if not chunk:
+                break
+            self.fp.write(self.encode(chunk))
+            self.words_written += len(chunk)
+
+
+'''
+Writes the image as raw words with an explicit byte order ('big' matches bitstring's Bits.bytes).
+'''
+class BinaryImageWriter(ImageWriter):
+
+    def __init__(self, fp: IO, byteorder: str = 'big'):
+        super().__init__(fp)
+        if byteorder not in ('big', 'little'):
+            raise ValueError('Invalid byte order \'{}\'. Expected \'big\' or \'little\'.'.format(byteorder))
+        self.byteorder = byteorder
+
+    def encode(self, words: array) -> bytes:
+        if self.byteorder != sys.byteorder:
+            words = array(WORD_TYPECODE, words) # copy into a new buffer before swapping in place
+            words.byteswap()
+        return words.tobytes()
+
+
+'''
+Writes the image as text, one word per line. Words are rendered by joining precomputed
+per-byte renderings instead of formatting each word.
+'''
+class TextImageWriter(ImageWriter):
+
+    BINARY = False
+    EXTENSION = '.txt'
+    BYTE_FORMAT = '{:08b}'
+
+    __tables: Dict[str, List[str]] = {}
+
+    def __init__(self, fp: IO):
+        super().__init__(fp)
+        self.__table = TextImageWriter.byte_table(self.BYTE_FORMAT)
+
+    @staticmethod
+    def byte_table(byte_format: str) -> List[str]:
+        table = TextImageWriter.__tables.get(byte_format)
+        if table is None:
+            table = TextImageWriter.__tables[byte_format] = [byte_format.format(b) for b in range(256)]
+        return table
+
+    def encode(self, words: array) -> str:
+        table = self.__table
+        return ''.join([table[word >> 8] + table[word & 0xFF] + '\n' for word in words])
+
+
+class HexImageWriter(TextImageWriter):
+
+    EXTENSION = '.hex'
+    BYTE_FORMAT = '{:02x}'
+
+
+# Maps output format names (assemble.py --format) to their image writers
+IMAGE_WRITERS: Dict[str, type] = {
+    'binary': BinaryImageWriter,
+    'text': TextImageWriter,
+    'hex': HexImageWriter,
+}
+
+def create_writer(fp: IO, format: str = 'binary', byteorder: str = 'big') -> ImageWriter:
+    writer_cls = IMAGE_WRITERS[format]
+    return writer_cls(fp, byteorder) if issubclass(writer_cls, BinaryImageWriter) else writer_cls(fp)
+
+'''
+Writes a complete image to the file at filepath in one go using the writer for the given format.
+Returns the number of words written.
+'''
+def write_image(filepath: str, words: Union[array, List[int]], format: str = 'binary', byteorder: str = 'big') -> int:
+    with open(filepath, 'wb' if IMAGE_WRITERS[format].BINARY else 'w') as fp:
+        writer = create_writer(fp, format, byteorder)
+        writer.write(words)
+        return writer.words_written
+
+'''
+Encodes a complete image in memory and returns the exact bytes write_image() would write.
+'''
+def encode_image(words: Union[array, List[int]], format: str = 'binary', byteorder: str = 'big') -> bytes:
+    out = io.BytesIO() if IMAGE_WRITERS[format].BINARY else io.StringIO(newline='')
+    create_writer(out, format, byteorder).write(words)
+    image = out.getvalue()
+    return image.encode('ascii') if isinstance(image, str) else image
+
+'''
+Writes an image from an iterable of words (ex. Assembler.assemble_file_stream()) in large chunks.
+Returns the number of words written.
+'''
+def write_image_stream(filepath: str, words: Iterable[int], format: str = 'binary', byteorder: str = 'big') -> int:
+    with open(filepath, 'wb' if IMAGE_WRITERS[format].BINARY else 'w') as fp:
+        writer = create_writer(fp, format, byteorder)
+        writer.write_stream(words)
+        return writer.words_written
+
+'''
+Rewrites ranges of words ((start, end) word indexes) of an image written by write_image() in place.
+Every format encodes a word in the same number of bytes, so a word's position in the file follows from
+its index. Returns False (without writing anything) if the file doesn't hold an image of len(words)
+words in this format, in which case it must be written as a whole.
+'''
+def patch_image(filepath: str, words: array, ranges: Iterable[Tuple[int, int]], format: str = 'binary', byteorder: str = 'big') -> bool:
+    word_size = len(encode_image(array(WORD_TYPECODE, [0]), format, byteorder))
+    try:
+        with open(filepath, 'r+b') as fp:
+            if os.fstat(fp.fileno()).st_size != len(words) * word_size:
+                return False
+            for start, end in ranges:
+                fp.seek(start * word_size)
+                fp.write(encode_image(words[start:end], format, byteorder))
+    except FileNotFoundError:
+        return False
+    return True
@@ -0,0 +1,54 @@
+'''
+Benchmark for define substitution in preprocessor pass 1.
+
+Generates sources with a growing number of .define directives followed by a fixed number of
+instruction lines (half referencing defines, half not) and reports the average pass 1 cost per
+instruction line. With the precompiled define table the per-line cost should stay roughly flat
+as the define count grows.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_defines [--lines N] [--defines 10,100,1000,10000]
+'''
+import argparse
+import time
+from typing import List
+
+from assembler.custom_assembler import CustomPreprocessor
+from assembler.state import AssemblerPassState
+
+
+def generate_source(num_defines: int, num_lines: int) -> List[str]:
+    lines = ['.define CONST_{} #{}'.format(i, i % 16) for i in range(num_defines)]
+    for i in range(num_lines):
+        if i % 2:
+            lines.append('ADDI $1, $2, CONST_{}'.format(i % num_defines))
+        else:
+            lines.append('ADD  $1, $2, $3')
+    return lines
+
+
+def time_pass1(source_lines: List[str], num_defines: int) -> float:
+    preprocessor = CustomPreprocessor()
+    preprocessor.reset()
+    aps = AssemblerPassState()
+    aps.filename = 'bench'
+    for line in source_lines[:num_defines]: # the define block isn't part of the measurement
+        preprocessor.process_line(line, aps)
+        aps.lineno += 1
+    start = time.perf_counter()
+    for line in source_lines[num_defines:]:
+        preprocessor.process_line(line, aps)
+        aps.lineno += 1
+    return time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--lines', type=int, default=20000, help='number of instruction lines per run')
+    parser.add_argument('--defines', default='10,100,1000,10000', help='comma separated define counts to benchmark')
+    args = parser.parse_args()
+
+    print('{:>10s} {:>12s} {:>14s}'.format('defines', 'total (s)', 'per line (us)'))
+    for num_defines in (int(n) for n in args.defines.split(',')):
+        elapsed = time_pass1(generate_source(num_defines, args.lines), num_defines)
+        print('{:>10d} {:>12.4f} {:>14.3f}'.format(num_defines, elapsed, elapsed / args.lines * 1e6))
@@ -0,0 +1,259 @@
+'''
+Scaling benchmark for the whole assembler.
+
+Generates synthetic programs with a realistic mix of source (every opcode in the instruction set,
+dense labels and branches, many .defines, line and block comments) at sizes from 1k to 1M lines, and
+measures every phase: reading the source, pass 1 (preprocessing and lowering to the IR), pass 2
+(symbol resolution) and writing the image. Each size runs in a fresh process so its peak memory (max
+RSS) isn't inflated by the sizes before it; every phase keeps its fastest time over --repeat runs.
+
+Results can be written as JSON (--json) and compared against a saved baseline (--baseline): a phase
+whose throughput dropped, or memory growth that increased, by more than --tolerance is a regression and the
+exit code is 1.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_suite [--sizes 1000,10000,100000,1000000] [--repeat 3] [--json results.json] [--baseline baseline.json]
+'''
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Optional
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_VERSION = 1
+PHASES = ['read', 'pass1', 'pass2', 'write']
+
+LABEL_INTERVAL = 8          # instructions between labels
+BRANCH_WINDOW = 96          # max distance (in instructions) from a branch to its target, well inside an 8-bit displacement
+DEFINES_PER_LINE = 1 / 100  # .define lines per source line (capped at MAX_DEFINES)
+MAX_DEFINES = 2000
+BLOCK_COMMENT_INTERVAL = 150 # instructions between block comments
+
+MIN_COMPARE_SECONDS = 0.005 # phases faster than this in the baseline are too noisy to compare
+MEMORY_SLACK_MB = 1.0       # memory growth allowed on top of the tolerance (small runs barely allocate)
+
+# Relative frequency of each opcode in generated programs (opcodes not listed have a weight of 1)
+OPCODE_WEIGHTS: Dict[str, float] = {
+    'ADDI': 8, 'ADD': 6, 'SUB': 3, 'LD': 6, 'ST': 4, 'LBI': 4, 'SLBI': 2, 'BEQZ': 4, 'BLTZ': 2, 'BGEZ': 2, 'J': 3,
+    'HALT': 0.05, 'NOP': 0.5,
+}
+
+
+'''
+Generates a program of about num_lines lines that assembles without errors. The same seed always
+gives the same program.
+'''
+def generate_program(num_lines: int, seed: int = 0) -> List[str]:
+    from assembler.custom_assembler import get_instruction_set
+    from assembler.isa import ImplicitOperandProcessor, RegisterOperandProcessor, DisplacementOperandProcessor
+
+    rng = random.Random(seed)
+    instr_set = get_instruction_set()
+    names = list(instr_set.keys())
+    weights = [OPCODE_WEIGHTS.get(name, 1) for name in names]
+
+    num_defines = min(MAX_DEFINES, max(2, int(num_lines * DEFINES_PER_LINE)))
+    lines = ['; synthetic benchmark program ({} lines, seed {})'.format(num_lines, seed), '.segment TEXT']
+    for i in range(num_defines):
+        if i % 2:
+            lines.append('.define REG_{} ${}'.format(i, rng.randrange(8)))
+        else:
+            lines.append('.define CONST_{} #{}'.format(i, rng.randrange(4))) # fits every immediate of 3 bits or more
+
+    def operand(opd_proc, pc: int) -> str:
+        nonlocal max_label
+        if isinstance(opd_proc, RegisterOperandProcessor):
+            if rng.random() < 0.1:
+                return 'REG_{}'.format(rng.randrange(num_defines // 2) * 2 + 1)
+            return '${}'.format(rng.randrange(8))
+        if isinstance(opd_proc, DisplacementOperandProcessor):
+            first = max(0, (pc - BRANCH_WINDOW) // LABEL_INTERVAL + 1)
+            label = rng.randint(first, (pc + BRANCH_WINDOW) // LABEL_INTERVAL - 1)
+            max_label = max(max_label, label)
+            return 'B{}'.format(label)
+        if opd_proc.length >= 3 and rng.random() < 0.2:
+            return 'CONST_{}'.format(rng.randrange(num_defines // 2) * 2)
+        if opd_proc.is_signed:
+            return '#{}'.format(rng.randrange(-(1 << (opd_proc.length - 1)), 1 << (opd_proc.length - 1)))
+        return '#0x{:x}'.format(rng.randrange(1 << opd_proc.length))
+
+    pc = 0
+    max_label = -1
+    while len(lines) < num_lines:
+        if pc % LABEL_INTERVAL == 0:
+            lines.append('B{}:'.format(pc // LABEL_INTERVAL))
+        if pc % BLOCK_COMMENT_INTERVAL == BLOCK_COMMENT_INTERVAL // 2:
+            lines.extend(['/* block {}'.format(pc), '   ADDI $1, $1, #1 ; commented out', '*/'])
+        name = rng.choices(names, weights)[0]
+        operands = [operand(opd_proc, pc) for _, opd_proc, _ in instr_set[name].fields if type(opd_proc) != ImplicitOperandProcessor]
+        line = '    {} {}'.format(name, ', '.join(operands)) if operands else '    ' + name
+        roll = rng.random()
+        if roll < 0.2:
+            line += ' ; line comment'
+        elif roll < 0.25:
+            lines.append('')
+        lines.append(line)
+        pc += 1
+
+    # Define the labels branches near the end refer to (they all land on the end of the program)
+    for label in range((pc - 1) // LABEL_INTERVAL + 1, max_label + 1):
+        lines.append('B{}:'.format(label))
+    return lines
+
+
+def write_program(filepath: str, num_lines: int, seed: int = 0):
+    with open(filepath, 'w') as fp:
+        fp.write('\n'.join(generate_program(num_lines, seed)))
+        fp.write('\n')
+
+
+def max_rss_mb() -> float:
+    import resource
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1 << 20) if sys.platform == 'darwin' else rss / 1024 # bytes on macOS, KB elsewhere
+
+
+'''
+Measures every phase on one source file (run in a fresh process, see run_size()).
+'''
+def measure(source_path: str, repeat: int, format: str) -> Dict[str, Any]:
+    from assembler.custom_assembler import CustomAssembler
+    from assembler.writers import write_image
+
+    assembler = CustomAssembler()
+    best = { phase: float('inf') for phase in PHASES }
+    rss_start = max_rss_mb()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        image_path = os.path.join(tmp_dir, 'image')
+        for _ in range(repeat):
+            times = [time.perf_counter()]
+            with open(source_path, 'r') as fp:
+                lines = fp.readlines()
+            times.append(time.perf_counter())
+            ir, aps = assembler.build_ir(lines, source_path)
+            times.append(time.perf_counter())
+            words = assembler.synthesize_ir(ir, aps, lines)
+            times.append(time.perf_counter())
+            num_words = write_image(image_path, words, format)
+            times.append(time.perf_counter())
+            for phase, start, end in zip(PHASES, times, times[1:]):
+                best[phase] = min(best[phase], end - start)
+            num_lines = len(lines)
+            del lines, ir, aps, words
+    peak = max_rss_mb()
+    return {
+        'lines': num_lines,
+        'words': num_words,
+        'seconds': dict(best, total=sum(best.values())),
+        'lines_per_second': { phase: num_lines / seconds for phase, seconds in dict(best, total=sum(best.values())).items() if seconds > 0 },
+        'peak_rss_mb': round(peak, 2),
+        'rss_growth_mb': round(peak - rss_start, 2),
+    }
+
+
+'''
+Generates a program of num_lines lines and measures it in a child process.
+'''
+def run_size(num_lines: int, repeat: int, format: str, seed: int, tmp_dir: str) -> Dict[str, Any]:
+    source_path = os.path.join(tmp_dir, 'bench_{}.asm'.format(num_lines))
+    write_program(source_path, num_lines, seed)
+    proc = subprocess.run([sys.executable, '-m', 'benchmarks.bench_suite', '--child', source_path, '--repeat', str(repeat), '--format', format],
+                          cwd=REPO_ROOT, stdout=subprocess.PIPE, universal_newlines=True, check=True)
+    result = json.loads(proc.stdout)
+    result['size'] = num_lines
+    return result
+
+
+'''
+Compares results against a baseline. Returns a description of every regression: a phase whose
+throughput dropped, or a memory growth that increased, by more than tolerance (a fraction). Phases
+too short to time reliably are skipped.
+'''
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    regressions = []
+    baseline_runs = { run['size']: run for run in baseline.get('results', []) }
+    for run in results['results']:
+        base = baseline_runs.get(run['size'])
+        if base is None:
+            continue
+        for phase in PHASES + ['total']:
+            if base['seconds'].get(phase, 0) < MIN_COMPARE_SECONDS:
+                continue
+            old, new = base['lines_per_second'].get(phase), run['lines_per_second'].get(phase)
+            if old and new and new < old * (1 - tolerance):
+                regressions.append('{} lines: {} throughput {:.0f} -> {:.0f} lines/s ({:+.1%})'.format(run['size'], phase, old, new, new / old - 1))
+        old, new = base.get('rss_growth_mb'), run.get('rss_growth_mb')
+        if old is not None and new is not None and new > old * (1 + tolerance) + MEMORY_SLACK_MB:
+            regressions.append('{} lines: memory growth {:.1f} -> {:.1f} MB ({:+.1%})'.format(run['size'], old, new, new / old - 1))
+    return regressions
+
+
+def print_results(results: Dict[str, Any], baseline: Optional[Dict[str, Any]]):
+    baseline_runs = { run['size']: run for run in baseline.get('results', []) } if baseline else {}
+    print('{:>9s} {:>9s}  {:>11s} {:>11s} {:>11s} {:>11s}  {:>9s} {:>9s}'.format('lines', 'words', 'read/s', 'pass1/s', 'pass2/s', 'write/s', 'total (s)', 'peak MB'))
+    for run in results['results']:
+        rates = run['lines_per_second']
+        print('{:>9d} {:>9d}  {:>11.0f} {:>11.0f} {:>11.0f} {:>11.0f}  {:>9.3f} {:>9.1f}'.format(
+            run['lines'], run['words'], rates['read'], rates['pass1'], rates['pass2'], rates['write'], run['seconds']['total'], run['peak_rss_mb']))
+        base = baseline_runs.get(run['size'])
+        if base:
+            print('{:>9s} {:>9s}  {}  {:>9s} {:>9s}'.format('', 'vs base', ' '.join('{:>+11.1%}'.format(rates[phase] / base['lines_per_second'][phase] - 1) for phase in PHASES),
+                                                        '{:+.1%}'.format(base['seconds']['total'] / run['seconds']['total'] - 1), '{:+.1f}'.format(run['peak_rss_mb'] - base['peak_rss_mb'])))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', default='1000,10000,100000,1000000', help='comma separated program sizes in lines')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per size (the fastest time of every phase is kept)')
+    parser.add_argument('--format', default='binary', help='image format written in the write phase')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the program generator')
+    parser.add_argument('--json', metavar='FILE', help='write the results as JSON to FILE (ex. to save a baseline)')
+    parser.add_argument('--baseline', metavar='FILE', help='compare against results saved with --json; regressions make the exit code 1')
+    parser.add_argument('--tolerance', type=float, default=0.15, help='fraction a phase can slow down (or memory grow) before it counts as a regression')
+    parser.add_argument('--child', metavar='SOURCE', help=argparse.SUPPRESS) # measure one source and print the result as JSON
+    args = parser.parse_args()
+
+    if args.child:
+        json.dump(measure(args.child, args.repeat, args.format), sys.stdout)
+        exit(0)
+
+    from assembler.assembler import ASSEMBLER_VERSION
+    results = {
+        'version': RESULTS_VERSION,
+        'assembler_version': ASSEMBLER_VERSION,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'repeat': args.repeat,
+        'format': args.format,
+        'seed': args.seed,
+        'results': [],
+    }
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for num_lines in (int(n) for n in args.sizes.split(',')):
+            results['results'].append(run_size(num_lines, args.repeat, args.format, args.seed, tmp_dir))
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, 'r') as fp:
+            baseline = json.load(fp)
+    print_results(results, baseline)
+
+    if args.json:
+        with open(args.json, 'w') as fp:
+            json.dump(results, fp, indent=2)
+        print('Results written to {}'.format(args.json))
+
+    if baseline is not None:
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print('REGRESSION: {}'.format(regression))
+        if regressions:
+            print('FAILED: {} regression(s) against {} (tolerance {:.0%})'.format(len(regressions), args.baseline, args.tolerance))
+            exit(1)
+        print('PASSED: no regressions against {} (tolerance {:.0%})'.format(args.baseline, args.tolerance))
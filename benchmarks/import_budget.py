@@ -0,0 +1,58 @@
+'''
+Import-time budget check for the assemble.py CLI.
+
+Runs 'python -X importtime -c "import assemble, assembler.custom_assembler"' several times, takes the
+fastest cumulative import time of those modules and fails (exit code 1) when it's over budget. The CLI
+module only imports the assembler itself once it assembles (see assembler.batch), so both are needed to
+cover what a real assemble.py run imports. The slowest imports of the fastest run are listed to show
+where the time went.
+
+Usage (from the repository root):
+    python -m benchmarks.import_budget [--budget-ms 60] [--runs 5] [--top 10]
+'''
+import argparse
+import os
+import subprocess
+import sys
+from typing import List, Tuple
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CLI_MODULES = ('assemble', 'assembler.custom_assembler') # the CLI, and the assembler it imports lazily to assemble
+
+'''
+Returns (cumulative us, module name) for every module imported while importing the CLI.
+'''
+def measure_imports() -> List[Tuple[int, str]]:
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ' + ', '.join(CLI_MODULES)], cwd=REPO_ROOT, stderr=subprocess.PIPE, universal_newlines=True, check=True)
+    imports = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        imports.append((int(cumulative), name.rstrip()))
+    return imports
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--budget-ms', type=float, default=60.0, help='maximum cumulative import time of the CLI in milliseconds')
+    parser.add_argument('--runs', type=int, default=5, help='number of runs (the fastest one is used)')
+    parser.add_argument('--top', type=int, default=10, help='number of slowest imports to list')
+    args = parser.parse_args()
+
+    best_us, best_imports = None, None
+    for _ in range(args.runs):
+        imports = measure_imports()
+        total_us = sum(cumulative for cumulative, name in imports if name.strip() in CLI_MODULES and not name.startswith('  ')) # top level imports only
+        if best_us is None or total_us < best_us:
+            best_us, best_imports = total_us, imports
+
+    print('Slowest imports (cumulative):')
+    for cumulative, name in sorted(best_imports, reverse=True)[:args.top]:
+        print('{:>10.2f} ms  {}'.format(cumulative / 1000, name))
+
+    total_ms = best_us / 1000
+    if total_ms > args.budget_ms:
+        print('FAILED: CLI import time {:.2f} ms is over the budget of {:.2f} ms'.format(total_ms, args.budget_ms))
+        exit(1)
+    print('PASSED: CLI import time {:.2f} ms (budget {:.2f} ms)'.format(total_ms, args.budget_ms))
@@ -0,0 +1,33 @@
+import argparse
+import sys
+
+from assembler.writers import IMAGE_WRITERS
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('input', help='absolute or relative filepath of the object image to disassemble')
+    parser.add_argument('-o', '--output', help='absolute or relative filepath to write the assembly source (default: print it)')
+    parser.add_argument('-f', '--format', default='binary', choices=list(IMAGE_WRITERS.keys()), type=str.lower, help='format the image was written in')
+    parser.add_argument('--endian', default='big', choices=['big','little'], type=str.lower, help='byte order of words in binary images')
+    parser.add_argument('--addresses', action='store_true', help='follow every instruction with a comment holding its address and encoding')
+    parser.add_argument('--no-labels', action='store_true', help='print branch and jump displacements as immediates instead of synthesizing labels')
+    parser.add_argument('--data-start', type=lambda text: int(text, 0), help='address where the DATA segment starts; the words from there on are written as .word directives')
+    parser.add_argument('--no-numpy', action='store_true', help='don\'t use numpy even if it\'s installed')
+    args = parser.parse_args()
+
+    from assembler.custom_assembler import CustomDisassembler
+    try:
+        disassembly = CustomDisassembler().disassemble_file(args.input, args.format, args.endian, not args.no_labels, args.addresses, not args.no_numpy, args.data_start)
+    except (OSError, ValueError) as e:
+        print('{}: ERROR: {}'.format(args.input, e))
+        exit(-1)
+
+    if args.output:
+        disassembly.write_file(args.output)
+    else:
+        disassembly.write(sys.stdout)
+
+    if disassembly.undecodable:
+        print('{}: WARNING: {} word(s) are not valid instructions; the output won\'t reassemble to the same image'.format(args.input, disassembly.undecodable), file=sys.stderr)
+    if args.output:
+        print('SUCCESS: Disassembled {} word(s) ({} label(s)) written to {}'.format(disassembly.words, disassembly.labels, args.output))
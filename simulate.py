@@ -0,0 +1,81 @@
+import argparse
+import json
+import time
+
+from assembler.writers import IMAGE_WRITERS
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('input', help='absolute or relative filepath of the assembly file (or with --image, the object image) to run')
+    parser.add_argument('--image', action='store_true', help='the input is an image written by assemble.py instead of assembly source')
+    parser.add_argument('-f', '--format', default='binary', choices=list(IMAGE_WRITERS.keys()), type=str.lower, help='(--image) format the image was written in')
+    parser.add_argument('--endian', default='big', choices=['big','little'], type=str.lower, help='(--image) byte order of words in binary images')
+    parser.add_argument('-O', '--optimize', action='store_true', help='run the program as assembled with peephole optimization')
+    parser.add_argument('--max-instructions', type=int, default=100000000, help='stop (and fail) after running this many instructions')
+    parser.add_argument('--costs', metavar='FILE', help='JSON file overriding the cycle model: {"costs": {"<opcode>": cycles}, "taken_penalty": n, "default": n}')
+    parser.add_argument('--hot', type=int, metavar='N', help='count executions per address and print the N most executed instructions')
+    parser.add_argument('--dump', nargs=2, type=lambda text: int(text, 0), metavar=('ADDRESS', 'WORDS'), help='print WORDS memory words from ADDRESS on once the program stops')
+    args = parser.parse_args()
+
+    from assembler.custom_assembler import CustomAssembler, CustomDisassembler, CustomSimulator, get_cycle_model, get_instruction_set
+    from assembler.disassembler import load_image
+    from assembler.exceptions import AssemblerError
+    from assembler.simulator import SimulationError
+
+    model = get_cycle_model()
+    if args.costs:
+        try:
+            with open(args.costs, 'r') as costs_file:
+                model = model.updated(json.load(costs_file), list(get_instruction_set().keys()))
+        except (OSError, ValueError) as e:
+            print('{}: ERROR: {}'.format(args.costs, e))
+            exit(-1)
+
+    try:
+        if args.image:
+            words = load_image(args.input, args.format, args.endian)
+        else:
+            assembler = CustomAssembler()
+            assembler.optimize = args.optimize
+            words = assembler.assemble_file(args.input, as_words=True)
+    except AssemblerError as e:
+        print(e.tostring())
+        exit(-1)
+    except UnicodeDecodeError as e:
+        if args.image:
+            print('{}: ERROR: {}'.format(args.input, e))
+        else:
+            print('{}: ERROR: Not an assembly source file ({}). Use --image to run an object image.'.format(args.input, e))
+        exit(-1)
+    except (OSError, ValueError) as e:
+        print('{}: ERROR: {}'.format(args.input, e))
+        exit(-1)
+
+    simulator = CustomSimulator(model)
+    try:
+        simulator.load(words)
+        start = time.perf_counter()
+        result = simulator.run(max_instructions=args.max_instructions, counters=args.hot is not None)
+        elapsed = time.perf_counter() - start
+    except (SimulationError, ValueError) as e:
+        print('{}: ERROR: {}'.format(args.input, e))
+        exit(-1)
+
+    print('REGISTERS: {}'.format(' '.join('${}=0x{:04x}'.format(i, value) for i, value in enumerate(simulator.registers))))
+    if args.dump:
+        address, num_words = args.dump
+        for line_start in range(address, address + num_words, 8):
+            values = simulator.memory[line_start:min(line_start + 8, address + num_words)]
+            print('MEMORY: {:04x}: {}'.format(line_start, ' '.join('{:04x}'.format(value) for value in values)))
+    if result.counts is not None:
+        disassembler = CustomDisassembler()
+        for pc, executed in result.hot_spots(args.hot):
+            decoded = disassembler.decode(words[pc])
+            print('HOT: {:04x}: {:10d} ({:5.1f}%)  {}'.format(pc, executed, 100 * executed / result.instructions, decoded.text() if decoded else '0x{:04x}'.format(words[pc])))
+
+    rate = result.instructions / elapsed if elapsed > 0 else 0
+    summary = '{} instruction(s) and {} cycle(s) ({} branch(es) and jump(s) taken, {:.2f}M instructions/s)'.format(result.instructions, result.cycles, result.taken, rate / 1e6)
+    if not result.halted:
+        print('{}: ERROR: No HALT after {}; stopped at 0x{:04x}'.format(args.input, summary, result.pc))
+        exit(-1)
+    print('SUCCESS: HALT at 0x{:04x} after {}'.format(result.pc, summary))
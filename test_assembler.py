@@ -1,6 +1,9 @@
 from typing import List
+from array import array
 
-from assembler.custom_assembler import CustomAssembler
+from assembler.custom_assembler import CONTROL_FLOW_OPCODES, PC_RELATIVE_OPCODES, CustomAssembler, CustomDisassembler, CustomSimulator, get_cycle_model, get_instruction_set
+from assembler.analysis import CycleAnalysis
+from assembler.simulator import SimulationError
 from assembler.exceptions import AssemblerError
 
 from bitstring import Bits
@@ -99,6 +102,22 @@ BLOCK_COMMENTS_EXPECTED = [
     Bits(bin='0000000000000000'),
 ]
 
+DEFINES = """
+.define ZERO $0
+.define ONE #1
+.define MASK #0x0F
+ADDI ZERO, $1, MASK
+LOOP_ONE:
+ADDI $1, ZERO, ONE
+J LOOP_ONE ; label names containing a define name are not substituted
+"""
+
+DEFINES_EXPECTED = [
+    Bits(bin='0100000100001111'),
+    Bits(bin='0100000000100001'),
+    Bits(bin='0010011111111110'),
+]
+
 SAMPLE_FILE = """
 
 .entry 0x0000 ; tells the assembler where the program will be loaded into memory
@@ -133,13 +152,25 @@ SAMPLE_FILE_EXPECTED = [
     Bits(bin='1100000000000000'),
     Bits(bin='1100000100110010'),
     Bits(bin='1100100100001001'),
-    Bits(bin='0110001000000010'),
+    Bits(bin='0110001000000011'),
     Bits(bin='0000100000000000'),
     Bits(bin='0100000000000001'),
-    Bits(bin='0010011111111010'),
+    Bits(bin='0010011111111011'),
     Bits(bin='0000000000000000'),
 ]
 
+# Each source fails to assemble with an error at (line, column), both 0-based
+ERROR_LOCATIONS = [
+    ('NOP\n  FOO $1, $2',               (1, 2)),
+    ('  ADDI $1, $9, #3',                (0, 11)),
+    ('.define X\nNOP',                  (0, 8)),
+    ('.bogus 1',                         (0, 1)),
+    ('/* c */ BEQZ $1,   NOWHERE',       (0, 19)),
+    ('NOP\nADDI $1, $1, #0xZZ',          (1, 13)),
+    ('ADDI $1, $1, #1.5',                (0, 13)),
+    ('ADD $1,,$2',                       (0, 7)),
+]
+
 def run_test(test_name:str, assembler: CustomAssembler, instrs: List[str], expected_outputs: List[Bits]):
     try:
         actual_outputs: Bits = assembler.assemble_lines(instrs, filename='testbench')
@@ -155,6 +186,804 @@ def run_test(test_name:str, assembler: CustomAssembler, instrs: List[str], expec
 
     print('PASSED: Test \'{}\''.format(test_name))
 
+def run_words_test(test_name:str, assembler: CustomAssembler, instrs: List[str], expected_outputs: List[Bits]):
+    try:
+        actual_words = assembler.assemble_lines(instrs, filename='testbench', as_words=True)
+    except AssemblerError as e:
+        print_exception(e)
+        print('FAILED: Exception thrown')
+        exit(-1)
+
+    for i, expected_output in enumerate(expected_outputs):
+        if actual_words[i] != expected_output.uint:
+            print('FAILED: Test \'{}\': \'{}\', expected = {}, actual = 0x{:04x}'.format(test_name, instrs[i], expected_output, actual_words[i]))
+            exit(-1)
+
+    print('PASSED: Test \'{}\''.format(test_name))
+
+def run_cache_test(test_name:str, assembler: CustomAssembler, source: str, expected_outputs: List[Bits]):
+    import os, tempfile
+    from assembler.cache import BuildCache
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        src_path = os.path.join(tmp_dir, 'testbench.asm')
+        with open(src_path, 'w') as src_file:
+            src_file.write(source)
+        cache = BuildCache(os.path.join(tmp_dir, 'cache'))
+        try:
+            runs = [assembler.assemble_file(src_path, as_words=True, cache=cache) for _ in range(2)]
+        except AssemblerError as e:
+            print_exception(e)
+            print('FAILED: Exception thrown')
+            exit(-1)
+
+    if (cache.stats.hits, cache.stats.misses) != (1, 1):
+        print('FAILED: Test \'{}\': expected 1 hit and 1 miss, got {}'.format(test_name, cache.stats))
+        exit(-1)
+    for actual_words in runs:
+        if list(actual_words) != [expected_output.uint for expected_output in expected_outputs]:
+            print('FAILED: Test \'{}\': expected = {}, actual = {}'.format(test_name, expected_outputs, actual_words))
+            exit(-1)
+
+    print('PASSED: Test \'{}\''.format(test_name))
+
+def run_data_test(test_name:str, assembler: CustomAssembler):
+    import os, tempfile
+    from assembler.listing import Listing
+    text = ['.segment TEXT', 'START:', 'J END', 'NOP', 'END:', 'NOP']
+    data = ['.segment DATA', 'TABLE:', '.word 1, 0x2, -1, #3', '.define COEF 0x1234', '.word COEF, START, TABLE, END_DATA',
+            '.fill 3, 0xAB', '.incbin blob.bin', 'END_DATA:', '.fill 0']
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        with open(os.path.join(tmp_dir, 'blob.bin'), 'wb') as blob:
+            blob.write(b'\x01\x02\x03') # odd sizes are padded with a zero byte
+        src_path = os.path.join(tmp_dir, 'testbench.asm')
+        with open(src_path, 'w') as src_file:
+            src_file.write('\n'.join(data[:3] + text + data[:1] + data[3:]) + '\n')
+        try:
+            text_words = assembler.assemble_lines(text, as_words=True)
+            listing = Listing()
+            runs = [assembler.assemble_file(src_path, as_words=True, listing=listing), assembler.assemble_file_mapped(src_path, as_words=True),
+                    array('H', assembler.assemble_file_stream(src_path))]
+        except AssemblerError as e:
+            print_exception(e)
+            print('FAILED: Exception thrown')
+            exit(-1)
+
+    data_words = [1, 2, 0xFFFF, 3, 0x1234, 0, 3, 16, 0xAB, 0xAB, 0xAB, 0x0102, 0x0300]
+    for actual_words in runs:
+        if list(actual_words) != list(text_words) + data_words:
+            print('FAILED: Test \'{}\': expected = {}, actual = {}'.format(test_name, list(text_words) + data_words, list(actual_words)))
+            exit(-1)
+    if not any(line.startswith('0003  0001') for line in listing.body_lines()):
+        print('FAILED: Test \'{}\': the listing doesn\'t show the data'.format(test_name))
+        exit(-1)
+    disassembly = CustomDisassembler().disassemble(runs[0], data_start=len(text_words))
+    if list(assembler.assemble_lines(disassembly.lines, as_words=True)) != list(runs[0]):
+        print('FAILED: Test \'{}\': disassembly doesn\'t reassemble to the same image:\n{}'.format(test_name, '\n'.join(disassembly.lines)))
+        exit(-1)
+
+    # Data and instructions in the wrong segment, and bad data words
+    for source, expected_location in (('.segment DATA\nNOP', (1, 0)), ('.word 1', (0, 6)), ('.segment DATA\n.word NOWHERE', (1, 6)),
+                                      ('.segment DATA\n.word 0x12345', (1, 6)), ('.segment DATA\n.fill -1', (1, 6))):
+        try:
+            assembler.assemble_lines(source.splitlines(), filename='testbench')
+        except AssemblerError as e:
+            if (e.lineno, e.column) != expected_location:
+                print('FAILED: Test \'{}\': \'{}\', expected = {}, actual = {}'.format(test_name, source, expected_location, (e.lineno, e.column)))
+                exit(-1)
+            continue
+        print('FAILED: Test \'{}\': \'{}\', expected an error'.format(test_name, source))
+        exit(-1)
+
+    print('PASSED: Test \'{}\''.format(test_name))
+
+def run_mapped_test(test_name:str, assembler: CustomAssembler, source: str, error_sources: List[tuple]):
+    import os, tempfile
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        src_path = os.path.join(tmp_dir, 'testbench.asm')
+        for newline in ('\n', '\r\n'):
+            with open(src_path, 'w', newline=newline) as src_file:
+                src_file.write(source)
+            try:
+                expected_words = assembler.assemble_file(src_path, as_words=True)
+                actual_words = assembler.assemble_file_mapped(src_path, as_words=True)
+            except AssemblerError as e:
+                print_exception(e)
+                print('FAILED: Exception thrown')
+                exit(-1)
+            if actual_words != expected_words:
+                print('FAILED: Test \'{}\': expected = {}, actual = {}'.format(test_name, expected_words, actual_words))
+                exit(-1)
+
+        # Errors point at the same line and column as when the source is read in as lines
+        for error_source, expected_location in error_sources:
+            with open(src_path, 'w') as src_file:
+                src_file.write(error_source)
+            try:
+                assembler.assemble_file_mapped(src_path)
+            except AssemblerError as e:
+                if (e.lineno, e.column) != expected_location or e.line != error_source.splitlines()[e.lineno]:
+                    print('FAILED: Test \'{}\': \'{}\', expected = {}, actual = {} \'{}\''.format(test_name, error_source, expected_location, (e.lineno, e.column), e.line))
+                    exit(-1)
+                continue
+            print('FAILED: Test \'{}\': \'{}\', expected an error'.format(test_name, error_source))
+            exit(-1)
+
+    print('PASSED: Test \'{}\''.format(test_name))
+
+def run_error_test(test_name:str, assembler: CustomAssembler, sources: List[tuple]):
+    for source, expected_location in sources:
+        try:
+            assembler.assemble_lines(source.splitlines(), filename='testbench')
+        except AssemblerError as e:
+            if (e.lineno, e.column) != expected_location:
+                print('FAILED: Test \'{}\': \'{}\', expected = {}, actual = {}'.format(test_name, source, expected_location, (e.lineno, e.column)))
+                exit(-1)
+            continue
+        print('FAILED: Test \'{}\': \'{}\', expected an error'.format(test_name, source))
+        exit(-1)
+
+    print('PASSED: Test \'{}\''.format(test_name))
+
+def run_disassembler_test(test_name:str, assembler: CustomAssembler, instrs: List[str]):
+    try:
+        words = assembler.assemble_lines(instrs, filename='testbench', as_words=True)
+        disassembly = CustomDisassembler().disassemble(words)
+        reassembled = assembler.assemble_lines(disassembly.lines, filename='disassembly', as_words=True)
+    except AssemblerError as e:
+        print_exception(e)
+        print('FAILED: Exception thrown')
+        exit(-1)
+
+    if disassembly.undecodable or list(reassembled) != list(words):
+        print('FAILED: Test \'{}\': disassembly doesn\'t reassemble to the same image:\n{}'.format(test_name, '\n'.join(disassembly.lines)))
+        exit(-1)
+
+    print('PASSED: Test \'{}\''.format(test_name))
+
+def run_profiler_test(test_name:str, assembler: CustomAssembler, instrs: List[str]):
+    from assembler.profiling import Profiler
+    profiler = assembler.profiler = Profiler()
+    try:
+        words = assembler.assemble_lines(instrs, filename='testbench', as_words=True)
+    except AssemblerError as e:
+        print_exception(e)
+        print('FAILED: Exception thrown')
+        exit(-1)
+    finally:
+        assembler.profiler = None
+
+    phases = profiler.to_dict()['phases']
+    encoded = sum(calls for name, (calls, _, _) in phases.items() if name.startswith('pass1.encode.'))
+    if phases.get('pass1', [0])[0] != 1 or phases.get('pass2', [0])[0] != 1 or encoded != len(words):
+        print('FAILED: Test \'{}\': unexpected stats {}'.format(test_name, phases))
+        exit(-1)
+    if any('lower_operands' in vars(instr_proc) for instr_proc in get_instruction_set().values()):
+        print('FAILED: Test \'{}\': profiling hooks were left installed'.format(test_name))
+        exit(-1)
+
+    print('PASSED: Test \'{}\''.format(test_name))
+
+def run_parallel_test(test_name:str, assembler: CustomAssembler, instrs: List[str]):
+    from assembler.parallel import synthesize_ir_parallel
+    try:
+        ir, aps = assembler.build_ir(instrs, filename='testbench')
+        serial_words = assembler.synthesize_ir(ir, aps, instrs)
+        parallel_words = synthesize_ir_parallel(assembler._Assembler__synthesizer, ir, aps, 3)
+    except AssemblerError as e:
+        print_exception(e)
+        print('FAILED: Exception thrown')
+        exit(-1)
+
+    if parallel_words != serial_words:
+        print('FAILED: Test \'{}\': parallel pass 2 differs from the serial pass'.format(test_name))
+        exit(-1)
+
+    # The first error in source order is reported, whichever chunk it's in
+    bad_instrs = instrs + ['J NOWHERE_{}'.format(i) for i in range(20)]
+    ir, aps = assembler.build_ir(bad_instrs, filename='testbench')
+    try:
+        synthesize_ir_parallel(assembler._Assembler__synthesizer, ir, aps, 3)
+    except AssemblerError as e:
+        if e.at_token != 'NOWHERE_0' or e.lineno != len(instrs):
+            print('FAILED: Test \'{}\': expected the error at line {}, got {} at line {}'.format(test_name, len(instrs), e.at_token, e.lineno))
+            exit(-1)
+    else:
+        print('FAILED: Test \'{}\': expected an error'.format(test_name))
+        exit(-1)
+
+    print('PASSED: Test \'{}\''.format(test_name))
+
+def run_parallel_pass1_test(test_name:str, assembler: CustomAssembler, instrs: List[str]):
+    # Chunks inside a block comment, or using a define the pre-scan missed (it follows a comment's end), are redone serially
+    third = len(instrs) // 3
+    instrs = (instrs[:third] + ['/* spans', 'ADD $0, $1, $2', 'several chunks'] + ['SUB $0, $1, $2'] * third + ['*/ .define FAR_REG $3']
+              + instrs[third:] + ['ADDI FAR_REG, $3, #1'] + ['.segment DATA', 'TABLE:', '.word 1, TABLE', '.fill {}, 7'.format(third), '.segment TEXT']
+              + instrs[:third] + ['.segment DATA'] + ['.word {}'.format(i) for i in range(third)])
+    try:
+        ir, aps = assembler.build_ir(instrs, filename='testbench')
+        serial_words = assembler.synthesize_ir(ir, aps, instrs)
+        parallel_ir, parallel_aps = assembler.build_ir_parallel(instrs, 'testbench', 3)
+        parallel_words = assembler.synthesize_ir(parallel_ir, parallel_aps, instrs)
+    except AssemblerError as e:
+        print_exception(e)
+        print('FAILED: Exception thrown')
+        exit(-1)
+
+    if parallel_words != serial_words or parallel_ir.linenos != ir.linenos or parallel_aps.get_symbol_table() != aps.get_symbol_table():
+        print('FAILED: Test \'{}\': parallel pass 1 differs from the serial pass'.format(test_name))
+        exit(-1)
+
+    # Errors are raised exactly as the serial pass raises them
+    bad_instrs = instrs + ['BAD $0'] + instrs
+    try:
+        assembler.build_ir_parallel(bad_instrs, 'testbench', 3)
+    except AssemblerError as e:
+        if e.at_token != 'BAD' or e.lineno != len(instrs):
+            print('FAILED: Test \'{}\': expected the error at line {}, got {} at line {}'.format(test_name, len(instrs), e.at_token, e.lineno))
+            exit(-1)
+    else:
+        print('FAILED: Test \'{}\': expected an error'.format(test_name))
+        exit(-1)
+
+    print('PASSED: Test \'{}\''.format(test_name))
+
+def run_peephole_test(test_name:str, assembler: CustomAssembler):
+    # Removed instructions are marked with ';-'. Labels and numeric displacements follow the instructions they point at.
+    source = """START:
+    ADDI $1, $1, #0 ;-
+    LBI $2, #5 ;-
+    LBI $2, #6
+    NOP ;-
+    NOP ;-
+    NOP
+    BEQZ $2, #6
+    J NEXT ;-
+    ADDI $3, $3, #0 ;-
+    NEXT:
+    ADD $1, $2, $3
+    J START
+    SLLI $4, $4, #0 ;-
+    BGEZ $1, START
+    BLTZ $1, #-13
+    HALT
+    .segment DATA
+    PTR:
+    .word NEXT, PTR"""
+    expected_source = """START:
+    LBI $2, #6
+    NOP
+    BEQZ $2, #3
+    NEXT:
+    ADD $1, $2, $3
+    J START
+    BGEZ $1, START
+    BLTZ $1, #-7
+    HALT
+    .segment DATA
+    PTR:
+    .word NEXT, PTR"""
+    expected_stats = {'addi-zero': 2, 'shift-zero': 1, 'nop-run': 2, 'lbi-overwritten': 1, 'jump-to-next': 1}
+    try:
+        assembler.optimize = True
+        words = assembler.assemble(source, filename='testbench', as_words=True)
+        stats = assembler.peephole_stats
+        assembler.optimize = False
+        expected_words = assembler.assemble(expected_source, filename='expected', as_words=True)
+        unoptimized_words = assembler.assemble(source, filename='testbench', as_words=True)
+    except AssemblerError as e:
+        print_exception(e)
+        print('FAILED: Exception thrown')
+        exit(-1)
+    finally:
+        assembler.optimize = False
+
+    if words != expected_words:
+        print('FAILED: Test \'{}\': expected = {}, actual = {}'.format(test_name, list(expected_words), list(words)))
+        exit(-1)
+    if stats != expected_stats or assembler.peephole_stats is not None:
+        print('FAILED: Test \'{}\': expected stats = {}, actual = {}'.format(test_name, expected_stats, stats))
+        exit(-1)
+    if len(unoptimized_words) != len(words) + sum(expected_stats.values()):
+        print('FAILED: Test \'{}\': the optimizer ran while it was off'.format(test_name))
+        exit(-1)
+
+    print('PASSED: Test \'{}\''.format(test_name))
+
+def run_relaxation_test(test_name:str, assembler: CustomAssembler):
+    # BLTZ is in range until relaxing BEQZ pushes NEAR 2 words further away
+    filler = ['ADD $2, $2, $3'] * 125
+    source = (['START:', 'BLTZ $1, NEAR', 'BEQZ $1, FAR', 'BEQZ $1, #1', 'NOP'] + filler[1:] + ['NEAR:', 'NOP'] + filler
+              + ['BGEZ $1, START', 'FAR:', 'HALT', '.segment DATA', 'PTR:', '.word FAR, NEAR'])
+    expected_source = (['START:', 'BGEZ $1, #1', 'J NEAR', 'BEQZ $1, #1', 'J #1', 'J FAR', 'BEQZ $1, #1', 'NOP'] + filler[1:] + ['NEAR:', 'NOP'] + filler
+                       + ['BLTZ $1, #1', 'J START', 'FAR:', 'HALT', '.segment DATA', 'PTR:', '.word FAR, NEAR'])
+    expected_sites = [(1, 'BLTZ', 'NEAR', 2, 1), (2, 'BEQZ', 'FAR', 3, 2), (256, 'BGEZ', 'START', 2, 1)]
+    try:
+        words = assembler.assemble_lines(source, filename='testbench', as_words=True)
+        sites = [(site.lineno, site.opcode, site.symbol, site.words, site.not_taken) for site in assembler.relaxed_branches]
+        expected_words = assembler.assemble_lines(expected_source, filename='expected', as_words=True)
+    except AssemblerError as e:
+        print_exception(e)
+        print('FAILED: Exception thrown')
+        exit(-1)
+
+    if words != expected_words:
+        print('FAILED: Test \'{}\': expected = {}, actual = {}'.format(test_name, list(expected_words), list(words)))
+        exit(-1)
+    if sites != expected_sites:
+        print('FAILED: Test \'{}\': expected relaxed branches = {}, actual = {}'.format(test_name, expected_sites, sites))
+        exit(-1)
+
+    # Without relaxation, the first out of range branch is an error
+    assembler.relax = False
+    try:
+        assembler.assemble_lines(source, filename='testbench')
+    except AssemblerError as e:
+        if (e.lineno, e.column) != (2, 9):
+            print('FAILED: Test \'{}\': expected the error at {}, actual = {}'.format(test_name, (2, 9), (e.lineno, e.column)))
+            exit(-1)
+    else:
+        print('FAILED: Test \'{}\': expected an error'.format(test_name))
+        exit(-1)
+    finally:
+        assembler.relax = True
+
+    print('PASSED: Test \'{}\''.format(test_name))
+
+def run_cycle_analysis_test(test_name:str, assembler: CustomAssembler):
+    # Dot product loop with an early exit and an if; the loop's slowest iteration takes the BLTZ
+    source = ['START:', 'LBI $1, #8', 'LBI $2, #0', 'LOOP:', 'VLD $3, $2, #0', 'VDOT $3, $3, #1', 'ADDI $2, $2, #4', 'SUBI $1, $1, #1',
+              'BEQZ $1, DONE', 'LD $4, $2, #0', 'BLTZ $4, SKIP', 'ADDI $5, $5, #1', 'SKIP:', 'J LOOP', 'DONE:', 'HALT']
+    expected_blocks = [(0, 2, 2), (2, 7, 11), (7, 9, 3), (9, 10, 1), (10, 11, 1), (11, 12, 1)]
+    try:
+        ir, aps, words = assembler.build_program(source, filename='testbench')
+    except AssemblerError as e:
+        print_exception(e)
+        print('FAILED: Exception thrown')
+        exit(-1)
+
+    analysis = CycleAnalysis(ir, aps.get_symbol_table(), get_instruction_set(), get_cycle_model(), CONTROL_FLOW_OPCODES, PC_RELATIVE_OPCODES)
+    blocks = [(block.start, block.end, block.cycles) for block in analysis.blocks]
+    if blocks != expected_blocks:
+        print('FAILED: Test \'{}\': expected blocks = {}, actual = {}'.format(test_name, expected_blocks, blocks))
+        exit(-1)
+    loops = [(loop.header, loop.blocks, loop.iteration_cycles) for loop in analysis.loops]
+    if loops != [(1, [1, 2, 3, 4], 19)]:
+        print('FAILED: Test \'{}\': expected loops = {}, actual = {}'.format(test_name, [(1, [1, 2, 3, 4], 19)], loops))
+        exit(-1)
+    paths = [analysis.worst_path('START', 'DONE'), analysis.worst_path('START', 'SKIP'), analysis.worst_path('DONE', 'LOOP')]
+    expected_paths = [([0, 1, 5], 15, [1]), ([0, 1, 2, 4], 18, [1]), None]
+    paths = [(path.blocks, path.cycles, path.loops) if path else None for path in paths]
+    if paths != expected_paths:
+        print('FAILED: Test \'{}\': expected paths = {}, actual = {}'.format(test_name, expected_paths, paths))
+        exit(-1)
+
+    # Overriding the cost table
+    model = get_cycle_model().updated({'costs': {'vdot': 1}, 'taken_penalty': 0}, list(get_instruction_set().keys()))
+    analysis = CycleAnalysis(ir, aps.get_symbol_table(), get_instruction_set(), model, CONTROL_FLOW_OPCODES, PC_RELATIVE_OPCODES)
+    if analysis.loops[0].iteration_cycles != 13:
+        print('FAILED: Test \'{}\': expected 13 cycles per iteration, actual = {}'.format(test_name, analysis.loops[0].iteration_cycles))
+        exit(-1)
+
+    print('PASSED: Test \'{}\''.format(test_name))
+
+def run_simulator_test(test_name:str, assembler: CustomAssembler):
+    # Dot product of the two vectors at VEC (address 18), a counted loop and a call through JALR
+    source = ['START:', 'LBI $1, #0', 'SLBI $1, #18', 'VLD $2, $1, #0', 'VLD $3, $1, #4', 'VDOT $2, $3, #0', 'LBI $4, #3',
+              'LOOP:', 'ADDI $5, $5, #3', 'SUBI $4, $4, #1', 'SUB $4, $4, $0', 'BEQZ $4, DONE', 'J LOOP',
+              'DONE:', 'LBI $6, #0', 'SLBI $6, #16', 'JALR $6, #0', 'ST $2, $1, #8', 'HALT',
+              'SUBR:', 'SLE $0, $2, $5', 'JR $7, #0',
+              '.segment DATA', 'VEC:', '.word 1, 2, 3, 4', '.word 5, 6, 7, -8', '.word 0']
+    try:
+        words = assembler.assemble_lines(source, filename='testbench', as_words=True)
+    except AssemblerError as e:
+        print_exception(e)
+        print('FAILED: Exception thrown')
+        exit(-1)
+
+    simulator = CustomSimulator()
+    simulator.load(words)
+    result = simulator.run(max_instructions=1000, counters=True)
+    # 27 instructions, 9 extra cycles for VLD/VDOT and 5 taken branches/jumps (2 cycles each)
+    actual = (result.halted, result.pc, result.instructions, result.cycles, result.taken, simulator.registers, simulator.memory[26])
+    expected = (True, 15, 27, 46, 5, [1, 18, 6, 0, 0, 9, 16, 14], 6)
+    if actual != expected:
+        print('FAILED: Test \'{}\': expected = {}, actual = {}'.format(test_name, expected, actual))
+        exit(-1)
+    if result.hot_spots(2) != [(6, 3), (7, 3)]:
+        print('FAILED: Test \'{}\': expected hot spots = {}, actual = {}'.format(test_name, [(6, 3), (7, 3)], result.hot_spots(2)))
+        exit(-1)
+
+    # Running out of instructions, and running past the end of the program
+    simulator.load(words)
+    result = simulator.run(max_instructions=10)
+    if (result.halted, result.instructions, result.pc) != (False, 10, 10):
+        print('FAILED: Test \'{}\': expected to stop at 0x000a, actual = {}'.format(test_name, result))
+        exit(-1)
+    simulator.load(assembler.assemble_lines(['NOP'], filename='testbench', as_words=True))
+    try:
+        simulator.run()
+    except SimulationError as e:
+        if e.pc != 1:
+            print('FAILED: Test \'{}\': expected the error at 0x0001, actual = 0x{:04x}'.format(test_name, e.pc))
+            exit(-1)
+    else:
+        print('FAILED: Test \'{}\': expected an error'.format(test_name))
+        exit(-1)
+
+    print('PASSED: Test \'{}\''.format(test_name))
+
+def run_batch_test(test_name:str, assembler: CustomAssembler):
+    import os, subprocess, sys, tempfile
+    from assembler.batch import BatchJob, run_job
+    from assembler.writers import IMAGE_WRITERS
+    extension = IMAGE_WRITERS['binary'].EXTENSION
+    sources = { 'a.asm': ['START:', 'ADDI $1, $1, #1', 'J START'], 'b.asm': ['NOP', 'HALT'], 'c.asm': ['NOP', 'ADDI $1, $9, #0'] }
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        src_dir, out_dir = os.path.join(tmp_dir, 'src'), os.path.join(tmp_dir, 'out')
+        os.mkdir(src_dir)
+        os.mkdir(out_dir)
+        for name, lines in sources.items():
+            with open(os.path.join(src_dir, name), 'w') as src_file:
+                src_file.write('\n'.join(lines) + '\n')
+        missing = os.path.join(tmp_dir, 'missing.asm')
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'assemble.py')
+        run = subprocess.run([sys.executable, script, os.path.join(src_dir, '*.asm'), missing, '-o', out_dir, '-j', '2'], capture_output=True, text=True)
+        # Every file is attempted and reported in input order (the glob sorted), with the failures counted
+        reports = [line.split(':')[0] for line in run.stdout.splitlines() if line.startswith(('SUCCESS', 'FAILED'))]
+        if run.returncode == 0 or reports != ['SUCCESS', 'SUCCESS', 'FAILED'] or 'FAILED: 2 of 4 file(s) failed to assemble' not in run.stdout or \
+           run.stdout.find('a' + extension) > run.stdout.find('b' + extension) or run.stdout.find('c.asm:2') > run.stdout.find('missing.asm'):
+            print('FAILED: Test \'{}\': unexpected report (exit code {}):\n{}{}'.format(test_name, run.returncode, run.stdout, run.stderr))
+            exit(-1)
+        for name in ('a', 'b'):
+            expected = assembler.assemble_lines(sources[name + '.asm'], as_words=True)
+            with open(os.path.join(out_dir, name + extension), 'rb') as image_file:
+                if image_file.read() != b''.join(word.to_bytes(2, 'big') for word in expected):
+                    print('FAILED: Test \'{}\': {}{} doesn\'t hold the assembled image'.format(test_name, name, extension))
+                    exit(-1)
+        if os.path.exists(os.path.join(out_dir, 'c' + extension)):
+            print('FAILED: Test \'{}\': an image was written for a file that failed'.format(test_name))
+            exit(-1)
+
+        # Unexpected exceptions fail the job instead of the batch
+        class FailingAssembler(CustomAssembler):
+            def assemble_file(self, *args, **kwargs):
+                raise RuntimeError('boom')
+        result = run_job(FailingAssembler(), BatchJob(os.path.join(src_dir, 'a.asm'), os.path.join(out_dir, 'x' + extension)))
+        if result.success or 'RuntimeError: boom' not in result.output:
+            print('FAILED: Test \'{}\': expected a failed result, actual = {}'.format(test_name, result))
+            exit(-1)
+
+    print('PASSED: Test \'{}\''.format(test_name))
+
+def run_daemon_test(test_name:str, assembler: CustomAssembler):
+    import os, socket, subprocess, sys, tempfile, time
+    from assembler.batch import format_daemon_error
+    from assembler.daemon_client import DaemonClient, encode_frame, recv_exactly, recv_frame
+    from assembler.writers import encode_image
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'assemble.py')
+    far = ['BEQZ $1, FAR'] + ['NOP'] * 200 + ['FAR:', 'HALT']
+
+    def raw_request(socket_path, message):
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.connect(socket_path)
+            sock.sendall(message if isinstance(message, bytes) else encode_frame(message))
+            header = recv_frame(sock)
+            recv_exactly(sock, header.get('image_size', 0) + header.get('listing_size', 0))
+            return header
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        socket_path, busy_path = os.path.join(tmp_dir, 'asm.sock'), os.path.join(tmp_dir, 'busy.sock')
+        servers = [subprocess.Popen([sys.executable, script, '--serve', path, '--workers', '1', '--max-pending', max_pending], stdout=subprocess.DEVNULL)
+                   for path, max_pending in ((socket_path, '8'), (busy_path, '0'))]
+        try:
+            deadline = time.monotonic() + 10
+            while not (os.path.exists(socket_path) and os.path.exists(busy_path)) and time.monotonic() < deadline:
+                time.sleep(0.05)
+            with DaemonClient(socket_path, timeout=10) as client:
+                ok = client.assemble(source='\n'.join(SAMPLE_FILE.splitlines()[:6]), filename='testbench', format='hex')
+                expected = encode_image(assembler.assemble_lines(SAMPLE_FILE.splitlines()[:6], as_words=True), 'hex')
+                error = client.assemble(source='NOP\nADDI $1, $1, #0xZZ', filename='testbench')
+                missing = client.assemble(path=os.path.join(tmp_dir, 'missing.asm'))
+                relaxed, strict = client.assemble(source='\n'.join(far)), client.assemble(source='\n'.join(far), relax=False)
+                alive = client.ping()
+            if not ok.success or ok.image != expected or not alive:
+                print('FAILED: Test \'{}\': expected = {}, actual = {}'.format(test_name, expected, ok))
+                exit(-1)
+            if error.success or (error.errors[0].get('lineno'), error.errors[0].get('column')) != (1, 13):
+                print('FAILED: Test \'{}\': expected a located error, actual = {}'.format(test_name, error))
+                exit(-1)
+            if missing.success or not format_daemon_error(missing.errors[0], 'missing.asm').startswith('missing.asm: ERROR: '):
+                print('FAILED: Test \'{}\': expected an unlocated error, actual = {}'.format(test_name, missing))
+                exit(-1)
+            if not relaxed.success or [branch['symbol'] for branch in relaxed.relaxed] != ['FAR'] or strict.success:
+                print('FAILED: Test \'{}\': expected the branch to be relaxed only by default, actual = {} and {}'.format(test_name, relaxed, strict))
+                exit(-1)
+
+            # Malformed requests are answered instead of dropping the connection
+            for message in (encode_frame([1]), encode_frame({'op': 'assemble', 'source': 5}), encode_frame({'op': 'assemble', 'source': 'NOP', 'byteorder': 'middle'}), b'\0\0\0\2{['):
+                header = raw_request(socket_path, message)
+                if header.get('ok') or not header.get('errors'):
+                    print('FAILED: Test \'{}\': expected an error response to {}, actual = {}'.format(test_name, message, header))
+                    exit(-1)
+            if not raw_request(busy_path, {'op': 'assemble', 'source': 'NOP'}).get('busy'):
+                print('FAILED: Test \'{}\': expected a busy response'.format(test_name))
+                exit(-1)
+        finally:
+            for server in servers:
+                server.terminate()
+                server.wait(10)
+
+    print('PASSED: Test \'{}\''.format(test_name))
+
+def run_stream_test(test_name:str, assembler: CustomAssembler, sources: List[str], error_sources: List[tuple]):
+    import os, tempfile
+    from assembler.writers import write_image, write_image_stream
+
+    def assemble(filepath, stream):
+        try:
+            return list(assembler.assemble_file_stream(filepath)) if stream else list(assembler.assemble_file(filepath, as_words=True))
+        except AssemblerError as e:
+            return (e.args[0], e.filename, e.lineno, e.column, e.at_token, e.line)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        src_path = os.path.join(tmp_dir, 'testbench.asm')
+        for source in sources + [source for source, _ in error_sources]:
+            with open(src_path, 'w') as src_file:
+                src_file.write(source)
+            words, streamed = assemble(src_path, False), assemble(src_path, True)
+            if words != streamed:
+                print('FAILED: Test \'{}\': \'{}\', expected = {}, actual = {}'.format(test_name, source, words, streamed))
+                exit(-1)
+
+        # The streamed image file is the same as the one written in bulk
+        with open(src_path, 'w') as src_file:
+            src_file.write(sources[0])
+        for format in ('binary', 'hex'):
+            bulk_path, stream_path = os.path.join(tmp_dir, 'bulk.' + format), os.path.join(tmp_dir, 'stream.' + format)
+            write_image(bulk_path, assembler.assemble_file(src_path, as_words=True), format)
+            write_image_stream(stream_path, assembler.assemble_file_stream(src_path), format)
+            with open(bulk_path, 'rb') as bulk_file, open(stream_path, 'rb') as stream_file:
+                if bulk_file.read() != stream_file.read():
+                    print('FAILED: Test \'{}\': the streamed {} image differs from the bulk one'.format(test_name, format))
+                    exit(-1)
+
+    print('PASSED: Test \'{}\''.format(test_name))
+
+def run_image_writer_test(test_name:str):
+    import os, tempfile
+    from assembler.writers import ImageWriter, encode_image, write_image
+    words = [0x0000, 0x1234, 0xabcd, 0xffff]
+    expected_images = {
+        ('binary', 'big'):    b'\x00\x00\x12\x34\xab\xcd\xff\xff',
+        ('binary', 'little'): b'\x00\x00\x34\x12\xcd\xab\xff\xff',
+        ('text', 'big'):      b'0000000000000000\n0001001000110100\n1010101111001101\n1111111111111111\n',
+        ('hex', 'big'):       b'0000\n1234\nabcd\nffff\n',
+        ('hex', 'little'):    b'0000\n1234\nabcd\nffff\n', # text formats have no byte order
+    }
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for (format, byteorder), expected in expected_images.items():
+            image = encode_image(words, format, byteorder)
+            image_path = os.path.join(tmp_dir, 'image')
+            write_image(image_path, words, format, byteorder)
+            with open(image_path, 'rb') as image_file:
+                written = image_file.read()
+            if image != expected or written != expected:
+                print('FAILED: Test \'{}\': {} {}, expected = {}, actual = {} and {}'.format(test_name, format, byteorder, expected, image, written))
+                exit(-1)
+
+    # Images larger than a chunk are encoded in several blocks
+    many_words = [(i * 0x9e37) & 0xffff for i in range(ImageWriter.CHUNK_WORDS + 3)]
+    if encode_image(many_words, 'binary', 'little') != b''.join(word.to_bytes(2, 'little') for word in many_words) or \
+       encode_image(many_words, 'hex') != ''.join('{:04x}\n'.format(word) for word in many_words).encode('ascii'):
+        print('FAILED: Test \'{}\': image of {} words'.format(test_name, len(many_words)))
+        exit(-1)
+
+    print('PASSED: Test \'{}\''.format(test_name))
+
+def run_listing_test(test_name:str, assembler: CustomAssembler):
+    import os, subprocess, sys, tempfile
+    from assembler.listing import Listing
+    source = ['; demo', 'START:', 'LBI $1, #5', 'BEQZ $1, START ; loop', '.segment DATA', 'TABLE:', '.word 7, START']
+    expected = ('; demo.asm\n'
+                'ADDR  WORD   LINE  SOURCE\n'
+                '                1  ; demo\n'
+                '                2  START:\n'
+                '0000  c105      3  LBI $1, #5\n'
+                '0001  61fe      4  BEQZ $1, START ; loop\n'
+                '                5  .segment DATA\n'
+                '                6  TABLE:\n'
+                '0002  0007      7  .word 7, START\n')
+    listing = Listing()
+    try:
+        assembler.assemble_lines(source, 'demo.asm', as_words=True, listing=listing)
+    except AssemblerError as e:
+        print_exception(e)
+        print('FAILED: Exception thrown')
+        exit(-1)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        listing_path = os.path.join(tmp_dir, 'demo.lst')
+        listing.write_file(listing_path)
+        with open(listing_path, 'r') as listing_file:
+            actual = listing_file.read()
+        if actual != expected:
+            print('FAILED: Test \'{}\': expected =\n{}actual =\n{}'.format(test_name, expected, actual))
+            exit(-1)
+
+        # -l is a flag, so the input after it is still the input (the listing goes next to the output)
+        os.remove(listing_path)
+        with open(os.path.join(tmp_dir, 'demo.asm'), 'w') as src_file:
+            src_file.write('\n'.join(source) + '\n')
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'assemble.py')
+        for options, written in ((['-l', 'demo.asm'], 'demo.lst'), (['demo.asm', '--listing-file', 'other.lst'], 'other.lst')):
+            run = subprocess.run([sys.executable, script] + options, cwd=tmp_dir, capture_output=True, text=True)
+            if run.returncode != 0 or not os.path.exists(os.path.join(tmp_dir, written)):
+                print('FAILED: Test \'{}\': {} didn\'t write {} (exit code {}):\n{}{}'.format(test_name, ' '.join(options), written, run.returncode, run.stdout, run.stderr))
+                exit(-1)
+            with open(os.path.join(tmp_dir, written), 'r') as listing_file:
+                if listing_file.read() != expected:
+                    print('FAILED: Test \'{}\': {} doesn\'t hold the listing'.format(test_name, written))
+                    exit(-1)
+
+    print('PASSED: Test \'{}\''.format(test_name))
+
+def run_include_test(test_name:str, assembler: CustomAssembler):
+    import os, tempfile
+    from assembler.includes import get_include_cache
+    header = ['.define STEP #2', 'TWICE:', 'ADD $2, $1, $1', 'JR $7, #0', '.segment DATA', 'TABLE:', '.word 1, TWICE', '.segment TEXT']
+    main = ['START:', 'NOP', '.include "defs.inc"', 'LBI $1, STEP', 'BEQZ $1, TWICE', 'J START', '.segment DATA', '.word TABLE']
+    uses_define = ['ADDI $1, $1, SCALE']
+    cache = get_include_cache()
+    cache.clear()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        lib_dir = os.path.join(tmp_dir, 'lib')
+        os.mkdir(lib_dir)
+        sources = { os.path.join(lib_dir, 'defs.inc'): header, os.path.join(tmp_dir, 'main.asm'): main, os.path.join(tmp_dir, 'scaled.inc'): uses_define,
+                    os.path.join(tmp_dir, 'a.inc'): ['.include "b.inc"'], os.path.join(tmp_dir, 'b.inc'): ['NOP', '.include "a.inc"'],
+                    os.path.join(tmp_dir, 'broken.inc'): ['NOP', 'ADDI $1, $9, #0'] }
+        for path, lines in sources.items():
+            with open(path, 'w') as src_file:
+                src_file.write('\n'.join(lines) + '\n')
+        main_path = os.path.join(tmp_dir, 'main.asm')
+        assembler.include_paths = [lib_dir]
+        try:
+            expected = list(assembler.assemble_lines(main[:2] + header + main[3:], as_words=True))
+            runs = [list(assembler.assemble_file(main_path, as_words=True))]
+            included = assembler.included_files
+            runs.append(list(assembler.assemble_file_mapped(main_path, as_words=True)))
+            scaled = [list(assembler.assemble_lines(['.define SCALE #{}'.format(scale), '.include "scaled.inc"'], os.path.join(tmp_dir, 'x.asm'), as_words=True)) for scale in (1, 3)]
+            expected_scaled = [list(assembler.assemble_lines(['ADDI $1, $1, #{}'.format(scale)], as_words=True)) for scale in (1, 3)]
+        except AssemblerError as e:
+            print_exception(e)
+            print('FAILED: Exception thrown')
+            exit(-1)
+        if any(words != expected for words in runs) or scaled != expected_scaled:
+            print('FAILED: Test \'{}\': expected = {} and {}, actual = {} and {}'.format(test_name, expected, expected_scaled, runs, scaled))
+            exit(-1)
+        # The header is lowered once and reused; the file using an including file's define isn't cached
+        if (cache.hits, cache.misses) != (1, 3) or included != [os.path.realpath(os.path.join(lib_dir, 'defs.inc'))]:
+            print('FAILED: Test \'{}\': expected 1 hit and 3 misses, got {} and {}, included {}'.format(test_name, cache.hits, cache.misses, included))
+            exit(-1)
+
+        # Verbose output shows included instructions at their .include line
+        import io
+        from contextlib import redirect_stdout
+        from assembler.listing import VERBOSITY_INFO, VERBOSITY_QUIET
+        out = io.StringIO()
+        assembler.verbosity = VERBOSITY_INFO
+        try:
+            with redirect_stdout(out):
+                words = assembler.assemble_file(main_path, as_words=True)
+        finally:
+            assembler.verbosity = VERBOSITY_QUIET
+        info = out.getvalue().splitlines()
+        if len(info) != len(expected) - 3 or sum(1 for line in info if ':3: INFO: \'.include "defs.inc"' in line) != 2: # 3 data words, 2 included instructions
+            print('FAILED: Test \'{}\': unexpected verbose output:\n{}'.format(test_name, out.getvalue()))
+            exit(-1)
+
+        # Editing the header invalidates it
+        with open(os.path.join(lib_dir, 'defs.inc'), 'w') as src_file:
+            src_file.write('\n'.join(['NOP'] + header) + '\n')
+        if list(assembler.assemble_file(main_path, as_words=True)) != list(assembler.assemble_lines(main[:2] + ['NOP'] + header + main[3:], as_words=True)):
+            print('FAILED: Test \'{}\': the edited header wasn\'t reassembled'.format(test_name))
+            exit(-1)
+
+        # Circular and missing includes, errors inside an included file and modes without .include
+        errors = (('.include "a.inc"', 'b.inc', 1), ('.include "missing.inc"', 'x.asm', 0), ('NOP\n.include "broken.inc"', 'broken.inc', 1))
+        for source, filename, lineno in errors:
+            try:
+                assembler.assemble(source, os.path.join(tmp_dir, 'x.asm'))
+            except AssemblerError as e:
+                if (os.path.basename(e.filename), e.lineno) != (filename, lineno):
+                    print('FAILED: Test \'{}\': expected the error in {} line {}, actual = {} line {}'.format(test_name, filename, lineno, e.filename, e.lineno))
+                    exit(-1)
+            else:
+                print('FAILED: Test \'{}\': expected an error for \'{}\''.format(test_name, source))
+                exit(-1)
+        try:
+            list(assembler.assemble_file_stream(main_path))
+        except AssemblerError:
+            pass
+        else:
+            print('FAILED: Test \'{}\': expected an error when streaming'.format(test_name))
+            exit(-1)
+        assembler.include_paths = []
+
+        # A header is lowered again once a binary file it places changes size
+        blob_path, blob_main_path = os.path.join(tmp_dir, 'blob.bin'), os.path.join(tmp_dir, 'blob.asm')
+        with open(os.path.join(tmp_dir, 'blob.inc'), 'w') as src_file:
+            src_file.write('.segment DATA\n.incbin "blob.bin"\n.segment TEXT\n')
+        with open(blob_main_path, 'w') as src_file:
+            src_file.write('NOP\n.include "blob.inc"\n')
+        for blob in (b'\x12\x34', b'\xab\xcd\xef'):
+            with open(blob_path, 'wb') as blob_file:
+                blob_file.write(blob)
+            try:
+                words = list(assembler.assemble_file(blob_main_path, as_words=True))
+            except AssemblerError as e:
+                print_exception(e)
+                print('FAILED: Exception thrown')
+                exit(-1)
+            if words != [0x0800] + [int.from_bytes(blob[i:i + 2].ljust(2, b'\0'), 'big') for i in range(0, len(blob), 2)]:
+                print('FAILED: Test \'{}\': expected the image to hold {}, actual = {}'.format(test_name, blob, words))
+                exit(-1)
+
+    print('PASSED: Test \'{}\''.format(test_name))
+
+def run_incremental_test(test_name:str, assembler: CustomAssembler):
+    import os, tempfile
+    from assembler.incremental import IncrementalAssembler
+    from assembler.writers import encode_image
+    scenarios = (
+        (['.define K #1', 'START:', 'ADDI $1, $1, K', 'LBI $2, #4', '/*', 'NOP', '*/', 'LOOP:', 'SUBI $2, $2, #1',
+          'BEQZ $2, DONE', 'J LOOP', '.define K #2', 'DONE:', 'ADDI $3, $3, K', 'HALT', '.segment DATA', '.word LOOP, DONE'],
+         ( # (line, new text (None to delete), whether only the edited lines are reassembled)
+            (3, 'LBI $2, #7', True), (8, 'SUBI $2, $2, #2 ; two at a time', True), (9, 'BEQZ $2, START', True), (3, 'LBI $2, #7 ; comment', True),
+            (2, 'ADDI $2, $1, K', False),  # K is redefined after the edit
+            (5, 'HALT', False),            # inside a block comment
+            (10, None, False),             # labels after the edit move
+            (0, '.define K #3', False),    # a define directive
+         )),
+        (['/* disabled', 'HALT', '/* note */ NOP', '; spacer', 'ADDI $1, $1, #1', '/*', 'HALT', '*/', 'NOP'],
+         (
+            (3, None, True),               # the lines after the edit (and their block comments) move up
+            (7, 'HALT', True),
+            (2, 'NOP // note', False),     # closes a block comment opened before the edit
+         )),
+    )
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        src_path, output_path = os.path.join(tmp_dir, 'testbench.asm'), os.path.join(tmp_dir, 'testbench.hex')
+        for source, edits in scenarios:
+            source = list(source)
+            with open(src_path, 'w') as src_file:
+                src_file.write('\n'.join(source) + '\n')
+            watcher = IncrementalAssembler(assembler, src_path, output_path, 'hex')
+            try:
+                watcher.build()
+                for lineno, text, incremental in edits:
+                    old_words = list(watcher.words)
+                    if text is None:
+                        del source[lineno]
+                    else:
+                        source[lineno] = text
+                    with open(src_path, 'w') as src_file:
+                        src_file.write('\n'.join(source) + '\n')
+                    build = watcher.build()
+                    expected = assembler.assemble_lines(source, src_path, as_words=True)
+                    with open(output_path, 'rb') as output_file:
+                        image = output_file.read()
+                    changed = [index for start, end in build.changed for index in range(start, end)]
+                    expected_changed = [index for index, word in enumerate(expected) if index >= len(old_words) or old_words[index] != word]
+                    if (list(watcher.words), build.incremental, image) != (list(expected), incremental, encode_image(expected, 'hex')) or (build.incremental and changed != expected_changed):
+                        print('FAILED: Test \'{}\': after editing line {} expected = {} (incremental {}, changed {}), actual = {} (incremental {}, changed {})'.format(
+                            test_name, lineno + 1, list(expected), incremental, expected_changed, list(watcher.words), build.incremental, changed))
+                        exit(-1)
+            except AssemblerError as e:
+                print_exception(e)
+                print('FAILED: Exception thrown')
+                exit(-1)
+
+    print('PASSED: Test \'{}\''.format(test_name))
+
 if __name__ == '__main__':
     assembler = CustomAssembler()
 
@@ -162,6 +991,9 @@ if __name__ == '__main__':
     instrs, expected_outputs = list(VALID_INSTRUCTIONS.keys()), list(VALID_INSTRUCTIONS.values())
     run_test('Valid Instructions', assembler, instrs, expected_outputs)
 
+    # Test 1b: Assemble every instruction to integer words
+    run_words_test('Valid Instructions (words)', assembler, instrs, expected_outputs)
+
     # Test 2: Assemble with line comments
     instrs, expected_outputs = LINE_COMMENTS.splitlines(), LINE_COMMENTS_EXPECTED
     run_test('Line Comments', assembler, instrs, expected_outputs)
@@ -170,6 +1002,68 @@ if __name__ == '__main__':
     instrs, expected_outputs = BLOCK_COMMENTS.splitlines(), BLOCK_COMMENTS_EXPECTED
     run_test('Block Comments', assembler, instrs, expected_outputs)
 
+    # Test 4: Assemble with define substitutions
+    instrs, expected_outputs = DEFINES.splitlines(), DEFINES_EXPECTED
+    run_test('Defines', assembler, instrs, expected_outputs)
+
+    # Test 4b: Assemble twice through the build cache
+    run_cache_test('Build Cache', assembler, DEFINES, DEFINES_EXPECTED)
+
+    # Test 4c: Errors point at the line and column of the offending token
+    run_error_test('Error Locations', assembler, ERROR_LOCATIONS)
+
+    # Test 4d: Disassemble and reassemble every instruction, and a program with labels
+    run_disassembler_test('Disassembler (instructions)', assembler, list(VALID_INSTRUCTIONS.keys()))
+    run_disassembler_test('Disassembler (labels)', assembler, SAMPLE_FILE.splitlines())
+
+    # Test 4e: Profile an assembly and check the hooks are removed afterwards
+    run_profiler_test('Profiler', assembler, SAMPLE_FILE.splitlines())
+
+    # Test 4f: Synthesize pass 2 across worker processes
+    run_parallel_test('Parallel Pass 2', assembler, SAMPLE_FILE.splitlines() * 4)
+
+    # Test 4g: Preprocess and lower chunks of the source across worker processes
+    run_parallel_pass1_test('Parallel Pass 1', assembler, SAMPLE_FILE.splitlines() * 4)
+
+    # Test 4h: Assemble a memory mapped source, decoding only the lines that hold code
+    run_mapped_test('Memory Mapped Source', assembler, SAMPLE_FILE + '\n/* unterminated\nADD $0, $1, $2\n', ERROR_LOCATIONS)
+
+    # Test 4i: Place data in the DATA segment with .word, .fill and .incbin
+    run_data_test('Data Segment', assembler)
+
+    # Test 4j: Remove redundant instructions with the peephole optimizer
+    run_peephole_test('Peephole Optimizer', assembler)
+
+    # Test 4k: Rewrite branches whose label is out of range around a jump, until they all fit
+    run_relaxation_test('Branch Relaxation', assembler)
+
+    # Test 4l: Estimate cycles per basic block, per loop iteration and along the worst path between labels
+    run_cycle_analysis_test('Cycle Analysis', assembler)
+
+    # Test 4m: Run a program in the simulator
+    run_simulator_test('Simulator', assembler)
+
+    # Test 4n: Include source files, searching the include paths, through the per process include cache
+    run_include_test('Includes', assembler)
+
+    # Test 4o: Reassemble only the edited lines of a watched source, and only rewrite the words that changed
+    run_incremental_test('Incremental Reassembly', assembler)
+
+    # Test 4p: Assemble several inputs (and a glob) across worker processes, reporting every file in order
+    run_batch_test('Batch Assembly', assembler)
+
+    # Test 4q: Assemble through a daemon: images, located and unlocated errors, malformed and busy requests
+    run_daemon_test('Daemon Protocol', assembler)
+
+    # Test 4r: Stream both passes and check the words, image files and errors match the in-memory passes
+    run_stream_test('Streaming', assembler, [SAMPLE_FILE, DEFINES, DEFINES + SAMPLE_FILE + '.segment DATA\n.word 1, LOOP_ONE\n'], ERROR_LOCATIONS)
+
+    # Test 4s: Encode images in every format and byte order
+    run_image_writer_test('Image Writers')
+
+    # Test 4t: Write the listing of a small program
+    run_listing_test('Listing', assembler)
+
     # Test 3: Assemble sample file with block/line comments, labels, and directives
     instrs, expected_outputs = SAMPLE_FILE.splitlines(), SAMPLE_FILE_EXPECTED
     run_test('Sample File', assembler, instrs, expected_outputs)